@@ -1,4 +1,4 @@
 # -*- coding: utf-8 -*-
-u"""Aplicativo geral do Gestão Livre."""
+u"""Aplicativo contábil do Gestão Livre."""
 
-default_app_config = 'gestaolivre.apps.geral.apps.GeralAppConfig'
+default_app_config = 'gestaolivre.apps.contabil.apps.ContabilAppConfig'
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+u"""Configurações do aplicativo contábil."""
+
+from django.apps import AppConfig
+
+
+class ContabilAppConfig(AppConfig):
+    u"""Configuração do aplicativo contábil."""
+
+    name = 'gestaolivre.apps.contabil'
+    verbose_name = 'contábil'
@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*-
+u"""Cálculo dos saldos periódicos do plano de contas.
+
+Os lançamentos de um período são somados por conta diretamente no banco de dados e os
+totais são propagados às contas sintéticas usando os intervalos ``lft``/``rght`` da árvore
+MPTT. O número de consultas é constante, independente do tamanho do plano de contas ou
+da quantidade de lançamentos.
+
+Além do cálculo completo, :func:`apply_movements` mantém os saldos gravados de forma
+incremental: cada alteração de débito/crédito é aplicada à conta, às suas ancestrais e
+aos saldos inicial e final de todos os períodos seguintes, como no recálculo. Com
+``CONTABIL_BALANCE_DELTAS`` as variações são apenas inseridas em :class:`BalanceDelta`,
+sem bloquear as linhas de saldo das contas mais movimentadas e das suas ancestrais;
+:func:`compact_balances` as incorpora periodicamente aos saldos gravados e
+:func:`stored_balances` soma aos saldos gravados as variações ainda pendentes.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import TransactionManagementError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
+from django.db.models import Sum
+
+from .models import BalanceDelta
+from .models import EntryItem
+from .models import Period
+from .models import PeriodicBalance
+from .periods import period_index
+from .snapshots import period_snapshot
+from .tree import chart_tree
+
+
+ZERO = Decimal('0.00')
+
+BATCH_SIZE = 1000
+
+COMPACTION_LOCK = 0x62616c
+
+POSTING_LOCK = 0x706f73
+
+RESULT_MEMOS = (
+    'APURAÇÃO RESULTADO 12/2014',
+    'VLR.DISTRIBUIÇÃO DE LUCROS AO SÓCIO SERGIO RAFAEL GARCIA',
+)
+
+
+class Saldo(object):
+    u"""Saldo de uma conta em um período."""
+
+    __slots__ = ('initial_balance', 'debit_value', 'credit_value')
+
+    def __init__(self, initial_balance=ZERO, debit_value=ZERO, credit_value=ZERO):
+        u"""Inicializa o saldo."""
+        self.initial_balance = initial_balance
+        self.debit_value = debit_value
+        self.credit_value = credit_value
+
+    @property
+    def final_balance(self):
+        u"""Saldo final: saldo inicial mais créditos menos débitos."""
+        return self.initial_balance + self.credit_value - self.debit_value
+
+    def __eq__(self, other):
+        u"""Compara dois saldos pelos seus valores."""
+        return (self.initial_balance, self.debit_value, self.credit_value) == \
+            (other.initial_balance, other.debit_value, other.credit_value)
+
+    def __ne__(self, other):
+        u"""Compara dois saldos pelos seus valores."""
+        return not self == other
+
+    def __repr__(self):
+        u"""Representação deste saldo."""
+        return '<Saldo: {0} -{1} +{2} = {3}>'.format(self.initial_balance, self.debit_value,
+                                                     self.credit_value, self.final_balance)
+
+
+class ClosedPeriodError(ValueError):
+    u"""Os saldos gravados de um período fechado não podem ser alterados."""
+
+
+def _chart_with(empresa_id, account_ids):
+    u"""Obtém o plano de contas, conferindo a versão se faltar alguma das contas."""
+    tree = chart_tree(empresa_id)
+    if any(account_id not in tree.nodes for account_id in account_ids):
+        tree = chart_tree(empresa_id, verify=True)
+    return tree
+
+
+def tree_accounts(empresa_id, account_ids=()):
+    u"""Obtém as contas da empresa na ordem da árvore: ``(id, tree_id, lft, rght)``.
+
+    ``account_ids`` são contas que precisam estar presentes, como as dos lançamentos
+    somados; se alguma faltar, a cópia em memória é conferida com o banco.
+    """
+    return _chart_with(empresa_id, account_ids).accounts
+
+
+def roll_up(accounts, totals):
+    u"""Propaga os totais de cada conta para todas as suas ancestrais.
+
+    ``accounts`` deve estar na ordem da árvore (``tree_id``, ``lft``), como retornado por
+    :func:`tree_accounts`, e ``totals`` mapeia o id da conta para ``(débito, crédito)``.
+    Os intervalos aninhados são percorridos com uma pilha: quando uma conta sai da pilha
+    todos os seus descendentes já foram somados a ela, e o total é repassado à conta
+    que fica no topo, que é a sua mãe. Retorna um dicionário com ``[débito, crédito]``
+    para todas as contas.
+    """
+    result = {}
+    stack = []
+
+    def pop():
+        account_id = stack.pop()[0]
+        if stack:
+            parent, child = result[stack[-1][0]], result[account_id]
+            parent[0] += child[0]
+            parent[1] += child[1]
+
+    for account_id, tree_id, lft, rght in accounts:
+        while stack and (stack[-1][1] != tree_id or stack[-1][3] < lft):
+            pop()
+        result[account_id] = list(totals.get(account_id, (ZERO, ZERO)))
+        stack.append((account_id, tree_id, lft, rght))
+    while stack:
+        pop()
+    return result
+
+
+def period_items(period, include_results=True):
+    u"""Obtém os itens de lançamento da empresa dentro do período."""
+    query = Q(empresa_id=period.empresa_id) & \
+        Q(entry__date__gte=period.start_date) & \
+        Q(entry__date__lte=period.end_date)
+    if not include_results:
+        query &= ~Q(entry__memo__in=RESULT_MEMOS)
+    return EntryItem.objects.all_empresas().filter(query)
+
+
+def leaf_totals(items):
+    u"""Soma débitos e créditos dos itens por conta, no banco de dados."""
+    rows = items.order_by().values('account').annotate(debit=Sum('debit_value'), credit=Sum('credit_value'))
+    return dict((row['account'], (row['debit'] or ZERO, row['credit'] or ZERO)) for row in rows)
+
+
+def pending_deltas(empresa_id, period_ids=None, account_ids=None):
+    u"""Soma as variações ainda não compactadas.
+
+    Retorna um dicionário de ``(período, conta)`` para ``[inicial, débito, crédito]``.
+    """
+    deltas = BalanceDelta.objects.all_empresas().filter(empresa_id=empresa_id)
+    if period_ids is not None:
+        deltas = deltas.filter(period__in=list(period_ids))
+    if account_ids is not None:
+        deltas = deltas.filter(account__in=list(account_ids))
+    rows = deltas.order_by().values_list('period', 'account').annotate(
+        Sum('initial_balance'), Sum('debit_value'), Sum('credit_value'))
+    return dict(((period_id, account_id), [initial, debit, credit])
+                for period_id, account_id, initial, debit, credit in rows)
+
+
+def stored_balances(empresa_id, periods, account_ids=None):
+    u"""Saldos gravados dos períodos somados às variações ainda não compactadas.
+
+    Retorna um dicionário de ``(período, conta)`` para :class:`Saldo`. Uma conta com
+    variações pendentes e ainda sem saldo gravado no período parte do saldo final gravado
+    no período anterior, como em :func:`compact_balances`.
+    """
+    period_ids = [period.pk for period in periods]
+    stored = PeriodicBalance.objects.all_empresas().filter(empresa_id=empresa_id, period__in=period_ids)
+    if account_ids is not None:
+        stored = stored.filter(account__in=list(account_ids))
+    result = dict(((period_id, account_id), Saldo(initial, debit, credit)) for period_id, account_id, initial, debit,
+                  credit in stored.values_list('period', 'account', 'initial_balance', 'debit_value', 'credit_value'))
+    if not incremental_balances() or not balance_deltas():
+        return result
+    pending = pending_deltas(empresa_id, account_ids=account_ids)
+    if not pending:
+        return result
+
+    by_period = defaultdict(list)
+    for (period_id, account_id), change in pending.items():
+        by_period[period_id].append((account_id, change))
+    index = period_index(empresa_id)
+    chains = {}
+    for period in periods:
+        for account_id, _ in by_period.get(period.pk, ()):
+            if (period.pk, account_id) in result:
+                continue
+            chain, prior = [], index.previous(period)
+            while prior is not None:
+                chain.append(prior.pk)
+                if (prior.pk, account_id) not in pending:
+                    break
+                prior = index.previous(prior)
+            chains[(period.pk, account_id)] = chain
+    if chains:
+        finals = dict(((period_id, account_id), final) for period_id, account_id, final in
+                      PeriodicBalance.objects.all_empresas().filter(
+                          period__in=set(pk for chain in chains.values() for pk in chain),
+                          account__in=set(account_id for _, account_id in chains)).values_list(
+                              'period', 'account', 'final_balance'))
+        for (period_id, account_id), chain in chains.items():
+            base = next((finals[(pk, account_id)] for pk in chain if (pk, account_id) in finals), ZERO)
+            result[(period_id, account_id)] = Saldo(base, ZERO, ZERO)
+
+    for period_id in period_ids:
+        for account_id, (initial, debit, credit) in by_period.get(period_id, ()):
+            saldo = result[(period_id, account_id)]
+            saldo.initial_balance += initial
+            saldo.debit_value += debit
+            saldo.credit_value += credit
+    return result
+
+
+def opening_balances(period):
+    u"""Obtém os saldos finais do período anterior."""
+    previous = period.previous()
+    if not previous:
+        return {}
+    return dict((account_id, saldo.final_balance)
+                for (_, account_id), saldo in stored_balances(period.empresa_id, [previous]).items())
+
+
+def compute_period(period, include_results=True):
+    u"""Calcula, sem gravar, os saldos de todas as contas da empresa no período.
+
+    Retorna um dicionário do id da conta para :class:`Saldo`.
+    """
+    totals = leaf_totals(period_items(period, include_results))
+    totals = roll_up(tree_accounts(period.empresa_id, totals), totals)
+    opening = opening_balances(period)
+    return dict((account_id, Saldo(opening.get(account_id, ZERO), debit, credit))
+                for account_id, (debit, credit) in totals.items())
+
+
+def _advisory_lock(key, empresa_id, shared=False):
+    function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT {0}(%s, hashtext(%s))'.format(function), [key, str(empresa_id)])
+
+
+def lock_balances(empresa_id):
+    u"""Bloqueia os saldos da empresa para um recálculo, até o fim da transação.
+
+    Espera as compactações e os recálculos da empresa em andamento e os lançamentos que
+    já aplicaram variações (:func:`apply_movements`) e ainda não terminaram; os novos
+    lançamentos esperam o fim da transação. Assim os itens lidos pelo recálculo e as
+    variações apagadas por :func:`write_balances` correspondem aos mesmos lançamentos.
+    """
+    _advisory_lock(COMPACTION_LOCK, empresa_id)
+    _advisory_lock(POSTING_LOCK, empresa_id)
+
+
+def write_balances(empresa_id, balances_by_period):
+    u"""Substitui os saldos gravados dos períodos informados.
+
+    ``balances_by_period`` mapeia cada período para o resultado de :func:`compute_period`.
+    Os saldos antigos são apagados e os novos inseridos em lote, na mesma transação. O
+    cálculo e a gravação devem ocorrer em uma transação com :func:`lock_balances`, como
+    em :func:`calculate_period`. Períodos fechados são recusados com
+    :class:`ClosedPeriodError`: os seus saldos estão na cópia conferida no fechamento.
+    """
+    if _closed_period_ids(balances_by_period):
+        raise ClosedPeriodError('Os saldos de um período fechado não podem ser recalculados; reabra o período.')
+    rows = [PeriodicBalance(empresa_id=empresa_id,
+                            account_id=account_id,
+                            period_id=period.pk,
+                            initial_balance=saldo.initial_balance,
+                            final_balance=saldo.final_balance,
+                            debit_value=saldo.debit_value,
+                            credit_value=saldo.credit_value)
+            for period, balances in balances_by_period.items()
+            for account_id, saldo in balances.items()]
+    period_ids = [p.pk for p in balances_by_period]
+    with transaction.atomic():
+        # O recálculo já inclui as variações pendentes desses períodos.
+        BalanceDelta.objects.all_empresas().filter(period__in=period_ids).delete()
+        PeriodicBalance.objects.all_empresas().filter(period__in=period_ids).delete()
+        PeriodicBalance.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return rows
+
+
+def _closed_period_ids(periods):
+    # Lido do banco sob lock_balances, que também é obtido pelo fechamento.
+    return set(Period.objects.all_empresas().filter(pk__in=[period.pk for period in periods],
+                                                    status=Period.CLOSED).values_list('pk', flat=True))
+
+
+def calculate_period(period, include_results=True):
+    u"""Recalcula e grava os saldos de todas as contas da empresa no período."""
+    with transaction.atomic():
+        lock_balances(period.empresa_id)
+        return write_balances(period.empresa_id, {period: compute_period(period, include_results)})
+
+
+def compute_fiscal_year(fiscal_year, progress=None):
+    u"""Calcula, sem gravar, os saldos de todos os períodos do exercício.
+
+    Os itens do exercício são lidos uma única vez, somados por conta e data, e
+    distribuídos entre os períodos em memória. O saldo inicial de cada período é o saldo
+    final calculado para o período anterior; o do primeiro período vem do exercício
+    anterior. ``progress``, se informado, é chamado com ``(período, índice, total)`` ao
+    fim de cada período. Retorna um dicionário do período para o resultado no formato de
+    :func:`compute_period`.
+    """
+    index = period_index(fiscal_year.empresa_id)
+    periods = index.year(fiscal_year.pk)
+    if not periods:
+        return {}
+    positions = dict((period.pk, position) for position, period in enumerate(periods))
+    items = EntryItem.objects.all_empresas().filter(empresa_id=fiscal_year.empresa_id,
+                                                    entry__date__gte=periods[0].start_date,
+                                                    entry__date__lte=periods[-1].end_date)
+    grouped = [defaultdict(lambda: [ZERO, ZERO]) for _ in periods]
+    for row in items.order_by().values('account', 'entry__date').annotate(debit=Sum('debit_value'),
+                                                                          credit=Sum('credit_value')):
+        period = index.find(row['entry__date'])
+        if period is None or period.pk not in positions:
+            continue
+        totals = grouped[positions[period.pk]][row['account']]
+        totals[0] += row['debit'] or ZERO
+        totals[1] += row['credit'] or ZERO
+
+    accounts = tree_accounts(fiscal_year.empresa_id, set(account_id for totals in grouped for account_id in totals))
+    opening = opening_balances(periods[0])
+    result = {}
+    for position, period in enumerate(periods):
+        balances = dict((account_id, Saldo(opening.get(account_id, ZERO), debit, credit))
+                        for account_id, (debit, credit) in roll_up(accounts, grouped[position]).items())
+        result[period] = balances
+        opening = dict((account_id, saldo.final_balance) for account_id, saldo in balances.items())
+        if progress:
+            progress(period, position + 1, len(periods))
+    return result
+
+
+def calculate_fiscal_year(fiscal_year, progress=None):
+    u"""Recalcula e grava, em uma única transação, os saldos de todo o exercício.
+
+    Os períodos fechados entram no cálculo, como base dos seguintes, mas os seus saldos
+    gravados não são alterados.
+    """
+    with transaction.atomic():
+        lock_balances(fiscal_year.empresa_id)
+        balances = compute_fiscal_year(fiscal_year, progress)
+        closed = _closed_period_ids(balances)
+        return write_balances(fiscal_year.empresa_id, dict((period, values) for period, values in balances.items()
+                                                           if period.pk not in closed))
+
+
+def _period_saldo(account, day, inclusive):
+    index = period_index(account.empresa_id)
+    period = index.find(day)
+    if period is None:
+        return None
+    snapshot = period_snapshot(period)
+    if snapshot is not None and inclusive and day == period.end_date:
+        initial, debit, credit, _ = snapshot.get(account.pk, (ZERO, ZERO, ZERO, ZERO))
+        return Saldo(initial, debit, credit)
+    previous = index.previous(period)
+    opening = None
+    previous_snapshot = period_snapshot(previous) if previous else None
+    if previous_snapshot is not None:
+        opening = previous_snapshot.get(account.pk, (ZERO, ZERO, ZERO, ZERO))[3]
+    elif previous:
+        saldo = stored_balances(account.empresa_id, [previous], [account.pk]).get((previous.pk, account.pk))
+        opening = saldo.final_balance if saldo else None
+    items = EntryItem.objects.all_empresas().filter(empresa_id=account.empresa_id,
+                                                    account__tree_id=account.tree_id,
+                                                    account__lft__gte=account.lft,
+                                                    account__lft__lte=account.rght,
+                                                    entry__date__gte=period.start_date)
+    items = items.filter(entry__date__lte=day) if inclusive else items.filter(entry__date__lt=day)
+    totals = items.aggregate(debit=Sum('debit_value'), credit=Sum('credit_value'))
+    return Saldo(opening or ZERO, totals['debit'] or ZERO, totals['credit'] or ZERO)
+
+
+def balance_at(account, day):
+    u"""Saldo de uma conta, analítica ou sintética, ao fim do dia informado.
+
+    Parte do saldo final do período anterior e soma apenas os itens do período atual até
+    a data, restritos ao intervalo ``lft``/``rght`` da conta. Retorna :class:`Saldo`, com
+    o movimento do período até o dia, ou ``None`` se não houver período para a data.
+    """
+    return _period_saldo(account, day, inclusive=True)
+
+
+def opening_balance(account, day):
+    u"""Saldo da conta no início do dia informado, ou zero se não houver período para a data."""
+    saldo = _period_saldo(account, day, inclusive=False)
+    return saldo.final_balance if saldo else ZERO
+
+
+def incremental_balances():
+    u"""Indica se os saldos devem ser mantidos a cada alteração de lançamento."""
+    return getattr(settings, 'CONTABIL_INCREMENTAL_BALANCES', True)
+
+
+def balance_deltas():
+    u"""Indica se as variações dos saldos são gravadas em :class:`BalanceDelta`, para compactação posterior."""
+    return getattr(settings, 'CONTABIL_BALANCE_DELTAS', True)
+
+
+def ancestors(empresa_id, account_ids):
+    u"""Mapeia cada conta para os ids das suas ancestrais, incluindo ela mesma."""
+    tree = _chart_with(empresa_id, account_ids)
+    return dict((account_id, tree.ancestors(account_id, include_self=True)) for account_id in account_ids)
+
+
+def _ensure_rows(empresa_id, index, keys):
+    u"""Cria, zerados, os saldos que ainda não existem para ``(período, conta)``.
+
+    O saldo inicial de cada linha criada é o saldo final da mesma conta no período
+    anterior, que é lido em uma única consulta.
+    """
+    period_ids = set(period_id for period_id, _ in keys)
+    account_ids = set(account_id for _, account_id in keys)
+    previous = dict((period.pk, index.previous(period)) for period in index.periods if period.pk in period_ids)
+    lookup_ids = period_ids | set(p.pk for p in previous.values() if p)
+    finals = dict(((period_id, account_id), final) for period_id, account_id, final in
+                  PeriodicBalance.objects.all_empresas().filter(period__in=lookup_ids, account__in=account_ids)
+                  .values_list('period', 'account', 'final_balance'))
+    rows = []
+    for period in index.periods:
+        if period.pk not in period_ids:
+            continue
+        prior = previous.get(period.pk)
+        for account_id in account_ids:
+            if (period.pk, account_id) not in keys or (period.pk, account_id) in finals:
+                continue
+            initial = finals.get((prior.pk, account_id), ZERO) if prior else ZERO
+            finals[(period.pk, account_id)] = initial
+            rows.append(PeriodicBalance(empresa_id=empresa_id, account_id=account_id, period_id=period.pk,
+                                        initial_balance=initial, final_balance=initial,
+                                        debit_value=ZERO, credit_value=ZERO))
+    PeriodicBalance.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def update_rows(changes):
+    u"""Soma as variações aos saldos gravados, com um ``UPDATE`` por lote.
+
+    ``changes`` mapeia ``(período, conta)`` para ``[inicial, débito, crédito]``; o saldo
+    final recebe a variação do inicial mais créditos menos débitos.
+    """
+    table = PeriodicBalance._meta.db_table
+    items = list(changes.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), BATCH_SIZE):
+            batch = items[start:start + BATCH_SIZE]
+            values = ', '.join(['(%s::uuid, %s::uuid, %s::numeric, %s::numeric, %s::numeric)'] * len(batch))
+            params = []
+            for (period_id, account_id), (initial, debit, credit) in batch:
+                params.extend([period_id, account_id, initial, debit, credit])
+            cursor.execute(
+                'UPDATE {0} AS pb SET '
+                'initial_balance = pb.initial_balance + v.initial, '
+                'debit_value = pb.debit_value + v.debit, '
+                'credit_value = pb.credit_value + v.credit, '
+                'final_balance = pb.final_balance + v.initial + v.credit - v.debit '
+                'FROM (VALUES {1}) AS v(period_id, account_id, initial, debit, credit) '
+                'WHERE pb.period_id = v.period_id AND pb.account_id = v.account_id'.format(table, values), params)
+
+
+def apply_movements(empresa_id, movements):
+    u"""Aplica variações de débito/crédito aos saldos gravados.
+
+    ``movements`` é uma sequência de ``(conta, data, débito, crédito)``, com valores
+    negativos para estornar um movimento. Cada variação é somada à conta e às suas
+    ancestrais no período da data, e a variação líquida é propagada aos saldos inicial e
+    final de todos os períodos seguintes, inclusive dos exercícios posteriores, cujos saldos
+    iniciais partem dos finais do exercício anterior. Datas fora de qualquer período são
+    ignoradas.
+
+    As variações devem ser aplicadas na mesma transação que grava os itens, para que um
+    recálculo simultâneo (:func:`lock_balances`) veja ambos ou nenhum; fora de uma
+    transação a função levanta ``TransactionManagementError``. ``Entry.save`` e
+    ``EntryItem.save`` abrem essa transação para os sinais que chamam esta função.
+    """
+    if not connection.in_atomic_block:
+        raise TransactionManagementError('As variações dos saldos devem ser aplicadas na transação dos lançamentos.')
+    movements = [m for m in movements if m[2] or m[3]]
+    if not movements:
+        return
+    index = period_index(empresa_id)
+    ancestry = ancestors(empresa_id, set(m[0] for m in movements))
+    changes = defaultdict(lambda: [ZERO, ZERO, ZERO])
+    for account_id, day, debit, credit in movements:
+        period = index.find(day)
+        if period is None:
+            continue
+        later = index.following(period)
+        for ancestor_id in ancestry[account_id]:
+            change = changes[(period.pk, ancestor_id)]
+            change[1] += debit
+            change[2] += credit
+            for following in later:
+                changes[(following.pk, ancestor_id)][0] += credit - debit
+    if not changes:
+        return
+    _advisory_lock(POSTING_LOCK, empresa_id, shared=True)
+    if balance_deltas():
+        BalanceDelta.objects.bulk_create([
+            BalanceDelta(empresa_id=empresa_id, period_id=period_id, account_id=account_id,
+                         initial_balance=initial, debit_value=debit, credit_value=credit)
+            for (period_id, account_id), (initial, debit, credit) in changes.items()], batch_size=BATCH_SIZE)
+        return
+    _ensure_rows(empresa_id, index, changes)
+    update_rows(changes)
+
+
+def compact_balances(empresa_id):
+    u"""Incorpora aos saldos gravados as variações pendentes da empresa.
+
+    As variações são apagadas e somadas na mesma transação, portanto as que forem
+    inseridas durante a compactação ficam para a próxima. Compactações simultâneas da
+    mesma empresa são serializadas. Retorna a quantidade de saldos alterados.
+    """
+    table = BalanceDelta._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        _advisory_lock(COMPACTION_LOCK, empresa_id)
+        cursor.execute(
+            'WITH moved AS (DELETE FROM {0} WHERE empresa_id = %s '
+            'RETURNING period_id, account_id, initial_balance, debit_value, credit_value) '
+            'SELECT period_id, account_id, SUM(initial_balance), SUM(debit_value), SUM(credit_value) '
+            'FROM moved GROUP BY period_id, account_id'.format(table), [empresa_id])
+        changes = dict(((period_id, account_id), [initial, debit, credit])
+                       for period_id, account_id, initial, debit, credit in cursor.fetchall())
+        if changes:
+            _ensure_rows(empresa_id, period_index(empresa_id), changes)
+            update_rows(changes)
+    return len(changes)
+
+
+def verify_period(period, include_results=True):
+    u"""Compara os saldos gravados do período com um recálculo completo.
+
+    Retorna uma lista de ``(conta, gravado, calculado)`` com as divergências; ``gravado``
+    é ``None`` quando o saldo não existe.
+    """
+    expected = compute_period(period, include_results)
+    stored = dict((account_id, saldo) for (_, account_id), saldo in
+                  stored_balances(period.empresa_id, [period]).items())
+    differences = []
+    for account_id, saldo in expected.items():
+        current = stored.get(account_id)
+        if current is None:
+            if saldo != Saldo():
+                differences.append((account_id, None, saldo))
+        elif current != saldo:
+            differences.append((account_id, current, saldo))
+    return differences
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+u"""Carga em lote do plano de contas.
+
+O plano de contas é lido de um arquivo CSV ou JSON identificado pelo código de cada
+conta (formato 9.9.9.99.9999). A conta mãe é deduzida pelo prefixo do código e os campos
+``lft``/``rght``/``level``/``tree_id`` da árvore MPTT são calculados em uma única
+passada, em memória, antes de inserir todas as contas com ``bulk_create``. Assim nenhuma
+inserção desloca os intervalos das demais contas.
+"""
+
+import csv
+import json
+import uuid
+
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Conta
+from .tree import invalidate_chart
+
+
+BATCH_SIZE = 1000
+
+TREE_ID_LOCK = 0x636f6e7461
+
+
+class ChartImportError(ValueError):
+    u"""O plano de contas informado não pode ser carregado."""
+
+    def __init__(self, errors):
+        u"""Inicializa o erro com a lista de mensagens."""
+        super(ChartImportError, self).__init__('; '.join(errors))
+        self.errors = errors
+
+
+def read_chart_csv(lines):
+    u"""Lê as contas de um CSV com as colunas ``codigo``, ``nome``, ``nature`` e ``type``."""
+    return list(csv.DictReader(lines))
+
+
+def read_chart_json(text):
+    u"""Lê as contas de uma lista JSON de objetos com os mesmos campos do CSV."""
+    data = json.loads(text)
+    if not isinstance(data, list):
+        raise ChartImportError(['O arquivo deve conter uma lista de contas.'])
+    return data
+
+
+def parent_code(codigo):
+    u"""Código da conta mãe, ou ``None`` para as contas de primeiro nível."""
+    return codigo.rsplit('.', 1)[0] if '.' in codigo else None
+
+
+def build_chart(empresa_id, rows, first_tree_id):
+    u"""Cria, sem gravar, as contas com os campos da árvore já calculados.
+
+    Cada conta raiz recebe um ``tree_id`` a partir de ``first_tree_id``; as filhas são
+    ordenadas pelo código, como em ``order_insertion_by``. Retorna a lista de contas ou
+    levanta :class:`ChartImportError` com todos os problemas encontrados.
+    """
+    pattern = Conta._meta.get_field('codigo').validators[0].regex
+    natures = dict(Conta.NATUREZA_CHOICES)
+    types = dict(Conta.TIPO_CHOICES)
+    errors = []
+    accounts = {}
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            errors.append('Linha {0}: conta inválida.'.format(number))
+            continue
+        codigo = (row.get('codigo') or '').strip()
+        nome = (row.get('nome') or '').strip()
+        if not pattern.match(codigo):
+            errors.append('Linha {0}: o código deve estar no formato 9.9.9.99.9999: {1}.'.format(number, codigo))
+            continue
+        if codigo in accounts:
+            errors.append('Linha {0}: código repetido: {1}.'.format(number, codigo))
+            continue
+        if not nome or len(nome) > 50:
+            errors.append('Linha {0}: o nome é obrigatório e deve ter até 50 caracteres.'.format(number))
+        nature = row.get('nature') or Conta.CREDITO
+        if nature not in natures:
+            errors.append('Linha {0}: natureza inválida: {1}.'.format(number, nature))
+        accounts[codigo] = Conta(id=uuid.uuid4(), empresa_id=empresa_id, codigo=codigo, nome=nome, nature=nature,
+                                 type=row.get('type') or '')
+
+    children = dict((codigo, []) for codigo in accounts)
+    roots = []
+    for codigo in sorted(accounts):
+        parent = parent_code(codigo)
+        if parent is None:
+            roots.append(codigo)
+        elif parent in accounts:
+            children[parent].append(codigo)
+        else:
+            errors.append('Conta mãe {0} não encontrada para {1}.'.format(parent, codigo))
+    if errors:
+        raise ChartImportError(errors)
+
+    for tree_id, root in enumerate(roots, first_tree_id):
+        counter = 1
+        stack = [(root, None, 0, False)]
+        while stack:
+            codigo, parent, level, closing = stack.pop()
+            account = accounts[codigo]
+            if closing:
+                account.rght = counter
+                counter += 1
+                continue
+            account.tree_id, account.level, account.lft = tree_id, level, counter
+            account.parent_id = parent.pk if parent else None
+            counter += 1
+            stack.append((codigo, parent, level, True))
+            stack.extend((child, account, level + 1, False) for child in reversed(children[codigo]))
+
+    for codigo, account in accounts.items():
+        account.type = account.type or (Conta.ANALITICA if not children[codigo] else Conta.SINTETICA)
+        if account.type not in types:
+            errors.append('Tipo inválido para {0}: {1}.'.format(codigo, account.type))
+        elif account.type == Conta.ANALITICA and account.level < 3:
+            errors.append('A conta analítica {0} deve ser de nível 4 ou maior.'.format(codigo))
+    if errors:
+        raise ChartImportError(errors)
+    return [accounts[codigo] for codigo in sorted(accounts)]
+
+
+def load_chart(empresa_id, rows):
+    u"""Carrega o plano de contas de uma empresa que ainda não tem contas.
+
+    Retorna a quantidade de contas criadas.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [TREE_ID_LOCK])
+        contas = Conta.objects.all_empresas()
+        if contas.filter(empresa_id=empresa_id).exists():
+            raise ChartImportError(['A empresa já possui plano de contas.'])
+        first_tree_id = (contas.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+        accounts = build_chart(empresa_id, rows, first_tree_id)
+        Conta.objects.bulk_create(accounts, batch_size=BATCH_SIZE)
+        invalidate_chart(empresa_id)
+    return len(accounts)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+u"""Fechamento e reabertura de períodos.
+
+Os períodos de uma empresa são fechados em ordem, inclusive entre exercícios, de modo
+que um lançamento em período aberto nunca altera os saldos de um período fechado. No
+fechamento os saldos gravados são conferidos com um recálculo completo e copiados para
+:class:`PeriodSnapshot`, sob o bloqueio dos saldos da empresa, que espera os lançamentos
+em andamento; a partir daí o banco de dados rejeita qualquer alteração nos lançamentos do
+período e os recálculos deixam de gravar os seus saldos.
+"""
+
+from django.db import transaction
+
+from .balances import compact_balances
+from .balances import lock_balances
+from .balances import verify_period
+from .models import Period
+from .models import PeriodSnapshot
+from .snapshots import create_snapshot
+from .snapshots import invalidate_snapshot
+
+
+class ClosingError(ValueError):
+    u"""O período não pode ser fechado ou reaberto."""
+
+
+def _periods(period):
+    return Period.objects.all_empresas().filter(empresa_id=period.empresa_id).order_by('start_date', 'end_date')
+
+
+def _locked(period):
+    # Bloqueia todos os períodos da empresa, serializando fechamentos e reaberturas.
+    periods = list(_periods(period).select_for_update())
+    return next(other for other in periods if other.pk == period.pk)
+
+
+def close_period(period):
+    u"""Fecha o período, gravando a cópia imutável dos seus saldos."""
+    with transaction.atomic():
+        period = _locked(period)
+        if period.status == Period.CLOSED:
+            raise ClosingError('O período já está fechado.')
+        earlier = _periods(period).filter(start_date__lt=period.start_date).exclude(status=Period.CLOSED).first()
+        if earlier:
+            raise ClosingError('Feche antes o período {0}.'.format(earlier))
+        lock_balances(period.empresa_id)
+        compact_balances(period.empresa_id)
+        if verify_period(period):
+            raise ClosingError('Os saldos gravados do período divergem dos lançamentos; '
+                               'execute verify_balances --fix.')
+        create_snapshot(period)
+        period.status = Period.CLOSED
+        period.save()
+    invalidate_snapshot(period)
+    return period
+
+
+def reopen_period(period):
+    u"""Reabre o período, descartando a cópia dos saldos."""
+    with transaction.atomic():
+        period = _locked(period)
+        if period.status != Period.CLOSED:
+            raise ClosingError('O período não está fechado.')
+        later = _periods(period).filter(start_date__gt=period.end_date, status=Period.CLOSED).last()
+        if later:
+            raise ClosingError('Reabra antes o período {0}.'.format(later))
+        PeriodSnapshot.objects.all_empresas().filter(period=period).delete()
+        period.status = Period.OPEN
+        period.save()
+    invalidate_snapshot(period)
+    return period
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+u"""Exportação da Escrituração Contábil Digital (SPED ECD).
+
+O arquivo de um exercício é gerado linha a linha: o plano de contas (I050) vem da cópia
+em memória da árvore de contas, os saldos periódicos (I150/I155) são os saldos gravados
+somados às variações ainda não compactadas, os lançamentos (I200/I250) são lidos com
+cursores do servidor, e os registros de encerramento de blocos
+e do bloco 9 são calculados com as contagens acumuladas durante a geração. Assim a
+memória usada não depende da quantidade de lançamentos do exercício.
+"""
+
+import io
+import re
+from collections import OrderedDict
+
+from sped.ecd.registros import Registro0000
+from sped.ecd.registros import Registro0001
+from sped.ecd.registros import Registro0990
+from sped.ecd.registros import Registro9001
+from sped.ecd.registros import Registro9900
+from sped.ecd.registros import Registro9990
+from sped.ecd.registros import Registro9999
+from sped.ecd.registros import RegistroI001
+from sped.ecd.registros import RegistroI010
+from sped.ecd.registros import RegistroI050
+from sped.ecd.registros import RegistroI150
+from sped.ecd.registros import RegistroI155
+from sped.ecd.registros import RegistroI200
+from sped.ecd.registros import RegistroI250
+from sped.ecd.registros import RegistroI990
+from sped.ecd.registros import RegistroJ001
+from sped.ecd.registros import RegistroJ990
+
+from gestaolivre.apps.utils.db import server_side_rows
+
+from .balances import stored_balances
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+from .models import Period
+from .tree import chart_tree
+
+
+LAYOUT_VERSION = '4.00'
+
+LINE_END = '\r\n'
+
+ENCODING = 'latin-1'
+
+ENTRIES_SQL = '''
+SELECT e.id, e.date, e.value, e.memo, a.codigo, i.debit_value, i.credit_value
+  FROM {entry} e
+  JOIN {item} i ON i.entry_id = e.id
+  JOIN {conta} a ON a.id = i.account_id
+ WHERE e.empresa_id = %s AND e.date >= %s AND e.date <= %s
+ ORDER BY e.date, e.id
+'''
+
+
+def nature_code(codigo):
+    u"""Código de natureza da conta no SPED, pelo grupo do plano de contas."""
+    if codigo.startswith('2.3'):
+        return '03'
+    return {'1': '01', '2': '02'}.get(codigo[0], '04')
+
+
+def _text(value):
+    return (value or '').replace('|', ' ').strip()
+
+
+def _indicator(value):
+    u"""Valor absoluto e indicador de débito ou crédito de um saldo."""
+    return abs(value), 'C' if value >= 0 else 'D'
+
+
+class EcdWriter(object):
+    u"""Formata os registros e mantém as contagens por registro e por bloco."""
+
+    def __init__(self):
+        u"""Inicializa as contagens."""
+        self.counts = OrderedDict()
+        self.block_lines = 0
+
+    def line(self, registro_class, **values):
+        u"""Formata um registro com os valores informados."""
+        registro = registro_class()
+        for name, value in values.items():
+            setattr(registro, name, value)
+        name = registro.valores[1]
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.block_lines += 1
+        return registro.as_line() + LINE_END
+
+    def open_block(self, registro_class, has_data):
+        u"""Abre um bloco, reiniciando a contagem de linhas do bloco."""
+        self.block_lines = 0
+        return self.line(registro_class, IND_DAD='0' if has_data else '1')
+
+    def close_block(self, registro_class, field):
+        u"""Fecha um bloco com a quantidade de linhas dele, incluindo o encerramento."""
+        return self.line(registro_class, **{field: self.block_lines + 1})
+
+    @property
+    def total(self):
+        u"""Quantidade de linhas geradas."""
+        return sum(self.counts.values())
+
+
+def ecd_lines(empresa, fiscal_year):
+    u"""Gera as linhas do arquivo da ECD do exercício da empresa.
+
+    Somente lê o banco, portanto pode ser enviada durante um ``GET``; a compactação das
+    variações pendentes fica com a tarefa ``contabil.ecd`` e o comando ``compact_balances``.
+    """
+    writer = EcdWriter()
+    yield writer.line(Registro0000, DT_INI=fiscal_year.start_date, DT_FIN=fiscal_year.end_date,
+                      NOME=_text(empresa.razao_social), CNPJ=re.sub(r'\D', '', str(empresa.cnpj)),
+                      IND_SIT_INI_PER='0', IND_NIRE='0', IND_FIN_ESC='0', IND_GRANDE_PORTE='0', TIP_ECD='0')
+    yield writer.line(Registro0001, IND_DAD='0')
+    yield writer.line(Registro0990, QTD_LIN_0=writer.total + 1)
+
+    yield writer.open_block(RegistroI001, True)
+    yield writer.line(RegistroI010, IND_ESC='G', COD_VER_LC=LAYOUT_VERSION)
+    tree = chart_tree(empresa.pk)
+    for node in tree.order:
+        codigo_parent = tree.node(node.parent_id).codigo if node.parent_id else ''
+        yield writer.line(RegistroI050, DT_ALT=fiscal_year.start_date, COD_NAT=nature_code(node.codigo),
+                          IND_CTA='A' if node.is_leaf else 'S', NIVEL=node.level + 1, COD_CTA=node.codigo,
+                          COD_CTA_SUP=codigo_parent, CTA=_text(node.nome))
+
+    periods = list(Period.objects.all_empresas().filter(empresa_id=empresa.pk, year_id=fiscal_year.pk,
+                                                        type=Period.STANDARD).order_by('start_date'))
+    leaves = sorted((node.codigo, node.id) for node in tree.order if node.is_leaf)
+    balances = stored_balances(empresa.pk, periods, [account_id for _, account_id in leaves])
+    for period in periods:
+        opened = False
+        for codigo, account_id in leaves:
+            saldo = balances.get((period.pk, account_id))
+            if saldo is None or not (saldo.initial_balance or saldo.debit_value or saldo.credit_value or
+                                     saldo.final_balance):
+                continue
+            if not opened:
+                opened = True
+                yield writer.line(RegistroI150, DT_INI=period.start_date, DT_FIN=period.end_date)
+            initial, initial_dc = _indicator(saldo.initial_balance)
+            final, final_dc = _indicator(saldo.final_balance)
+            yield writer.line(RegistroI155, COD_CTA=codigo, VL_SLD_INI=initial, IND_DC_INI=initial_dc,
+                              VL_DEB=saldo.debit_value, VL_CRED=saldo.credit_value, VL_SLD_FIN=final,
+                              IND_DC_FIN=final_dc)
+
+    entries = ENTRIES_SQL.format(entry=Entry._meta.db_table, item=EntryItem._meta.db_table,
+                                 conta=Conta._meta.db_table)
+    current = None
+    for entry_id, day, value, memo, codigo, debit, credit in server_side_rows(
+            entries, [empresa.pk, fiscal_year.start_date, fiscal_year.end_date]):
+        if entry_id != current:
+            current = entry_id
+            yield writer.line(RegistroI200, NUM_LCTO=str(entry_id), DT_LCTO=day, VL_LCTO=value, IND_LCTO='N')
+        yield writer.line(RegistroI250, COD_CTA=codigo, VL_DC=debit or credit, IND_DC='D' if debit else 'C',
+                          HIST=_text(memo))
+    yield writer.close_block(RegistroI990, 'QTD_LIN_I')
+
+    yield writer.open_block(RegistroJ001, False)
+    yield writer.close_block(RegistroJ990, 'QTD_LIN_J')
+
+    yield writer.open_block(Registro9001, True)
+    counts = list(writer.counts.items()) + [('9900', None), ('9990', 1), ('9999', 1)]
+    lines_9900 = len(counts)
+    for name, count in counts:
+        yield writer.line(Registro9900, REG_BLC=name, QTD_REG_BLC=lines_9900 if name == '9900' else count)
+    # O total do bloco 9 inclui o 9990 e o 9999.
+    yield writer.line(Registro9990, QTD_LIN_9=writer.block_lines + 2)
+    yield writer.line(Registro9999, QTD_LIN=writer.total + 1)
+
+
+def encoded_lines(empresa, fiscal_year):
+    u"""Gera as linhas da ECD codificadas em Latin-1, como esperado pelo validador."""
+    for line in ecd_lines(empresa, fiscal_year):
+        yield line.encode(ENCODING, 'replace')
+
+
+def export_ecd(empresa, fiscal_year, path):
+    u"""Grava o arquivo da ECD do exercício em ``path``, retornando a quantidade de linhas."""
+    lines = 0
+    with io.open(path, 'wb') as output:
+        for line in encoded_lines(empresa, fiscal_year):
+            output.write(line)
+            lines += 1
+    return lines
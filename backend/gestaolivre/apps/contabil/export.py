@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+u"""Exportação tabular da contabilidade para ferramentas de BI.
+
+Os conjuntos de dados (contas, períodos e partidas dos lançamentos, já unidas ao
+lançamento e à conta) são lidos com SQL direto, sem instanciar modelos: em arquivo, com
+``COPY ... TO STDOUT``; em resposta HTTP, com cursor do servidor; em Parquet, em blocos
+de linhas gravados como *row groups*, um arquivo por exercício. Com ``since`` somente as
+linhas alteradas depois dessa marca são exportadas, e cada exportação informa a marca a
+usar na próxima.
+"""
+
+import csv
+import io
+import os
+from collections import namedtuple
+
+from django.db import connection
+
+from gestaolivre.apps.utils.db import server_side_rows
+
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+from .models import FiscalYear
+from .models import Period
+
+
+BATCH_ROWS = 50000
+
+CSV_FLUSH_ROWS = 1000
+
+Dataset = namedtuple('Dataset', 'name columns sql since')
+
+ACCOUNTS = Dataset('accounts', (
+    ('id', 'string'), ('codigo', 'string'), ('nome', 'string'), ('nature', 'string'), ('type', 'string'),
+    ('level', 'int'), ('parent', 'string'), ('modified', 'timestamp'),
+), '''
+SELECT a.id::text, a.codigo, a.nome, a.nature, a.type, a.level, p.codigo, a.modified
+  FROM {conta} a
+  LEFT JOIN {conta} p ON p.id = a.parent_id
+ WHERE a.empresa_id = %s {since}
+ ORDER BY a.codigo
+''', 'AND a.modified > %s')
+
+PERIODS = Dataset('periods', (
+    ('id', 'string'), ('fiscal_year', 'int'), ('start_date', 'date'), ('end_date', 'date'), ('status', 'string'),
+    ('type', 'string'), ('modified', 'timestamp'),
+), '''
+SELECT p.id::text, y.year, p.start_date, p.end_date, p.status, p.type, p.modified
+  FROM {period} p
+  JOIN {year} y ON y.id = p.year_id
+ WHERE p.empresa_id = %s {since}
+ ORDER BY p.start_date, p.end_date
+''', 'AND p.modified > %s')
+
+ENTRIES = Dataset('entries', (
+    ('item_id', 'string'), ('entry_id', 'string'), ('fiscal_year', 'int'), ('date', 'date'), ('memo', 'string'),
+    ('status', 'string'), ('account', 'string'), ('account_name', 'string'), ('debit_value', 'decimal'),
+    ('credit_value', 'decimal'), ('modified', 'timestamp'),
+), '''
+SELECT i.id::text, e.id::text, %s, e.date, e.memo, e.status, a.codigo, a.nome, i.debit_value, i.credit_value,
+       GREATEST(e.modified, i.modified)
+  FROM {entry} e
+  JOIN {item} i ON i.entry_id = e.id
+  JOIN {conta} a ON a.id = i.account_id
+ WHERE e.empresa_id = %s AND e.date >= %s AND e.date <= %s {since}
+ ORDER BY e.date, e.id, i.id
+''', 'AND (e.modified > %s OR i.modified > %s)')
+
+DATASETS = dict((dataset.name, dataset) for dataset in (ACCOUNTS, PERIODS, ENTRIES))
+
+WATERMARK_SQL = '''
+SELECT LEAST(now(), MIN(xact_start))
+  FROM pg_stat_activity
+ WHERE datname = current_database() AND pid <> pg_backend_pid()
+'''
+
+
+class ExportError(ValueError):
+    u"""A exportação pedida não pode ser feita."""
+
+
+def watermark():
+    u"""Marca a usar como ``since`` na próxima exportação.
+
+    É o início da transação mais antiga em andamento no banco (ou o momento atual), de
+    modo que alterações ainda não confirmadas durante esta exportação serão incluídas na
+    próxima. As linhas são identificadas pelo id, e a sobreposição entre exportações é
+    resolvida por quem as consome.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(WATERMARK_SQL)
+        return cursor.fetchone()[0]
+
+
+def queries(empresa_id, dataset, since=None):
+    u"""Gera ``(exercício, sql, parâmetros)`` das consultas do conjunto de dados.
+
+    As partidas são consultadas por exercício; os demais conjuntos têm uma consulta só,
+    com exercício ``None``.
+    """
+    since_params = [since] * dataset.since.count('%s') if since is not None else []
+    sql = dataset.sql.format(conta=Conta._meta.db_table, period=Period._meta.db_table,
+                             year=FiscalYear._meta.db_table, entry=Entry._meta.db_table,
+                             item=EntryItem._meta.db_table, since=dataset.since if since is not None else '')
+    if dataset is not ENTRIES:
+        yield None, sql, [empresa_id] + since_params
+        return
+    for year, start, end in FiscalYear.objects.all_empresas().filter(empresa_id=empresa_id).order_by(
+            'start_date').values_list('year', 'start_date', 'end_date'):
+        yield year, sql, [year, empresa_id, start, end] + since_params
+
+
+def csv_chunks(empresa_id, dataset, since=None):
+    u"""Gera o CSV do conjunto de dados em blocos de texto, com memória constante."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in dataset.columns])
+    rows = 0
+    for _, sql, params in queries(empresa_id, dataset, since):
+        for row in server_side_rows(sql, params):
+            writer.writerow(row)
+            rows += 1
+            if rows % CSV_FLUSH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
+
+
+def copy_csv(empresa_id, dataset, path, since=None):
+    u"""Grava o CSV do conjunto de dados em ``path`` com ``COPY ... TO STDOUT``."""
+    with connection.cursor() as cursor, io.open(path, 'w', encoding='utf-8', newline='') as output:
+        first = True
+        for _, sql, params in queries(empresa_id, dataset, since):
+            query = cursor.mogrify(sql, params).decode('utf-8')
+            cursor.copy_expert('COPY ({0}) TO STDOUT WITH CSV{1}'.format(query, ' HEADER' if first else ''), output)
+            first = False
+        if first:
+            output.write(','.join(name for name, _ in dataset.columns) + '\n')
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError('A exportação em Parquet requer o pacote pyarrow.')
+    return pyarrow, pyarrow.parquet
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_parquet(empresa_id, dataset, directory, since=None):
+    u"""Grava o conjunto de dados em Parquet, um arquivo por exercício para as partidas.
+
+    Retorna a lista de arquivos gravados.
+    """
+    pa, pq = _arrow()
+    types = {'string': pa.string(), 'int': pa.int32(), 'date': pa.date32(), 'decimal': pa.decimal128(12, 2),
+             'timestamp': pa.timestamp('us', tz='UTC')}
+    schema = pa.schema([(name, types[kind]) for name, kind in dataset.columns])
+    paths = []
+    for year, sql, params in queries(empresa_id, dataset, since):
+        if year is None:
+            path = os.path.join(directory, '{0}.parquet'.format(dataset.name))
+        else:
+            path = os.path.join(directory, dataset.name, 'fiscal_year={0}'.format(year), 'part-0.parquet')
+        writer = None
+        for batch in _batches(server_side_rows(sql, params), BATCH_ROWS):
+            arrays = [pa.array(list(column), type=field.type) for column, field in zip(zip(*batch), schema)]
+            if writer is None:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        if writer is not None:
+            writer.close()
+            paths.append(path)
+    return paths
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+u"""Importação em lote de lançamentos contábeis.
+
+Os lançamentos são lidos de arquivos JSON Lines (um lançamento por linha, com a lista de
+itens) ou CSV (um item por linha, agrupados pela coluna ``entry``). As validações de
+partidas dobradas, de débito/crédito dos itens e de período aberto são feitas em memória,
+contra índices de contas e períodos montados uma única vez por lote, e os lançamentos
+válidos são inseridos com ``bulk_create`` em transações por bloco. Como os blocos são
+gravados à medida que o arquivo é lido, a codificação é conferida antes
+(:func:`check_utf8`), e cada lançamento é validado por completo em :meth:`EntryImporter.build`.
+"""
+
+import codecs
+import csv
+import json
+from decimal import Decimal
+from decimal import InvalidOperation
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from .balances import apply_movements
+from .balances import incremental_balances
+from .models import Entry
+from .models import EntryItem
+from .periods import period_index
+from .tree import chart_tree
+
+
+CHUNK_SIZE = 1000
+
+MAX_VALUE = Decimal('9999999999.99')
+
+CENTS = Decimal('0.01')
+
+READ_SIZE = 64 * 1024
+
+
+class ImportResult(object):
+    u"""Resultado de uma importação: quantidade gravada e erros por linha."""
+
+    def __init__(self):
+        u"""Inicializa um resultado vazio."""
+        self.created = 0
+        self.errors = []
+
+    def as_dict(self):
+        u"""Representa o resultado em tipos serializáveis."""
+        return {'created': self.created, 'errors': [{'row': row, 'errors': errors} for row, errors in self.errors]}
+
+
+def check_utf8(stream, read_size=READ_SIZE):
+    u"""Confere se o arquivo binário ``stream`` está em UTF-8 e volta ao seu início.
+
+    Levanta ``UnicodeDecodeError`` antes que qualquer bloco de lançamentos seja gravado.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in iter(lambda: stream.read(read_size), b''):
+        decoder.decode(chunk)
+    decoder.decode(b'', final=True)
+    stream.seek(0)
+
+
+def read_jsonl(lines):
+    u"""Lê lançamentos de linhas JSON, gerando ``(número da linha, lançamento)``."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def read_csv(lines):
+    u"""Lê itens CSV agrupando as linhas consecutivas com o mesmo valor em ``entry``."""
+    current, first = None, None
+    for number, row in enumerate(csv.DictReader(lines), 2):
+        key = row.get('entry')
+        if current is not None and key == current['key']:
+            current['items'].append(row)
+            continue
+        if current is not None:
+            yield first, current
+        current, first = {'key': key, 'date': row.get('date'), 'memo': row.get('memo'), 'items': [row]}, number
+    if current is not None:
+        yield first, current
+
+
+def _amount(value, errors, name):
+    if value in (None, ''):
+        return Decimal(0)
+    try:
+        amount = Decimal(str(value)) if isinstance(value, (str, int, float)) else None
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        errors.append('Valor de {0} inválido: {1}.'.format(name, value))
+        return Decimal(0)
+    if amount < 0 or amount > MAX_VALUE or amount != amount.quantize(CENTS):
+        errors.append('Valor de {0} fora do intervalo ou com mais de duas casas: {1}.'.format(name, value))
+    return amount
+
+
+class EntryImporter(object):
+    u"""Valida e grava lançamentos de uma empresa em lote."""
+
+    def __init__(self, empresa_id, status=Entry.DRAFT, chunk_size=CHUNK_SIZE):
+        u"""Monta os índices de contas analíticas e de períodos abertos da empresa."""
+        self.empresa_id = empresa_id
+        self.status = status
+        self.chunk_size = chunk_size
+        self.periods = period_index(empresa_id)
+        self.accounts = dict((node.codigo, node.id) for node in chart_tree(empresa_id, verify=True).order
+                             if node.is_leaf)
+
+    def build(self, data):
+        u"""Valida um lançamento lido e cria os objetos, ainda sem gravar.
+
+        Retorna ``(lançamento, itens, erros)``.
+        """
+        if not isinstance(data, dict):
+            return None, [], ['Lançamento inválido.']
+        errors = []
+        day = None
+        try:
+            day = parse_date(str(data.get('date') or ''))
+        except ValueError:
+            pass
+        if day is None:
+            errors.append('Data inválida: {0}.'.format(data.get('date')))
+        elif not self.periods.is_open(day):
+            errors.append('Não há período aberto para {0}.'.format(day))
+        memo = data.get('memo') or ''
+        if not isinstance(memo, str) or not memo or len(memo) > 150:
+            errors.append('O histórico é obrigatório e deve ter até 150 caracteres.')
+            memo = ''
+
+        entry = Entry(empresa_id=self.empresa_id, date=day, memo=memo, status=self.status)
+        items, debit_total, credit_total = [], Decimal(0), Decimal(0)
+        raw_items = data.get('items') or []
+        if not isinstance(raw_items, list):
+            errors.append('Os itens devem ser uma lista.')
+            raw_items = []
+        elif len(raw_items) < 2:
+            errors.append('O lançamento deve ter ao menos dois itens.')
+        for position, raw in enumerate(raw_items, 1):
+            if not isinstance(raw, dict):
+                errors.append('Item {0}: inválido.'.format(position))
+                continue
+            item_errors = []
+            debit = _amount(raw.get('debit'), item_errors, 'débito')
+            credit = _amount(raw.get('credit'), item_errors, 'crédito')
+            if debit > 0 and credit > 0:
+                item_errors.append('Informe somente débito ou crédito, não ambos.')
+            elif debit == 0 and credit == 0:
+                item_errors.append('Informe o débito ou o crédito.')
+            codigo = raw.get('account')
+            account_id = self.accounts.get(codigo) if isinstance(codigo, str) else None
+            if account_id is None:
+                item_errors.append('Conta analítica não encontrada: {0}.'.format(raw.get('account')))
+            errors.extend('Item {0}: {1}'.format(position, error) for error in item_errors)
+            debit_total += debit
+            credit_total += credit
+            items.append(EntryItem(empresa_id=self.empresa_id, entry=entry, account_id=account_id,
+                                   debit_value=debit, credit_value=credit))
+        if debit_total != credit_total:
+            errors.append('Débitos ({0}) e créditos ({1}) não conferem.'.format(debit_total, credit_total))
+        elif debit_total > MAX_VALUE:
+            errors.append('O total do lançamento excede {0}.'.format(MAX_VALUE))
+        entry.value = debit_total
+        return entry, items, errors
+
+    def save(self, chunk):
+        u"""Grava um bloco de lançamentos válidos em uma única transação."""
+        entries = [entry for entry, _ in chunk]
+        items = [item for _, entry_items in chunk for item in entry_items]
+        with transaction.atomic():
+            Entry.objects.bulk_create(entries, batch_size=CHUNK_SIZE)
+            EntryItem.objects.bulk_create(items, batch_size=CHUNK_SIZE)
+            if incremental_balances():
+                apply_movements(self.empresa_id, [(item.account_id, item.entry.date, item.debit_value,
+                                                   item.credit_value) for item in items])
+        return len(entries)
+
+    def run(self, rows):
+        u"""Importa os lançamentos de ``rows``, pares ``(linha, dados)``.
+
+        Lançamentos com erro são ignorados e relatados; os demais são gravados em blocos
+        de ``chunk_size``. Retorna :class:`ImportResult`.
+        """
+        result = ImportResult()
+        chunk = []
+        for number, data in rows:
+            entry, items, errors = self.build(data)
+            if errors:
+                result.errors.append((number, errors))
+                continue
+            chunk.append((entry, items))
+            if len(chunk) >= self.chunk_size:
+                result.created += self.save(chunk)
+                chunk = []
+        if chunk:
+            result.created += self.save(chunk)
+        return result
+
+
+def import_entries(empresa_id, lines, file_format='jsonl', **kwargs):
+    u"""Importa lançamentos das linhas de texto de um arquivo JSON Lines ou CSV."""
+    reader = read_csv if file_format == 'csv' else read_jsonl
+    return EntryImporter(empresa_id, **kwargs).run(reader(lines))
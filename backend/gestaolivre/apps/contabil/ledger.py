@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+u"""Razão: itens de lançamento de uma conta com saldo acumulado linha a linha.
+
+O saldo acumulado é calculado pelo banco de dados com uma função de janela e a
+paginação é por chave (data, lançamento, item): o cursor guarda a chave e o saldo da
+última linha entregue, de modo que qualquer página custa o mesmo que a primeira. O
+cursor também guarda a conta e o intervalo da consulta e só é aceito na mesma consulta,
+já que o saldo que ele carrega não vale para outra.
+"""
+
+from decimal import Decimal
+
+from django.core import signing
+from django.db import connection
+
+from .balances import opening_balance
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+
+
+CURSOR_SALT = 'gestaolivre.contabil.ledger'
+
+LEDGER_SQL = '''
+SELECT i.id, e.id, e.date, e.memo, a.codigo, i.debit_value, i.credit_value,
+       %s + SUM(i.credit_value - i.debit_value) OVER (ORDER BY e.date, e.id, i.id)
+  FROM {item} i
+  JOIN {entry} e ON e.id = i.entry_id
+  JOIN {conta} a ON a.id = i.account_id
+ WHERE i.empresa_id = %s
+   AND a.tree_id = %s AND a.lft BETWEEN %s AND %s
+   AND e.date >= %s AND e.date <= %s
+   {after}
+ ORDER BY e.date, e.id, i.id
+ LIMIT %s
+'''
+
+AFTER_SQL = 'AND (e.date, e.id, i.id) > (%s::date, %s::uuid, %s::uuid)'
+
+
+class InvalidCursor(ValueError):
+    u"""O cursor informado não é válido para esta consulta."""
+
+
+def cursor_scope(account, start, end):
+    u"""Identifica a consulta do razão à qual um cursor pertence."""
+    return [str(account.pk), start.isoformat(), end.isoformat()]
+
+
+def encode_cursor(row, scope):
+    u"""Codifica a chave e o saldo da última linha de uma página da consulta ``scope``."""
+    return signing.dumps({'d': row['date'].isoformat(), 'e': row['entry'], 'i': row['id'],
+                          'b': row['balance'], 's': scope}, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor, scope):
+    u"""Decodifica um cursor criado por :func:`encode_cursor` para a mesma consulta ``scope``."""
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+        if data['s'] != scope:
+            raise InvalidCursor('O cursor pertence a outra conta ou outro intervalo de datas.')
+        return data['d'], data['e'], data['i'], Decimal(data['b'])
+    except (signing.BadSignature, KeyError, TypeError, ArithmeticError):
+        raise InvalidCursor('Cursor inválido.')
+
+
+def ledger_page(account, start, end, cursor=None, limit=100):
+    u"""Obtém uma página do razão da conta entre as datas informadas.
+
+    Retorna ``(saldo_inicial, linhas, próximo_cursor)``; ``saldo_inicial`` é o saldo da
+    conta no início de ``start`` e ``próximo_cursor`` é ``None`` na última página.
+    """
+    scope = cursor_scope(account, start, end)
+    opening = opening_balance(account, start)
+    balance, after, params = opening, '', []
+    if cursor:
+        day, entry_id, item_id, balance = decode_cursor(cursor, scope)
+        after, params = AFTER_SQL, [day, entry_id, item_id]
+    sql = LEDGER_SQL.format(item=EntryItem._meta.db_table, entry=Entry._meta.db_table,
+                            conta=Conta._meta.db_table, after=after)
+    with connection.cursor() as db:
+        db.execute(sql, [balance, account.empresa_id, account.tree_id, account.lft, account.rght, start, end] +
+                   params + [limit + 1])
+        fetched = db.fetchall()
+    rows = [{'id': str(item_id), 'entry': str(entry_id), 'date': day, 'memo': memo, 'account': codigo,
+             'debit_value': str(debit), 'credit_value': str(credit), 'balance': str(running)}
+            for item_id, entry_id, day, memo, codigo, debit, credit, running in fetched[:limit]]
+    next_cursor = encode_cursor(rows[-1], scope) if len(fetched) > limit else None
+    return opening, rows, next_cursor
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+u"""Manutenção dos saldos de todas as empresas em paralelo.
+
+As empresas são independentes, portanto as tarefas de manutenção (recálculo,
+compactação e conferência dos saldos) de cada uma são distribuídas entre os processos de
+um ``Pool``, cada um com a sua conexão com o banco. As empresas com mais itens de
+lançamento começam primeiro, para que as mais demoradas não fiquem para o fim.
+
+O recálculo e a compactação de uma empresa obtêm o bloqueio dos saldos da empresa,
+portanto não colidem com a tarefa ``contabil.recompute`` nem com outra execução do
+comando para a mesma empresa.
+"""
+
+import time
+import traceback
+from collections import namedtuple
+from multiprocessing import Pool
+
+from django.db import connections
+from django.db import transaction
+from django.db.models import Count
+
+from gestaolivre.apps.geral.models import current_empresa
+
+from .balances import calculate_fiscal_year
+from .balances import compact_balances
+from .balances import lock_balances
+from .balances import verify_period
+from .models import EntryItem
+from .models import FiscalYear
+from .models import Period
+
+
+Outcome = namedtuple('Outcome', 'empresa_id task seconds result error')
+
+
+def recompute(empresa_id):
+    u"""Recalcula os saldos de todos os exercícios da empresa, retornando a quantidade gravada.
+
+    Os exercícios são recalculados em uma única transação, sob o bloqueio dos saldos da
+    empresa: cada exercício parte dos saldos finais do anterior, recém-gravados.
+    """
+    with transaction.atomic():
+        lock_balances(empresa_id)
+        return sum(len(calculate_fiscal_year(fiscal_year)) for fiscal_year in
+                   FiscalYear.objects.all_empresas().filter(empresa_id=empresa_id).order_by('start_date'))
+
+
+def compact(empresa_id):
+    u"""Compacta as variações de saldo pendentes, retornando a quantidade de saldos alterados."""
+    return compact_balances(empresa_id)
+
+
+def verify(empresa_id):
+    u"""Confere os saldos gravados de todos os períodos, retornando a quantidade de divergências."""
+    return sum(len(verify_period(period)) for period in
+               Period.objects.all_empresas().filter(empresa_id=empresa_id).order_by('start_date', 'end_date'))
+
+
+TASKS = {
+    'recompute': recompute,
+    'compact': compact,
+    'verify': verify,
+}
+
+
+def by_size(empresa_ids):
+    u"""Ordena as empresas pela quantidade de itens de lançamento, da maior para a menor."""
+    sizes = dict(EntryItem.objects.all_empresas().filter(empresa__in=list(empresa_ids)).order_by()
+                 .values_list('empresa').annotate(Count('id')))
+    return sorted(empresa_ids, key=lambda empresa_id: -sizes.get(empresa_id, 0))
+
+
+def run_task(job):
+    u"""Executa uma tarefa de manutenção de uma empresa, capturando o erro."""
+    task, empresa_id = job
+    started = time.time()
+    try:
+        with current_empresa(empresa_id):
+            result, error = TASKS[task](empresa_id), None
+    except Exception:
+        result, error = None, traceback.format_exc()
+    return Outcome(empresa_id, task, time.time() - started, result, error)
+
+
+def run(tasks, empresa_ids, processes=None):
+    u"""Executa as tarefas para as empresas, gerando cada :class:`Outcome` à medida que termina.
+
+    As tarefas de uma empresa são executadas em ordem, no mesmo processo; empresas
+    diferentes são processadas em paralelo por até ``processes`` processos.
+    """
+    jobs = [(tuple(tasks), empresa_id) for empresa_id in by_size(empresa_ids)]
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            for outcome in _run_tasks(job):
+                yield outcome
+        return
+    connections.close_all()
+    pool = Pool(processes)
+    try:
+        for outcomes in pool.imap_unordered(_run_tasks, jobs, chunksize=1):
+            for outcome in outcomes:
+                yield outcome
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _run_tasks(job):
+    tasks, empresa_id = job
+    outcomes = []
+    for task in tasks:
+        outcome = run_task((task, empresa_id))
+        outcomes.append(outcome)
+        if outcome.error:
+            break
+    return outcomes
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+u"""Base para os comandos de gestão que trabalham por empresa."""
+
+import re
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.geral.models import Empresa
+
+
+class EmpresaCommand(BaseCommand):
+    u"""Comando que pode ser restrito a uma empresa através do CNPJ."""
+
+    def add_arguments(self, parser):
+        u"""Adiciona a opção ``--empresa``."""
+        parser.add_argument('--empresa', help='CNPJ da empresa; por padrão, todas as empresas.')
+
+    def get_empresas(self, options):
+        u"""Obtém as empresas selecionadas pelas opções do comando."""
+        empresas = Empresa.objects.all()
+        if options.get('empresa'):
+            empresas = empresas.filter(cnpj=re.sub(r'\D', '', options['empresa']))
+            if not empresas.exists():
+                raise CommandError('Empresa não encontrada: {0}'.format(options['empresa']))
+        return empresas
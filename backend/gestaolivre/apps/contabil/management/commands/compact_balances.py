@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+u"""Incorpora aos saldos periódicos as variações de saldo pendentes."""
+
+from gestaolivre.apps.contabil.balances import compact_balances
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Incorpora aos saldos periódicos as variações de saldo pendentes."""
+
+    help = 'Incorpora aos saldos periódicos as variações de saldo gravadas pelos lançamentos.'
+
+    def handle(self, *args, **options):
+        u"""Executa a compactação."""
+        total = 0
+        for empresa in self.get_empresas(options):
+            with current_empresa(empresa):
+                changed = compact_balances(empresa.pk)
+            if changed:
+                self.stdout.write('{0}: {1} saldos atualizados.'.format(empresa.cnpj, changed))
+            total += changed
+        self.stdout.write('{0} saldos atualizados.'.format(total))
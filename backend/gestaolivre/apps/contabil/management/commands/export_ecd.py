@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+u"""Gera o arquivo da ECD (SPED Contábil) de um exercício."""
+
+import time
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.ecd import export_ecd
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.contabil.models import FiscalYear
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Gera o arquivo da ECD (SPED Contábil) de um exercício."""
+
+    help = 'Gera o arquivo da ECD (SPED Contábil) de um exercício.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('year', type=int, help='Exercício a exportar.')
+        parser.add_argument('path', help='Arquivo a gravar.')
+
+    def handle(self, *args, **options):
+        u"""Executa a exportação."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        empresa = self.get_empresas(options).get()
+        fiscal_year = FiscalYear.objects.all_empresas().filter(empresa=empresa, year=options['year']).first()
+        if fiscal_year is None:
+            raise CommandError('Nenhum exercício {0} encontrado.'.format(options['year']))
+        started = time.time()
+        with current_empresa(empresa):
+            lines = export_ecd(empresa, fiscal_year, options['path'])
+        self.stdout.write('{0} linhas gravadas em {1:.1f}s.'.format(lines, time.time() - started))
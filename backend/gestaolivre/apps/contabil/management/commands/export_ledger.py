@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+u"""Exporta contas, períodos e partidas em CSV ou Parquet para ferramentas de BI."""
+
+import os
+import time
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_datetime
+
+from gestaolivre.apps.contabil.export import DATASETS
+from gestaolivre.apps.contabil.export import ExportError
+from gestaolivre.apps.contabil.export import copy_csv
+from gestaolivre.apps.contabil.export import watermark
+from gestaolivre.apps.contabil.export import write_parquet
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Exporta contas, períodos e partidas em CSV ou Parquet para ferramentas de BI."""
+
+    help = 'Exporta contas, períodos e partidas em CSV ou Parquet para ferramentas de BI.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('directory', help='Diretório onde gravar os arquivos.')
+        parser.add_argument('--format', choices=('csv', 'parquet'), default='csv', help='Formato dos arquivos.')
+        parser.add_argument('--dataset', choices=sorted(DATASETS), action='append',
+                            help='Conjunto de dados a exportar; por padrão, todos.')
+        parser.add_argument('--since', help='Exporta somente as linhas alteradas depois desta marca (ISO 8601).')
+
+    def handle(self, *args, **options):
+        u"""Executa a exportação."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        empresa = self.get_empresas(options).get()
+        since = None
+        if options.get('since'):
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('Informe --since no formato ISO 8601.')
+        os.makedirs(options['directory'], exist_ok=True)
+        mark = watermark()
+        started = time.time()
+        with current_empresa(empresa):
+            for name in options.get('dataset') or sorted(DATASETS):
+                dataset = DATASETS[name]
+                try:
+                    if options['format'] == 'parquet':
+                        paths = write_parquet(empresa.pk, dataset, options['directory'], since)
+                    else:
+                        paths = [os.path.join(options['directory'], '{0}.csv'.format(name))]
+                        copy_csv(empresa.pk, dataset, paths[0], since)
+                except ExportError as error:
+                    raise CommandError(str(error))
+                for path in paths:
+                    self.stdout.write('  {0}'.format(path))
+        self.stdout.write('Exportação concluída em {0:.1f}s. Próxima marca (--since): {1}'.format(
+            time.time() - started, mark.isoformat()))
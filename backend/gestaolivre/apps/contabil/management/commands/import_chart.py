@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+u"""Carrega o plano de contas de uma empresa a partir de um arquivo CSV ou JSON."""
+
+import io
+import time
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.chart import load_chart
+from gestaolivre.apps.contabil.chart import read_chart_csv
+from gestaolivre.apps.contabil.chart import read_chart_json
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Carrega o plano de contas de uma empresa a partir de um arquivo CSV ou JSON."""
+
+    help = 'Carrega o plano de contas de uma empresa a partir de um arquivo CSV ou JSON.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('path', help='Arquivo do plano de contas.')
+        parser.add_argument('--format', choices=('csv', 'json'),
+                            help='Formato do arquivo; por padrão, pela extensão.')
+
+    def handle(self, *args, **options):
+        u"""Executa a carga."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        empresa = self.get_empresas(options).get()
+        file_format = options['format'] or ('json' if options['path'].endswith('.json') else 'csv')
+        started = time.time()
+        try:
+            with io.open(options['path'], encoding='utf-8', newline='') as lines:
+                rows = read_chart_json(lines.read()) if file_format == 'json' else read_chart_csv(lines)
+            with current_empresa(empresa):
+                created = load_chart(empresa.pk, rows)
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write('{0} contas carregadas em {1:.1f}s.'.format(created, time.time() - started))
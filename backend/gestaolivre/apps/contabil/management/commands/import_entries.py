@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+u"""Importa lançamentos em lote de um arquivo JSON Lines ou CSV."""
+
+import io
+import time
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.journal import check_utf8
+from gestaolivre.apps.contabil.journal import import_entries
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Importa lançamentos em lote de um arquivo JSON Lines ou CSV."""
+
+    help = 'Importa lançamentos em lote de um arquivo JSON Lines ou CSV.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('path', help='Arquivo de lançamentos.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Formato do arquivo; por padrão, pela extensão.')
+
+    def handle(self, *args, **options):
+        u"""Executa a importação."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        empresa = self.get_empresas(options).get()
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        started = time.time()
+        with io.open(options['path'], 'rb') as stream, current_empresa(empresa):
+            try:
+                check_utf8(stream)
+            except UnicodeDecodeError as error:
+                raise CommandError('O arquivo deve estar codificado em UTF-8: {0}.'.format(error))
+            result = import_entries(empresa.pk, io.TextIOWrapper(stream, encoding='utf-8', newline=''), file_format)
+        for row, errors in result.errors:
+            self.stderr.write('Linha {0}: {1}'.format(row, ' '.join(errors)))
+        elapsed = time.time() - started
+        self.stdout.write('{0} lançamentos importados, {1} rejeitados, em {2:.1f}s.'.format(
+            result.created, len(result.errors), elapsed))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+u"""Importa um extrato bancário OFX para a conta de um banco."""
+
+import time
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.contabil.models import Conta
+from gestaolivre.apps.contabil.ofx import import_statement
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Importa um extrato bancário OFX para a conta de um banco."""
+
+    help = 'Importa um extrato bancário OFX para a conta de um banco.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('path', help='Arquivo OFX.')
+        parser.add_argument('--account', required=True, help='Código da conta do banco.')
+        parser.add_argument('--counterpart', required=True, help='Código da conta de contrapartida.')
+
+    def get_account(self, empresa, codigo):
+        u"""Obtém a conta da empresa pelo código."""
+        account = Conta.objects.all_empresas().filter(empresa=empresa, codigo=codigo).first()
+        if account is None:
+            raise CommandError('Conta não encontrada: {0}'.format(codigo))
+        return account
+
+    def handle(self, *args, **options):
+        u"""Executa a importação."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        empresa = self.get_empresas(options).get()
+        account = self.get_account(empresa, options['account'])
+        counterpart = self.get_account(empresa, options['counterpart'])
+        started = time.time()
+        try:
+            with open(options['path'], 'rb') as stream, current_empresa(empresa):
+                result = import_statement(empresa.pk, account.pk, counterpart.pk, stream)
+        except ValueError as error:
+            raise CommandError(str(error))
+        for row, errors in result.errors:
+            self.stderr.write('Transação {0}: {1}'.format(row, ' '.join(errors)))
+        self.stdout.write('{0} transações importadas, {1} já importadas, {2} rejeitadas, em {3:.1f}s.'.format(
+            result.created, result.duplicates, len(result.errors), time.time() - started))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+u"""Executa a manutenção dos saldos de todas as empresas em paralelo."""
+
+import os
+import time
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.maintenance import TASKS
+from gestaolivre.apps.contabil.maintenance import run
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+
+
+class Command(EmpresaCommand):
+    u"""Executa a manutenção dos saldos de todas as empresas em paralelo."""
+
+    help = 'Executa recálculo, compactação ou conferência dos saldos das empresas, distribuídos entre processos.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('tasks', nargs='+', choices=sorted(TASKS),
+                            help='Tarefas a executar, em ordem, para cada empresa.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Quantidade máxima de processos; por padrão, um por CPU.')
+
+    def handle(self, *args, **options):
+        u"""Executa as tarefas e mostra o relatório de tempos e erros."""
+        empresas = dict(self.get_empresas(options).values_list('pk', 'cnpj'))
+        started = time.time()
+        totals = dict((task, [0, 0.0]) for task in options['tasks'])
+        errors = []
+        for outcome in run(options['tasks'], list(empresas), max(1, options['processes'] or 1)):
+            cnpj = empresas[outcome.empresa_id]
+            totals[outcome.task][0] += 1
+            totals[outcome.task][1] += outcome.seconds
+            if outcome.error:
+                errors.append((cnpj, outcome.task, outcome.error))
+                self.stderr.write('{0} {1}: erro em {2:.1f}s'.format(cnpj, outcome.task, outcome.seconds))
+            else:
+                self.stdout.write('{0} {1}: {2} em {3:.1f}s'.format(
+                    cnpj, outcome.task, outcome.result, outcome.seconds))
+        elapsed = time.time() - started
+        self.stdout.write('')
+        for task, (count, seconds) in totals.items():
+            self.stdout.write('{0}: {1} empresas, {2:.1f}s somados'.format(task, count, seconds))
+        self.stdout.write('{0} empresas em {1:.1f}s, {2} erros.'.format(len(empresas), elapsed, len(errors)))
+        for cnpj, task, error in errors:
+            self.stderr.write('\n{0} {1}:\n{2}'.format(cnpj, task, error))
+        if errors:
+            raise CommandError('{0} tarefas com erro.'.format(len(errors)))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+u"""Recalcula os saldos de todos os períodos de um exercício."""
+
+import time
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.balances import calculate_fiscal_year
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.contabil.models import FiscalYear
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Recalcula os saldos de todos os períodos de um exercício."""
+
+    help = 'Recalcula, em uma única passada, os saldos de todos os períodos do exercício.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('year', type=int, help='Exercício a recalcular.')
+
+    def handle(self, *args, **options):
+        u"""Executa o recálculo."""
+        fiscal_years = FiscalYear.objects.filter(year=options['year'],
+                                                 empresa__in=self.get_empresas(options)).select_related('empresa')
+        if not fiscal_years:
+            raise CommandError('Nenhum exercício {0} encontrado.'.format(options['year']))
+        for fiscal_year in fiscal_years:
+            started = time.time()
+
+            def progress(period, index, total):
+                self.stdout.write('  [{0}/{1}] {2} ({3:.1f}s)'.format(index, total, period, time.time() - started))
+
+            self.stdout.write('{0} - {1}'.format(fiscal_year.empresa.cnpj, fiscal_year))
+            with current_empresa(fiscal_year.empresa_id):
+                rows = calculate_fiscal_year(fiscal_year, progress)
+            self.stdout.write('  {0} saldos gravados em {1:.1f}s'.format(len(rows), time.time() - started))
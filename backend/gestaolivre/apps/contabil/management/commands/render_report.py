@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+u"""Gera um relatório contábil em PDF: Diário, Razão ou Balancete."""
+
+import time
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_date
+
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.contabil.models import Conta
+from gestaolivre.apps.contabil.models import Period
+from gestaolivre.apps.contabil.reports import JournalReport
+from gestaolivre.apps.contabil.reports import LedgerReport
+from gestaolivre.apps.contabil.reports import TrialBalanceReport
+from gestaolivre.apps.contabil.reports import render
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Gera um relatório contábil em PDF: Diário, Razão ou Balancete."""
+
+    help = 'Gera um relatório contábil em PDF: Diário, Razão ou Balancete.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('report', choices=('journal', 'ledger', 'trial-balance'), help='Relatório.')
+        parser.add_argument('path', help='Arquivo PDF a gravar.')
+        parser.add_argument('--start', help='Data inicial (AAAA-MM-DD) do Diário ou do Razão.')
+        parser.add_argument('--end', help='Data final (AAAA-MM-DD) do Diário ou do Razão.')
+        parser.add_argument('--account', help='Código da conta do Razão.')
+        parser.add_argument('--period', help='Data (AAAA-MM-DD) dentro do período do Balancete.')
+        parser.add_argument('--processes', type=int, help='Quantidade de processos; por padrão, um por CPU.')
+
+    def date_option(self, options, name):
+        u"""Obtém uma data obrigatória das opções."""
+        try:
+            value = parse_date(options.get(name) or '')
+        except ValueError:
+            value = None
+        if value is None:
+            raise CommandError('Informe --{0} no formato AAAA-MM-DD.'.format(name))
+        return value
+
+    def get_report(self, empresa, options):
+        u"""Cria o relatório pedido."""
+        if options['report'] == 'trial-balance':
+            day = self.date_option(options, 'period')
+            period = Period.objects.all_empresas().filter(empresa=empresa, start_date__lte=day, end_date__gte=day,
+                                                          type=Period.STANDARD).first()
+            if period is None:
+                raise CommandError('Não há período para {0}.'.format(day))
+            return TrialBalanceReport(empresa.pk, period)
+        start, end = self.date_option(options, 'start'), self.date_option(options, 'end')
+        if options['report'] == 'journal':
+            return JournalReport(empresa.pk, start, end)
+        account = Conta.objects.all_empresas().filter(empresa=empresa, codigo=options.get('account')).first()
+        if account is None:
+            raise CommandError('Informe o código da conta com --account.')
+        return LedgerReport(empresa.pk, account.pk, start, end)
+
+    def handle(self, *args, **options):
+        u"""Gera o relatório."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        empresa = self.get_empresas(options).get()
+        started = time.time()
+        with current_empresa(empresa):
+            pages = render(self.get_report(empresa, options), options['path'], options.get('processes'))
+        self.stdout.write('{0} páginas geradas em {1:.1f}s.'.format(pages, time.time() - started))
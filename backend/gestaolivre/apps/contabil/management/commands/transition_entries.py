@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+u"""Muda o status dos lançamentos de um intervalo de datas em lote."""
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_date
+
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.contabil.models import Entry
+from gestaolivre.apps.contabil.workflow import TransitionError
+from gestaolivre.apps.contabil.workflow import summarize
+from gestaolivre.apps.contabil.workflow import transition_entries
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Muda o status dos lançamentos de um intervalo de datas em lote."""
+
+    help = 'Muda o status dos lançamentos de um intervalo de datas, pulando os que estão em uso.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('status', choices=[code for code, _ in Entry.STATUS_CHOICES], help='Novo status.')
+        parser.add_argument('--start', required=True, type=parse_date, help='Data inicial (AAAA-MM-DD).')
+        parser.add_argument('--end', required=True, type=parse_date, help='Data final (AAAA-MM-DD).')
+        parser.add_argument('--from', dest='current', choices=[code for code, _ in Entry.STATUS_CHOICES],
+                            help='Muda somente os lançamentos com este status.')
+
+    def handle(self, *args, **options):
+        u"""Executa a mudança de status."""
+        if not options.get('empresa'):
+            raise CommandError('Informe a empresa com --empresa.')
+        if not options['start'] or not options['end']:
+            raise CommandError('Informe as datas no formato AAAA-MM-DD.')
+        empresa = self.get_empresas(options).get()
+        try:
+            with current_empresa(empresa):
+                outcomes = transition_entries(empresa.pk, options['status'], start=options['start'],
+                                              end=options['end'], current=options['current'])
+        except TransitionError as error:
+            raise CommandError(str(error))
+        summary = summarize(outcomes)
+        for outcome in outcomes:
+            if outcome.outcome == 'unbalanced':
+                self.stderr.write('Lançamento {0}: sem partidas dobradas.'.format(outcome.id))
+        self.stdout.write('{updated} alterados, {locked} em uso, {unbalanced} sem partidas dobradas, '
+                          '{invalid} com status incompatível.'.format(**summary))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+u"""Confere os saldos mantidos de forma incremental com um recálculo completo."""
+
+from django.core.management.base import CommandError
+
+from gestaolivre.apps.contabil.balances import calculate_period
+from gestaolivre.apps.contabil.balances import verify_period
+from gestaolivre.apps.contabil.management.base import EmpresaCommand
+from gestaolivre.apps.contabil.models import Conta
+from gestaolivre.apps.contabil.models import Period
+from gestaolivre.apps.contabil.models import PeriodSnapshot
+from gestaolivre.apps.contabil.snapshots import verify_snapshot
+from gestaolivre.apps.geral.models import current_empresa
+
+
+class Command(EmpresaCommand):
+    u"""Confere os saldos mantidos de forma incremental com um recálculo completo."""
+
+    help = 'Confere os saldos periódicos gravados com um recálculo completo dos lançamentos.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--year', type=int, help='Exercício a conferir; por padrão, todos.')
+        parser.add_argument('--fix', action='store_true', default=False,
+                            help='Recalcula os períodos com divergências.')
+
+    def handle(self, *args, **options):
+        u"""Executa a conferência."""
+        total = 0
+        for empresa in self.get_empresas(options):
+            periods = Period.objects.filter(empresa=empresa).order_by('start_date', 'end_date')
+            if options['year']:
+                periods = periods.filter(year__year=options['year'])
+            codigos = dict(Conta.objects.filter(empresa=empresa).values_list('id', 'codigo'))
+            with current_empresa(empresa):
+                for period in periods:
+                    differences = verify_period(period)
+                    for account_id, stored, expected in differences:
+                        self.stdout.write('{0} {1} {2}: gravado {3!r}, calculado {4!r}'.format(
+                            empresa.cnpj, period, codigos.get(account_id, account_id), stored, expected))
+                    if differences and options['fix']:
+                        if period.status == Period.CLOSED:
+                            self.stdout.write('{0} {1}: período fechado; reabra-o para corrigir os saldos'.format(
+                                empresa.cnpj, period))
+                        else:
+                            calculate_period(period)
+                    total += len(differences)
+                    if period.status == Period.CLOSED:
+                        snapshot = PeriodSnapshot.objects.filter(period=period).first()
+                        if snapshot is None or not verify_snapshot(snapshot):
+                            self.stdout.write('{0} {1}: cópia dos saldos ausente ou corrompida'.format(
+                                empresa.cnpj, period))
+                            total += 1
+        if total and not options['fix']:
+            raise CommandError('{0} saldos divergentes.'.format(total))
+        self.stdout.write('{0} saldos divergentes.'.format(total))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-04-02 14:21
+from __future__ import unicode_literals
+
+import datetime
+import django.contrib.postgres.fields.jsonb
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import gestaolivre.apps.contabil.models
+import gestaolivre.apps.geral.models
+import mptt.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('geral', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conta',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('codigo', models.CharField(max_length=20, validators=[django.core.validators.RegexValidator(message='O código deve estar no formato 9.9.9.99.9999', regex='^[1-9](\\.[1-9](\\.[1-9](\\.\\d{2}(\\.\\d{4})?)?)?)?$')], verbose_name='código')),
+                ('nome', models.CharField(max_length=50, verbose_name='name')),
+                ('nature', models.CharField(choices=[('C', 'Credito'), ('D', 'Débito')], default='C', max_length=1, verbose_name='nature')),
+                ('type', models.CharField(choices=[('A', 'Analytical'), ('S', 'Synthetic')], default='A', max_length=1, verbose_name='type')),
+                ('lft', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('rght', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('tree_id', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('level', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('parent', mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='contabil.Conta', verbose_name='parent')),
+            ],
+            options={
+                'verbose_name': 'account',
+                'verbose_name_plural': 'accounts',
+                'ordering': ['codigo'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Entry',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('date', models.DateField(default=datetime.date.today, validators=[gestaolivre.apps.contabil.models.open_period_validator], verbose_name='date')),
+                ('memo', models.CharField(max_length=150, verbose_name='memo')),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=12, validators=[django.core.validators.MinValueValidator(0)], verbose_name='value')),
+                ('status', models.CharField(choices=[('D', 'Draft'), ('P', 'Pending'), ('A', 'Approved'), ('F', 'Frozen')], default='D', max_length=1, verbose_name='status')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+            ],
+            options={
+                'verbose_name': 'entry',
+                'verbose_name_plural': 'entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='EntryItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('debit_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, validators=[django.core.validators.MinValueValidator(0)], verbose_name='debit value')),
+                ('credit_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, validators=[django.core.validators.MinValueValidator(0)], verbose_name='credit value')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='contabil.Conta', verbose_name='account')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='contabil.Entry', verbose_name='entry')),
+            ],
+            options={
+                'verbose_name': 'entry item',
+                'verbose_name_plural': 'entry items',
+                'ordering': ('account__codigo',),
+            },
+        ),
+        migrations.CreateModel(
+            name='FiscalYear',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('year', models.IntegerField(validators=[django.core.validators.MinValueValidator(2000), django.core.validators.MaxValueValidator(2100)], verbose_name='year')),
+                ('start_date', models.DateField(verbose_name='start date')),
+                ('end_date', models.DateField(verbose_name='end date')),
+                ('status', models.CharField(choices=[('O', 'Open'), ('C', 'Closed')], default='O', max_length=1, verbose_name='status')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+            ],
+            options={
+                'verbose_name': 'fiscal year',
+                'verbose_name_plural': 'fiscal years',
+                'ordering': ('year',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Period',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('start_date', models.DateField(verbose_name='start date')),
+                ('end_date', models.DateField(verbose_name='end date')),
+                ('status', models.CharField(choices=[('O', 'Open'), ('C', 'Closed')], default='O', max_length=1, verbose_name='status')),
+                ('type', models.CharField(choices=[('S', 'Standard'), ('A', 'Adjustment')], default='S', max_length=1, verbose_name='type')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('year', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='periods', to='contabil.FiscalYear', verbose_name='year')),
+            ],
+            options={
+                'verbose_name': 'period',
+                'verbose_name_plural': 'periods',
+                'ordering': ('start_date', 'end_date'),
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodicBalance',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('initial_balance', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='initial balance')),
+                ('final_balance', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='final balance')),
+                ('debit_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, validators=[django.core.validators.MinValueValidator(0)], verbose_name='debit value')),
+                ('credit_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, validators=[django.core.validators.MinValueValidator(0)], verbose_name='credit value')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contabil.Conta', verbose_name='account')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contabil.Period', verbose_name='period')),
+            ],
+            options={
+                'verbose_name': 'periodic balance',
+                'verbose_name_plural': 'periodic balances',
+                'ordering': ('period__start_date',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='conta',
+            unique_together=set([('empresa', 'codigo')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-04-09 10:42
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+        ('contabil', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='conta',
+            index_together=set([('tree_id', 'lft')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='entry',
+            index_together=set([('empresa', 'date')]),
+        ),
+    ]
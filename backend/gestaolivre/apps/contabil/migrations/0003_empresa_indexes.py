@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-04-23 15:07
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+        ('contabil', '0002_balance_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='entryitem',
+            index_together=set([('empresa', 'account', 'entry')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='period',
+            index_together=set([('empresa', 'start_date')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='periodicbalance',
+            unique_together=set([('empresa', 'period', 'account')]),
+        ),
+    ]
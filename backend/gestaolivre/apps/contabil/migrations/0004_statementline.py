@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-04-30 10:12
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import gestaolivre.apps.geral.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+        ('contabil', '0003_empresa_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementLine',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('fitid', models.CharField(max_length=255, verbose_name='transaction id')),
+                ('date', models.DateField(verbose_name='date')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='amount')),
+                ('memo', models.CharField(blank=True, max_length=255, verbose_name='memo')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statement_lines', to='contabil.Conta', verbose_name='account')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='statement_lines', to='contabil.Entry', verbose_name='entry')),
+            ],
+            options={
+                'verbose_name': 'statement line',
+                'verbose_name_plural': 'statement lines',
+                'ordering': ('date',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='statementline',
+            unique_together=set([('empresa', 'account', 'fitid')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='statementline',
+            index_together=set([('empresa', 'account', 'date')]),
+        ),
+    ]
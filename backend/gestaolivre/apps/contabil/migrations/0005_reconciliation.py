@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-05-07 09:41
+from __future__ import unicode_literals
+
+import datetime
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import gestaolivre.apps.geral.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+        ('contabil', '0004_statementline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reconciliation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('date', models.DateField(default=datetime.date.today, verbose_name='date')),
+                ('kind', models.CharField(choices=[('O', 'One to one'), ('S', 'One statement line to many entry items'), ('G', 'Many statement lines to one entry item')], default='O', max_length=1, verbose_name='kind')),
+                ('score', models.FloatField(default=0, verbose_name='score')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reconciliations', to='contabil.Conta', verbose_name='account')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+            ],
+            options={
+                'verbose_name': 'reconciliation',
+                'verbose_name_plural': 'reconciliations',
+                'ordering': ('date',),
+            },
+        ),
+        migrations.AddField(
+            model_name='entryitem',
+            name='reconciliation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='entry_items', to='contabil.Reconciliation', verbose_name='reconciliation'),
+        ),
+        migrations.AddField(
+            model_name='statementline',
+            name='reconciliation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='statement_lines', to='contabil.Reconciliation', verbose_name='reconciliation'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-05-14 11:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contabil', '0005_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conta',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='modified'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='modified'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='entryitem',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='modified'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='period',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='modified'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-05-21 16:27
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import gestaolivre.apps.geral.models
+import uuid
+
+
+CLOSED_PERIOD_SQL = '''
+CREATE OR REPLACE FUNCTION contabil_period_is_closed(empresa uuid, day date) RETURNS boolean AS $$
+    SELECT EXISTS (SELECT 1 FROM contabil_period
+                    WHERE empresa_id = empresa AND type = 'S' AND status = 'C'
+                      AND start_date <= day AND end_date >= day);
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION contabil_entry_closed_period() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND (NEW.empresa_id, NEW.date, NEW.memo, NEW.value)
+            IS NOT DISTINCT FROM (OLD.empresa_id, OLD.date, OLD.memo, OLD.value) THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP <> 'INSERT' AND contabil_period_is_closed(OLD.empresa_id, OLD.date) THEN
+        RAISE EXCEPTION 'Lançamento em período fechado: %', OLD.date USING ERRCODE = 'check_violation';
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    IF contabil_period_is_closed(NEW.empresa_id, NEW.date) THEN
+        RAISE EXCEPTION 'Lançamento em período fechado: %', NEW.date USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION contabil_entryitem_closed_period() RETURNS trigger AS $$
+DECLARE
+    entry_empresa uuid;
+    entry_date date;
+BEGIN
+    IF TG_OP = 'UPDATE' AND (NEW.entry_id, NEW.account_id, NEW.debit_value, NEW.credit_value)
+            IS NOT DISTINCT FROM (OLD.entry_id, OLD.account_id, OLD.debit_value, OLD.credit_value) THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        SELECT empresa_id, date INTO entry_empresa, entry_date FROM contabil_entry WHERE id = OLD.entry_id;
+        IF contabil_period_is_closed(entry_empresa, entry_date) THEN
+            RAISE EXCEPTION 'Lançamento em período fechado: %', entry_date USING ERRCODE = 'check_violation';
+        END IF;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    SELECT empresa_id, date INTO entry_empresa, entry_date FROM contabil_entry WHERE id = NEW.entry_id;
+    IF contabil_period_is_closed(entry_empresa, entry_date) THEN
+        RAISE EXCEPTION 'Lançamento em período fechado: %', entry_date USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER contabil_entry_closed_period BEFORE INSERT OR UPDATE OR DELETE ON contabil_entry
+    FOR EACH ROW EXECUTE PROCEDURE contabil_entry_closed_period();
+CREATE TRIGGER contabil_entryitem_closed_period BEFORE INSERT OR UPDATE OR DELETE ON contabil_entryitem
+    FOR EACH ROW EXECUTE PROCEDURE contabil_entryitem_closed_period();
+'''
+
+DROP_CLOSED_PERIOD_SQL = '''
+DROP TRIGGER IF EXISTS contabil_entryitem_closed_period ON contabil_entryitem;
+DROP TRIGGER IF EXISTS contabil_entry_closed_period ON contabil_entry;
+DROP FUNCTION IF EXISTS contabil_entryitem_closed_period();
+DROP FUNCTION IF EXISTS contabil_entry_closed_period();
+DROP FUNCTION IF EXISTS contabil_period_is_closed(uuid, date);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+        ('contabil', '0006_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodSnapshot',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('balances', django.contrib.postgres.fields.jsonb.JSONField(verbose_name='balances')),
+                ('checksum', models.CharField(max_length=64, verbose_name='checksum')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('period', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='contabil.Period', verbose_name='period')),
+            ],
+            options={
+                'verbose_name': 'period snapshot',
+                'verbose_name_plural': 'period snapshots',
+            },
+        ),
+        migrations.RunSQL(CLOSED_PERIOD_SQL, DROP_CLOSED_PERIOD_SQL),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-05-28 11:04
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import gestaolivre.apps.geral.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+        ('contabil', '0007_period_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceDelta',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('initial_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='initial balance')),
+                ('debit_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='debit value')),
+                ('credit_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='credit value')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contabil.Conta', verbose_name='account')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contabil.Period', verbose_name='period')),
+            ],
+            options={
+                'verbose_name': 'balance delta',
+                'verbose_name_plural': 'balance deltas',
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-06-04 10:12
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contabil', '0008_balancedelta'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='date',
+            field=models.DateField(default=datetime.date.today, verbose_name='date'),
+        ),
+    ]
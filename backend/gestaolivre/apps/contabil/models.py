@@ -2,38 +2,73 @@
 u"""Modelos gerais do Gestão Livre."""
 
 from datetime import date
-from datetime import timedelta
+from decimal import Decimal
+from threading import local
 
+from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.core.validators import MaxValueValidator
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db import transaction
 from django.db.models import F
 from django.db.models import Q
+from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.utils import dateformat
 from django.utils.translation import ugettext_lazy as _
 
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
+from mptt.querysets import TreeQuerySet
+from mptt.signals import node_moved
 
+from gestaolivre.apps.geral.models import EmpresaManager
 from gestaolivre.apps.geral.models import EmpresaModel
+from gestaolivre.apps.geral.models import EmpresaQuerySet
 
 
 leaf_nodes = Q(rght=F('lft') + 1)
 
 
-def open_period_validator(value):
-    from .models import Period
-    period = Period.objects.filter(status=Period.OPEN, start_date__lte=value, end_date__gte=value).first()
-    if not period:
+def open_period_validator(value, empresa_id):
+    # Usa a empresa do lançamento: fora de um request não há empresa corrente.
+    from .periods import period_index
+    if empresa_id is None or not period_index(empresa_id).is_open(value):
         raise ValidationError(
             _('There is no open calendar for %(date)s'),
             params={'date': dateformat.format(value, _('m/d/Y'))},
         )
 
 
+class ContaQuerySet(EmpresaQuerySet, TreeQuerySet):
+    u"""QuerySet das contas, com os filtros da empresa e as consultas da árvore."""
+
+
+class ContaManager(EmpresaManager, TreeManager):
+    u"""Gerenciador das contas da empresa corrente, com as operações da árvore do MPTT.
+
+    As consultas mantêm a ordenação do modelo, pelo código. O ``tree_id`` é único na
+    tabela, portanto as operações que numeram ou reconstroem as árvores usam o
+    gerenciador sem filtro ``Conta._tree_manager``.
+    """
+
+    _queryset_class = ContaQuerySet
+
+    def get_queryset(self, *args, **kwargs):
+        return super().get_queryset(*args, **kwargs).order_by(*self.model._meta.ordering)
+
+    def rebuild(self):
+        return self.model._tree_manager.rebuild()
+
+    def _get_next_tree_id(self):
+        return self.model._tree_manager._get_next_tree_id()
+
+
 class Conta(EmpresaModel, MPTTModel):
     CREDITO = 'C'
     DEBITO = 'D'
@@ -55,23 +90,39 @@ class Conta(EmpresaModel, MPTTModel):
     nature = models.CharField(max_length=1, choices=NATUREZA_CHOICES, default=CREDITO, verbose_name=_('nature'))
     type = models.CharField(max_length=1, choices=TIPO_CHOICES, default=ANALITICA, verbose_name=_('type'))
     parent = TreeForeignKey('self', blank=True, null=True, related_name='children', verbose_name=_('parent'))
+    modified = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('modified'))
+
+    objects = ContaManager()
 
     def __str__(self):
         return self.codigo + ' - ' + self.nome
 
     def clean(self):
         if self.type == Conta.ANALITICA:
-            if not self.parent or self.parent.level < 2:
+            if not self.parent_id or self._parent_level() < 2:
                 raise ValidationError(_('An analytical account level must be 4 or greater.'))
 
+    def _parent_level(self):
+        from .tree import chart_tree
+        node = chart_tree(self.empresa_id).node(self.parent_id)
+        return node.level if node else self.parent.level
+
     class Meta:
         verbose_name = _('account')
         verbose_name_plural = _('accounts')
-        unique_together = (('domain', 'code'),)
-        ordering = ['code']
+        unique_together = (('empresa', 'codigo'),)
+        index_together = (('tree_id', 'lft'),)
+        ordering = ['codigo']
 
     class MPTTMeta:
-        order_insertion_by = ['code']
+        order_insertion_by = ['codigo']
+
+
+# O MPTT adotaria ``objects`` como gerenciador da árvore, mas as suas operações precisam
+# enxergar as contas de todas as empresas.
+_tree_manager = TreeManager()
+_tree_manager.contribute_to_class(Conta, '_tree_manager')
+Conta._tree_manager = _tree_manager
 
 
 class Entry(EmpresaModel):
@@ -85,18 +136,33 @@ class Entry(EmpresaModel):
         (APPROVED, _('Approved')),
         (FROZEN, _('Frozen')),
     )
-    date = models.DateField(default=date.today, verbose_name=_('date'), validators=[open_period_validator])
+    date = models.DateField(default=date.today, verbose_name=_('date'))
     memo = models.CharField(max_length=150, verbose_name=_('memo'))
     value = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0)],
                                 default=0, verbose_name=_('value'))
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=DRAFT, verbose_name=_('status'))
+    modified = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('modified'))
 
     def __str__(self):
         return '{0}: {1}: {2}'.format(self.date, self.memo, self.value)
 
+    def clean(self):
+        super().clean()
+        if self.date is not None:
+            try:
+                open_period_validator(self.date, self.empresa_id)
+            except ValidationError as error:
+                raise ValidationError({'date': error})
+
+    def save(self, *args, **kwargs):
+        # A mudança de data e as variações dos saldos são gravadas na mesma transação.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = _('entry')
         verbose_name_plural = _('entries')
+        index_together = (('empresa', 'date'),)
 
 
 class EntryItem(EmpresaModel):
@@ -106,14 +172,23 @@ class EntryItem(EmpresaModel):
                                       default=0, verbose_name=_('debit value'))
     credit_value = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0)],
                                        default=0, verbose_name=_('credit value'))
+    reconciliation = models.ForeignKey('Reconciliation', related_name='entry_items', null=True, blank=True,
+                                       on_delete=models.SET_NULL, verbose_name=_('reconciliation'))
+    modified = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('modified'))
 
     def __str__(self):
         return '{0}: -{1} +{2}'.format(self.account, self.debit_value, self.credit_value)
 
+    def save(self, *args, **kwargs):
+        # O item e as variações dos saldos são gravados na mesma transação.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = _('entry item')
         verbose_name_plural = _('entry items')
-        ordering = ('account__code',)
+        ordering = ('account__codigo',)
+        index_together = (('empresa', 'account', 'entry'),)
 
     def clean(self):
         super().clean()
@@ -123,6 +198,51 @@ class EntryItem(EmpresaModel):
             raise ValidationError(_('You must inform debit or credit value.'))
 
 
+class StatementLine(EmpresaModel):
+    account = models.ForeignKey(Conta, related_name='statement_lines', verbose_name=_('account'))
+    fitid = models.CharField(max_length=255, verbose_name=_('transaction id'))
+    date = models.DateField(verbose_name=_('date'))
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name=_('amount'))
+    memo = models.CharField(max_length=255, blank=True, verbose_name=_('memo'))
+    entry = models.ForeignKey(Entry, related_name='statement_lines', null=True, blank=True,
+                              on_delete=models.SET_NULL, verbose_name=_('entry'))
+    reconciliation = models.ForeignKey('Reconciliation', related_name='statement_lines', null=True, blank=True,
+                                       on_delete=models.SET_NULL, verbose_name=_('reconciliation'))
+
+    def __str__(self):
+        return '{0}: {1}: {2}'.format(self.date, self.memo, self.amount)
+
+    class Meta:
+        verbose_name = _('statement line')
+        verbose_name_plural = _('statement lines')
+        ordering = ('date',)
+        unique_together = (('empresa', 'account', 'fitid'),)
+        index_together = (('empresa', 'account', 'date'),)
+
+
+class Reconciliation(EmpresaModel):
+    ONE_TO_ONE = 'O'
+    ONE_TO_MANY = 'S'
+    MANY_TO_ONE = 'G'
+    KIND_CHOICES = (
+        (ONE_TO_ONE, _('One to one')),
+        (ONE_TO_MANY, _('One statement line to many entry items')),
+        (MANY_TO_ONE, _('Many statement lines to one entry item')),
+    )
+    account = models.ForeignKey(Conta, related_name='reconciliations', verbose_name=_('account'))
+    date = models.DateField(default=date.today, verbose_name=_('date'))
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES, default=ONE_TO_ONE, verbose_name=_('kind'))
+    score = models.FloatField(default=0, verbose_name=_('score'))
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.account, self.date)
+
+    class Meta:
+        verbose_name = _('reconciliation')
+        verbose_name_plural = _('reconciliations')
+        ordering = ('date',)
+
+
 class FiscalYear(EmpresaModel):
     OPEN = 'O'
     CLOSED = 'C'
@@ -147,6 +267,10 @@ class FiscalYear(EmpresaModel):
     def __str__(self):
         return str(self.year)
 
+    def calculate_balances(self, progress=None):
+        from .balances import calculate_fiscal_year
+        calculate_fiscal_year(self, progress)
+
 
 @receiver(post_save, sender=FiscalYear)
 def new_year(sender, created, instance, **kwargs):
@@ -157,7 +281,8 @@ def new_year(sender, created, instance, **kwargs):
     import calendar
     for month in range(1, 13):
         last_day_in_month = calendar.monthrange(year, month)[1]
-        period = Period(year=fiscal_year,
+        period = Period(empresa_id=fiscal_year.empresa_id,
+                        year=fiscal_year,
                         start_date=date(year, month, 1),
                         end_date=date(year, month, last_day_in_month))
         period.save()
@@ -181,11 +306,13 @@ class Period(EmpresaModel):
     end_date = models.DateField(verbose_name=_('end date'))
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=OPEN, verbose_name=_('status'))
     type = models.CharField(max_length=1, choices=TYPE_CHOICES, default=STANDARD, verbose_name=_('type'))
+    modified = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('modified'))
 
     class Meta:
         verbose_name = _('period')
         verbose_name_plural = _('periods')
         ordering = ('start_date', 'end_date',)
+        index_together = (('empresa', 'start_date'),)
 
     def __str__(self):
         return _('%(start)s to %(end)s') % {'start': dateformat.format(self.start_date, _('m/d/Y')),
@@ -196,10 +323,12 @@ class Period(EmpresaModel):
             raise ValidationError(_('Start date must not be greater than end date.'))
 
     def next(self):
-        return Period.objects.filter(start_date=self.end_date + timedelta(days=1)).first()
+        from .periods import period_index
+        return period_index(self.empresa_id).next(self)
 
     def previous(self):
-        return Period.objects.filter(end_date=self.start_date - timedelta(days=1)).first()
+        from .periods import period_index
+        return period_index(self.empresa_id).previous(self)
 
 
 class PeriodicBalance(EmpresaModel):
@@ -216,6 +345,7 @@ class PeriodicBalance(EmpresaModel):
         verbose_name = _('periodic balance')
         verbose_name_plural = _('periodic balances')
         ordering = ('period__start_date',)
+        unique_together = (('empresa', 'period', 'account'),)
 
     def __str__(self):
         return '{0}: {1} {2}'.format(self.account, self.period.start_date, self.initial_balance)
@@ -226,38 +356,139 @@ class PeriodicBalance(EmpresaModel):
 
     @staticmethod
     def calculate_for(period, include_results=True):
-        def create_for(account, period):
-            pb = PeriodicBalance.objects.filter(period=period.previous(), account=account).first()
-            return PeriodicBalance(account=account,
-                                   period=period,
-                                   initial_balance=pb.final_balance if pb else 0,
-                                   final_balance=0,
-                                   debit_value=0,
-                                   credit_value=0)
-
-        for periodic_balance in PeriodicBalance.objects.filter(period=period):
-            periodic_balance.delete()
-
-        accounts_balance = dict([(a, create_for(a, period)) for a in Conta.objects.all()])
-
-        if include_results:
-            query = Q(entry__date__gte=period.start_date) & \
-                Q(entry__date__lte=period.end_date)
-        else:
-            query = ~Q(entry__memo='APURAÇÃO RESULTADO 12/2014') & \
-                    ~Q(entry__memo='VLR.DISTRIBUIÇÃO DE LUCROS AO SÓCIO SERGIO RAFAEL GARCIA') & \
-                Q(entry__date__gte=period.start_date) & \
-                Q(entry__date__lte=period.end_date)
-
-        for entry_item in EntryItem.objects.filter(query).all():
-            account = entry_item.account
-            while account:
-                account_balance = accounts_balance[account]
-                account_balance.debit_value += entry_item.debit_value
-                account_balance.credit_value += entry_item.credit_value
-                account = account.parent
-
-        for ab in accounts_balance.values():
-            ab.final_balance = ab.initial_balance + ab.credit_value - ab.debit_value
-            ab.save()
+        from .balances import calculate_period
+        calculate_period(period, include_results)
+
+
+class BalanceDelta(EmpresaModel):
+    account = models.ForeignKey(Conta, verbose_name=_('account'))
+    period = models.ForeignKey(Period, verbose_name=_('period'))
+    initial_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+                                          verbose_name=_('initial balance'))
+    debit_value = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_('debit value'))
+    credit_value = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_('credit value'))
+
+    class Meta:
+        verbose_name = _('balance delta')
+        verbose_name_plural = _('balance deltas')
+
+    def __str__(self):
+        return '{0}: {1} -{2} +{3}'.format(self.account, self.period.start_date, self.debit_value, self.credit_value)
+
+
+class PeriodSnapshot(EmpresaModel):
+    period = models.OneToOneField(Period, related_name='snapshot', verbose_name=_('period'))
+    balances = JSONField(verbose_name=_('balances'))
+    checksum = models.CharField(max_length=64, verbose_name=_('checksum'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
+
+    class Meta:
+        verbose_name = _('period snapshot')
+        verbose_name_plural = _('period snapshots')
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.period, self.checksum[:12])
+
+
+_deleting = local()
+
+
+@receiver(post_save, sender=Conta)
+@receiver(post_delete, sender=Conta)
+@receiver(node_moved, sender=Conta)
+def invalidate_chart_tree(sender, instance, **kwargs):
+    from .tree import invalidate_chart
+    invalidate_chart(instance.empresa_id)
+
+
+@receiver(post_save, sender=FiscalYear)
+@receiver(post_delete, sender=FiscalYear)
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+def invalidate_period_index(sender, instance, **kwargs):
+    from .periods import invalidate_periods
+    invalidate_periods(instance.empresa_id)
+
+
+def _apply_movements(empresa_id, movements):
+    from .balances import apply_movements
+    apply_movements(empresa_id, movements)
+
+
+def _incremental_balances():
+    from .balances import incremental_balances
+    return incremental_balances()
+
+
+def _entry_movements(entry):
+    return EntryItem.objects.all_empresas().filter(entry=entry).values_list('account', 'debit_value', 'credit_value')
+
+
+@receiver(pre_save, sender=EntryItem)
+def entry_item_pre_save(sender, instance, raw, **kwargs):
+    instance._previous_movement = None
+    if raw or instance._state.adding or not _incremental_balances():
+        return
+    instance._previous_movement = EntryItem.objects.all_empresas().filter(pk=instance.pk).values_list(
+        'account', 'entry__date', 'debit_value', 'credit_value').first()
+
+
+@receiver(post_save, sender=EntryItem)
+def entry_item_post_save(sender, instance, raw, **kwargs):
+    if raw or not _incremental_balances():
+        return
+    movements = []
+    previous = getattr(instance, '_previous_movement', None)
+    if previous:
+        account_id, day, debit_value, credit_value = previous
+        movements.append((account_id, day, -debit_value, -credit_value))
+    movements.append((instance.account_id, instance.entry.date,
+                      Decimal(instance.debit_value), Decimal(instance.credit_value)))
+    _apply_movements(instance.empresa_id, movements)
+
+
+@receiver(post_delete, sender=EntryItem)
+def entry_item_post_delete(sender, instance, **kwargs):
+    if instance.entry_id in getattr(_deleting, 'entries', ()) or not _incremental_balances():
+        return
+    _apply_movements(instance.empresa_id, [(instance.account_id, instance.entry.date,
+                                            -Decimal(instance.debit_value), -Decimal(instance.credit_value))])
+
+
+@receiver(pre_save, sender=Entry)
+def entry_pre_save(sender, instance, raw, **kwargs):
+    instance._previous_date = None
+    if raw or instance._state.adding or not _incremental_balances():
+        return
+    instance._previous_date = Entry.objects.all_empresas().filter(pk=instance.pk).values_list('date', flat=True).first()
+
+
+@receiver(post_save, sender=Entry)
+def entry_post_save(sender, instance, raw, **kwargs):
+    # Todos os status entram no cálculo completo dos saldos, portanto somente a mudança
+    # de data move os valores do lançamento entre períodos.
+    previous_date = getattr(instance, '_previous_date', None)
+    if raw or not previous_date or previous_date == instance.date:
+        return
+    movements = []
+    for account_id, debit_value, credit_value in _entry_movements(instance):
+        movements.append((account_id, previous_date, -debit_value, -credit_value))
+        movements.append((account_id, instance.date, debit_value, credit_value))
+    _apply_movements(instance.empresa_id, movements)
+
+
+@receiver(pre_delete, sender=Entry)
+def entry_pre_delete(sender, instance, **kwargs):
+    if not _incremental_balances():
+        return
+    if not hasattr(_deleting, 'entries'):
+        _deleting.entries = set()
+    _deleting.entries.add(instance.pk)
+    items = _entry_movements(instance)
+    _apply_movements(instance.empresa_id, [(account_id, instance.date, -debit_value, -credit_value)
+                                           for account_id, debit_value, credit_value in items])
+
 
+@receiver(post_delete, sender=Entry)
+def entry_post_delete(sender, instance, **kwargs):
+    getattr(_deleting, 'entries', set()).discard(instance.pk)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+u"""Importação de extratos bancários OFX.
+
+O arquivo é lido em blocos e as transações (``STMTTRN``) são geradas uma a uma, sem
+montar o documento inteiro em memória. Cada transação vira uma linha de extrato e um
+lançamento provisório entre a conta do banco e uma conta de contrapartida. Transações já
+importadas são reconhecidas pelo índice único (empresa, conta, FITID), portanto importar
+de novo um extrato que se sobrepõe a outro grava somente as transações novas.
+"""
+
+import codecs
+import re
+from datetime import date
+from decimal import Decimal
+from decimal import InvalidOperation
+
+from django.db import transaction
+
+from .balances import apply_movements
+from .balances import incremental_balances
+from .journal import ImportResult
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+from .models import StatementLine
+from .periods import period_index
+from .tree import chart_tree
+
+
+CHUNK_SIZE = 1000
+
+READ_SIZE = 64 * 1024
+
+MAX_VALUE = Decimal('9999999999.99')
+
+CENTS = Decimal('0.01')
+
+TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+UTF8 = re.compile(br'(CHARSET:\s*UTF-?8|ENCODING:\s*UTF-?8|encoding="utf-?8")', re.IGNORECASE)
+
+
+class StatementImportResult(ImportResult):
+    u"""Resultado de uma importação de extrato, com as transações já importadas antes."""
+
+    def __init__(self):
+        u"""Inicializa um resultado vazio."""
+        super(StatementImportResult, self).__init__()
+        self.duplicates = 0
+
+    def as_dict(self):
+        u"""Representa o resultado em tipos serializáveis."""
+        data = super(StatementImportResult, self).as_dict()
+        data['duplicates'] = self.duplicates
+        return data
+
+
+def _tokens(stream, read_size):
+    head = stream.read(read_size)
+    decoder = codecs.getincrementaldecoder('utf-8' if UTF8.search(head) else 'cp1252')('replace')
+    buffer, chunk = '', head
+    while chunk:
+        buffer += decoder.decode(chunk)
+        cut = buffer.rfind('<')
+        if cut > 0:
+            for match in TAG.finditer(buffer, 0, cut):
+                yield match.groups()
+            buffer = buffer[cut:]
+        chunk = stream.read(read_size)
+    buffer += decoder.decode(b'', final=True)
+    for match in TAG.finditer(buffer):
+        yield match.groups()
+
+
+def read_transactions(stream, read_size=READ_SIZE):
+    u"""Gera as transações do arquivo OFX binário ``stream`` como dicionários de campos.
+
+    Funciona tanto com o OFX 1.x (SGML, sem fechamento das tags de valor) como com o
+    OFX 2.x (XML).
+    """
+    current = None
+    for closing, tag, text in _tokens(stream, read_size):
+        tag = tag.upper()
+        if tag == 'STMTTRN':
+            if closing and current is not None:
+                yield current
+            current = None if closing else {}
+        elif current is not None and not closing:
+            current.setdefault(tag, text.strip())
+
+
+def _parse_date(value):
+    try:
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_amount(value):
+    value = (value or '').replace(' ', '')
+    if ',' in value and '.' not in value:
+        value = value.replace(',', '.')
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        return None
+    return amount if amount.is_finite() else None
+
+
+class StatementImporter(object):
+    u"""Importa as transações de um extrato para a conta do banco de uma empresa."""
+
+    def __init__(self, empresa_id, account_id, counterpart_id, chunk_size=CHUNK_SIZE):
+        u"""Confere as contas informadas e monta o índice de períodos da empresa."""
+        tree = chart_tree(empresa_id, verify=True)
+        for account in (account_id, counterpart_id):
+            node = tree.node(account)
+            if node is None or not node.is_leaf:
+                raise ValueError('Conta analítica não encontrada: {0}.'.format(account))
+        self.empresa_id = empresa_id
+        self.account_id = account_id
+        self.counterpart_id = counterpart_id
+        self.chunk_size = chunk_size
+        self.periods = period_index(empresa_id)
+
+    def build(self, data):
+        u"""Valida uma transação lida e cria os objetos, ainda sem gravar.
+
+        Retorna ``(linha do extrato, lançamento, itens, erros)``.
+        """
+        errors = []
+        fitid = data.get('FITID') or ''
+        if not fitid or len(fitid) > 255:
+            errors.append('FITID ausente ou inválido: {0}.'.format(fitid))
+        day = _parse_date(data.get('DTPOSTED'))
+        if day is None:
+            errors.append('Data inválida: {0}.'.format(data.get('DTPOSTED')))
+        elif not self.periods.is_open(day):
+            errors.append('Não há período aberto para {0}.'.format(day))
+        amount = _parse_amount(data.get('TRNAMT'))
+        if amount is None or amount == 0 or abs(amount) > MAX_VALUE:
+            errors.append('Valor inválido: {0}.'.format(data.get('TRNAMT')))
+            amount = Decimal(0)
+        amount = amount.quantize(CENTS)
+        memo = data.get('MEMO') or data.get('NAME') or ''
+
+        line = StatementLine(empresa_id=self.empresa_id, account_id=self.account_id, fitid=fitid, date=day,
+                             amount=amount, memo=memo[:255])
+        value = abs(amount)
+        entry = Entry(empresa_id=self.empresa_id, date=day, memo=(memo or 'Extrato bancário')[:150], value=value,
+                      status=Entry.DRAFT)
+        # Entradas no banco debitam a conta do banco; saídas a creditam.
+        debit, credit = (value, Decimal(0)) if amount > 0 else (Decimal(0), value)
+        items = [EntryItem(empresa_id=self.empresa_id, entry=entry, account_id=self.account_id,
+                           debit_value=debit, credit_value=credit),
+                 EntryItem(empresa_id=self.empresa_id, entry=entry, account_id=self.counterpart_id,
+                           debit_value=credit, credit_value=debit)]
+        line.entry = entry
+        return line, entry, items, errors
+
+    def save(self, chunk):
+        u"""Grava as transações ainda não importadas do bloco em uma única transação.
+
+        Retorna ``(gravadas, já importadas)``.
+        """
+        with transaction.atomic():
+            # Serializa importações simultâneas para a mesma conta do banco.
+            list(Conta.objects.all_empresas().select_for_update().filter(pk=self.account_id).values_list('pk'))
+            existing = set(StatementLine.objects.all_empresas().filter(
+                empresa_id=self.empresa_id, account_id=self.account_id,
+                fitid__in=[line.fitid for line, _, _ in chunk]).values_list('fitid', flat=True))
+            chunk = [row for row in chunk if row[0].fitid not in existing]
+            entries = [entry for _, entry, _ in chunk]
+            items = [item for _, _, entry_items in chunk for item in entry_items]
+            lines = [line for line, _, _ in chunk]
+            Entry.objects.bulk_create(entries, batch_size=CHUNK_SIZE)
+            EntryItem.objects.bulk_create(items, batch_size=CHUNK_SIZE)
+            StatementLine.objects.bulk_create(lines, batch_size=CHUNK_SIZE)
+            if incremental_balances():
+                apply_movements(self.empresa_id, [(item.account_id, item.entry.date, item.debit_value,
+                                                   item.credit_value) for item in items])
+        return len(lines), len(existing)
+
+    def run(self, transactions):
+        u"""Importa as transações geradas por :func:`read_transactions`.
+
+        Transações com erro são ignoradas e relatadas pela posição no arquivo; as que se
+        repetem no próprio arquivo ou já foram importadas são contadas em ``duplicates``.
+        Retorna :class:`StatementImportResult`.
+        """
+        result = StatementImportResult()
+        seen = set()
+        chunk = []
+        for number, data in enumerate(transactions, 1):
+            line, entry, items, errors = self.build(data)
+            if errors:
+                result.errors.append((number, errors))
+                continue
+            if line.fitid in seen:
+                result.duplicates += 1
+                continue
+            seen.add(line.fitid)
+            chunk.append((line, entry, items))
+            if len(chunk) >= self.chunk_size:
+                created, duplicates = self.save(chunk)
+                result.created += created
+                result.duplicates += duplicates
+                chunk = []
+        if chunk:
+            created, duplicates = self.save(chunk)
+            result.created += created
+            result.duplicates += duplicates
+        return result
+
+
+def import_statement(empresa_id, account_id, counterpart_id, stream, **kwargs):
+    u"""Importa o extrato OFX do arquivo binário ``stream`` para a conta do banco."""
+    return StatementImporter(empresa_id, account_id, counterpart_id, **kwargs).run(read_transactions(stream))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+u"""Índice em memória dos períodos de cada empresa.
+
+Os períodos de uma empresa são poucos e mudam raramente, mas são consultados a cada
+lançamento validado e a cada cálculo de saldo. O índice mantém os períodos ordenados
+pela data inicial e responde às buscas por data com ``bisect``, sem consultas ao banco.
+Ele é descartado sempre que um período ou exercício da empresa é gravado.
+"""
+
+from bisect import bisect_right
+from datetime import timedelta
+
+from gestaolivre.apps.utils.cache import VersionedCache
+
+from .models import Period
+
+
+class PeriodIndex(object):
+    u"""Períodos de uma empresa ordenados pela data inicial."""
+
+    def __init__(self, periods):
+        u"""Indexa os períodos informados."""
+        self.periods = sorted(periods, key=lambda period: (period.start_date, period.end_date))
+        self.standard = [period for period in self.periods if period.type == Period.STANDARD]
+        self.starts = [period.start_date for period in self.standard]
+        self.by_start = dict((period.start_date, period) for period in reversed(self.periods))
+        self.by_end = dict((period.end_date, period) for period in reversed(self.periods))
+
+    def find(self, day):
+        u"""Obtém o período normal que contém a data, ou ``None``."""
+        index = bisect_right(self.starts, day) - 1
+        if index >= 0 and day <= self.standard[index].end_date:
+            return self.standard[index]
+        return None
+
+    def is_open(self, day):
+        u"""Indica se a data pertence a um período aberto."""
+        period = self.find(day)
+        return period is not None and period.status == Period.OPEN
+
+    def next(self, period):
+        u"""Obtém o período que começa no dia seguinte ao fim do informado."""
+        return self.by_start.get(period.end_date + timedelta(days=1))
+
+    def previous(self, period):
+        u"""Obtém o período que termina no dia anterior ao início do informado."""
+        return self.by_end.get(period.start_date - timedelta(days=1))
+
+    def year(self, year_id):
+        u"""Obtém os períodos do exercício em ordem cronológica."""
+        return [period for period in self.periods if period.year_id == year_id]
+
+    def following(self, period):
+        u"""Obtém os períodos posteriores ao informado, inclusive dos exercícios seguintes.
+
+        São os períodos cujo saldo inicial depende do saldo final do informado, como em
+        :meth:`previous`.
+        """
+        return [other for other in self.periods if other.start_date > period.end_date]
+
+
+def _build(empresa_id):
+    return PeriodIndex(Period.objects.all_empresas().filter(empresa_id=empresa_id))
+
+
+_cache = VersionedCache('contabil.periods', _build)
+
+
+def period_index(empresa_id):
+    u"""Obtém o índice de períodos da empresa."""
+    return _cache.get(empresa_id)
+
+
+def invalidate_periods(empresa_id):
+    u"""Descarta o índice de períodos da empresa em todos os processos."""
+    _cache.invalidate(empresa_id)
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+u"""Conciliação bancária automática.
+
+As linhas de extrato da conta do banco são conciliadas com os itens de lançamento da
+mesma conta pelo valor, por uma janela de tolerância de datas e pela semelhança dos
+históricos. Os itens são agrupados pelo valor em centavos e, em cada grupo, ordenados
+pela data, de modo que os candidatos de cada linha são encontrados com ``bisect``, sem
+comparar todos os pares. Depois das conciliações um para um, os totais diários que
+sobraram permitem conciliar uma linha com vários itens do mesmo dia, e vice-versa.
+
+A importação do extrato gera um lançamento provisório para cada linha. Quando a linha é
+conciliada com um lançamento que já existia, o provisório duplicaria os valores da conta
+do banco e da contrapartida, portanto é apagado e os seus movimentos estornados na mesma
+transação da conciliação. O banco de dados não permite apagar lançamentos de períodos
+fechados, portanto as linhas desses períodos ficam fora da conciliação automática.
+"""
+
+import uuid
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import defaultdict
+from collections import namedtuple
+from datetime import timedelta
+from difflib import SequenceMatcher
+
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
+
+from .balances import apply_movements
+from .balances import incremental_balances
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+from .models import Period
+from .models import Reconciliation
+from .models import StatementLine
+
+
+DATE_TOLERANCE = 3
+
+BATCH_SIZE = 1000
+
+Record = namedtuple('Record', 'ids day cents memo')
+
+DISCARD_SQL = '''
+WITH entries AS (
+    DELETE FROM {entry}
+     WHERE empresa_id = %(empresa)s AND status = %(draft)s
+       AND id IN (SELECT entry_id FROM {line} WHERE id = ANY(%(lines)s::uuid[]))
+    RETURNING id, date
+), lines AS (
+    UPDATE {line} l SET entry_id = NULL FROM entries e WHERE l.entry_id = e.id
+), items AS (
+    DELETE FROM {item} i USING entries e WHERE i.entry_id = e.id
+    RETURNING i.account_id, e.date, i.debit_value, i.credit_value
+)
+SELECT account_id, date, debit_value, credit_value FROM items
+'''
+
+
+def _cents(value):
+    return int(value * 100)
+
+
+def similarity(first, second):
+    u"""Semelhança entre dois históricos, de 0 a 1."""
+    if not first or not second:
+        return 0.0
+    return SequenceMatcher(None, first.lower(), second.lower()).ratio()
+
+
+class AmountIndex(object):
+    u"""Registros agrupados pelo valor e ordenados pela data em cada grupo."""
+
+    def __init__(self, records):
+        u"""Indexa os registros informados."""
+        self.buckets = defaultdict(list)
+        for record in sorted(records, key=lambda record: record.day):
+            self.buckets[record.cents].append(record)
+        self.days = dict((cents, [record.day for record in bucket]) for cents, bucket in self.buckets.items())
+        self.used = set()
+
+    def best(self, record, tolerance):
+        u"""Obtém o registro de mesmo valor mais parecido dentro da janela de datas.
+
+        Retorna ``(registro, nota)`` ou ``(None, 0)``. A nota combina a distância entre
+        as datas e a semelhança dos históricos.
+        """
+        bucket = self.buckets.get(record.cents)
+        if not bucket:
+            return None, 0
+        days = self.days[record.cents]
+        start = bisect_left(days, record.day - tolerance)
+        end = bisect_right(days, record.day + tolerance)
+        found, found_score = None, -1
+        for candidate in bucket[start:end]:
+            if candidate.ids in self.used:
+                continue
+            distance = abs((candidate.day - record.day).days)
+            score = (1 - distance / (tolerance.days + 1)) / 2 + similarity(record.memo, candidate.memo) / 2
+            if score > found_score:
+                found, found_score = candidate, score
+        if found is None:
+            return None, 0
+        self.used.add(found.ids)
+        return found, found_score
+
+
+def _closed(periods, day):
+    return day is not None and any(start <= day <= end for start, end in periods)
+
+
+def _daily_groups(records):
+    groups = defaultdict(list)
+    for record in records:
+        groups[record.day].append(record)
+    return [Record(tuple(i for record in group for i in record.ids), day, sum(record.cents for record in group),
+                   ' '.join(record.memo for record in group))
+            for day, group in groups.items() if len(group) > 1]
+
+
+class Reconciler(object):
+    u"""Concilia automaticamente as linhas de extrato de uma conta de banco em um intervalo."""
+
+    def __init__(self, empresa_id, account_id, start, end, tolerance=DATE_TOLERANCE):
+        u"""Inicializa a conciliação da conta entre ``start`` e ``end``."""
+        self.empresa_id = empresa_id
+        self.account_id = account_id
+        self.start = start
+        self.end = end
+        self.tolerance = timedelta(days=tolerance)
+
+    def statement_lines(self):
+        u"""Linhas de extrato ainda não conciliadas no intervalo.
+
+        Linhas cujo lançamento gerado pela importação já saiu de rascunho ficam de fora:
+        esse lançamento já registra a transação.
+        """
+        return StatementLine.objects.all_empresas().filter(
+            Q(entry__isnull=True) | Q(entry__status=Entry.DRAFT),
+            empresa_id=self.empresa_id, account_id=self.account_id, date__range=(self.start, self.end),
+            reconciliation__isnull=True)
+
+    def entry_items(self, start=None, end=None):
+        u"""Itens de lançamento da conta ainda não conciliados.
+
+        Os lançamentos gerados pela própria importação do extrato não entram na
+        conciliação.
+        """
+        return EntryItem.objects.all_empresas().filter(
+            empresa_id=self.empresa_id, account_id=self.account_id,
+            entry__date__range=(start or self.start, end or self.end), reconciliation__isnull=True,
+            entry__statement_lines__isnull=True)
+
+    def closed_periods(self):
+        u"""Intervalos ``(início, fim)`` dos períodos fechados da empresa.
+
+        Os períodos da empresa ficam bloqueados para leitura até o fim da transação; como
+        ``close_period`` bloqueia todos eles para escrita, nenhum é fechado ou reaberto
+        durante a conciliação.
+        """
+        sql = 'SELECT start_date, end_date, type, status FROM {0} WHERE empresa_id = %s FOR SHARE'.format(
+            Period._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.empresa_id])
+            return [(start, end) for start, end, period_type, status in cursor.fetchall()
+                    if period_type == Period.STANDARD and status == Period.CLOSED]
+
+    def load(self):
+        u"""Carrega as linhas e os itens candidatos como registros.
+
+        Linhas cujo lançamento provisório está em um período fechado não podem ser
+        conciliadas, pois o provisório não pode ser apagado; continuam não conciliadas.
+        """
+        closed = self.closed_periods()
+        lines = [Record((pk,), day, _cents(amount), memo) for pk, day, entry_day, amount, memo in
+                 self.statement_lines().values_list('pk', 'date', 'entry__date', 'amount', 'memo')
+                 if not _closed(closed, day) and not _closed(closed, entry_day)]
+        items = [Record((pk,), day, _cents(debit - credit), memo) for pk, day, debit, credit, memo in
+                 self.entry_items(self.start - self.tolerance, self.end + self.tolerance).values_list(
+                     'pk', 'entry__date', 'debit_value', 'credit_value', 'entry__memo')]
+        return lines, items
+
+    def match(self, lines, items):
+        u"""Encontra as conciliações entre os registros.
+
+        Retorna a lista de ``(tipo, ids das linhas, ids dos itens, nota)``.
+        """
+        matches = []
+        index = AmountIndex(items)
+        remaining = []
+        for line in sorted(lines, key=lambda line: line.day):
+            item, score = index.best(line, self.tolerance)
+            if item is None:
+                remaining.append(line)
+            else:
+                matches.append((Reconciliation.ONE_TO_ONE, line.ids, item.ids, score))
+        items = [item for item in items if item.ids not in index.used]
+
+        index = AmountIndex(_daily_groups(items))
+        lines, remaining = remaining, []
+        for line in lines:
+            group, score = index.best(line, self.tolerance)
+            if group is None:
+                remaining.append(line)
+            else:
+                matches.append((Reconciliation.ONE_TO_MANY, line.ids, group.ids, score))
+        used = set(i for ids in index.used for i in ids)
+        items = [item for item in items if item.ids[0] not in used]
+
+        index = AmountIndex(items)
+        for group in _daily_groups(remaining):
+            item, score = index.best(group, self.tolerance)
+            if item is not None:
+                matches.append((Reconciliation.MANY_TO_ONE, group.ids, item.ids, score))
+        return matches
+
+    def discard_generated(self, line_ids):
+        u"""Apaga os lançamentos provisórios gerados para as linhas e estorna os seus movimentos.
+
+        Somente os lançamentos ainda em rascunho são apagados; a condição é conferida no
+        próprio ``DELETE``, portanto um lançamento confirmado ao mesmo tempo é mantido.
+        Retorna a quantidade de itens apagados.
+        """
+        if not line_ids:
+            return 0
+        sql = DISCARD_SQL.format(entry=Entry._meta.db_table, line=StatementLine._meta.db_table,
+                                 item=EntryItem._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {'empresa': self.empresa_id, 'draft': Entry.DRAFT,
+                                 'lines': [str(pk) for pk in line_ids]})
+            removed = cursor.fetchall()
+        if removed and incremental_balances():
+            apply_movements(self.empresa_id, [(account_id, day, -debit, -credit)
+                                              for account_id, day, debit, credit in removed])
+        return len(removed)
+
+    def save(self, matches):
+        u"""Grava as conciliações, associa a elas as linhas e os itens e apaga os provisórios das linhas."""
+        reconciliations = []
+        lines, items = [], []
+        for kind, line_ids, item_ids, score in matches:
+            reconciliation = Reconciliation(id=uuid.uuid4(), empresa_id=self.empresa_id,
+                                            account_id=self.account_id, kind=kind, score=round(score, 4))
+            reconciliations.append(reconciliation)
+            lines.extend((pk, reconciliation.pk) for pk in line_ids)
+            items.extend((pk, reconciliation.pk) for pk in item_ids)
+        Reconciliation.objects.bulk_create(reconciliations, batch_size=BATCH_SIZE)
+        _link(StatementLine, lines)
+        _link(EntryItem, items)
+        self.discard_generated([pk for pk, _ in lines])
+
+    def run(self):
+        u"""Concilia a conta no intervalo e retorna o resumo da conciliação."""
+        with transaction.atomic():
+            # Serializa conciliações simultâneas da mesma conta.
+            list(Conta.objects.all_empresas().select_for_update().filter(pk=self.account_id).values_list('pk'))
+            lines, items = self.load()
+            matches = self.match(lines, items)
+            self.save(matches)
+            summary = {'one_to_one': 0, 'one_to_many': 0, 'many_to_one': 0}
+            names = {Reconciliation.ONE_TO_ONE: 'one_to_one', Reconciliation.ONE_TO_MANY: 'one_to_many',
+                     Reconciliation.MANY_TO_ONE: 'many_to_one'}
+            for kind, _, _, _ in matches:
+                summary[names[kind]] += 1
+            # Inclui as linhas dos períodos fechados, que ficaram fora da conciliação.
+            summary['unmatched_lines'] = self.statement_lines().count()
+        return summary
+
+    def unmatched(self):
+        u"""Linhas de extrato e itens de lançamento não conciliados no intervalo."""
+        return {
+            'statement_lines': [
+                {'id': pk, 'date': day, 'fitid': fitid, 'amount': str(amount), 'memo': memo}
+                for pk, day, fitid, amount, memo in self.statement_lines().order_by('date').values_list(
+                    'pk', 'date', 'fitid', 'amount', 'memo')],
+            'entry_items': [
+                {'id': pk, 'entry': entry, 'date': day, 'memo': memo, 'debit_value': str(debit),
+                 'credit_value': str(credit)}
+                for pk, entry, day, memo, debit, credit in self.entry_items().order_by('entry__date').values_list(
+                    'pk', 'entry', 'entry__date', 'entry__memo', 'debit_value', 'credit_value')],
+        }
+
+
+def _link(model, pairs):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), BATCH_SIZE):
+            batch = pairs[start:start + BATCH_SIZE]
+            values = ', '.join(['(%s::uuid, %s::uuid)'] * len(batch))
+            params = [str(value) for pair in batch for value in pair]
+            cursor.execute(
+                'UPDATE {0} AS t SET reconciliation_id = v.reconciliation_id '
+                'FROM (VALUES {1}) AS v(id, reconciliation_id) WHERE t.id = v.id'.format(table, values), params)
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+u"""Relatórios em PDF: Diário, Razão e Balancete.
+
+Os relatórios têm leiaute fixo, uma linha de texto por linha do relatório, de modo que a
+página de cada linha é conhecida antes de desenhar qualquer página. O processo principal
+percorre apenas as chaves das linhas (com a quantidade de linhas de cada uma) e divide o
+relatório em blocos de páginas; cada bloco é desenhado por um processo de um ``Pool``, que
+lê somente as suas linhas, com cursor do servidor e conexão própria, e grava um PDF
+parcial. As partes são concatenadas na ordem ao final.
+"""
+
+import os
+import shutil
+import tempfile
+import uuid
+from collections import namedtuple
+from itertools import islice
+from multiprocessing import Pool
+
+from django.db import connection
+from django.db import connections
+
+from PyPDF2 import PdfFileMerger
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen.canvas import Canvas
+
+from gestaolivre.apps.geral.models import Empresa
+from gestaolivre.apps.utils.db import server_side_rows
+
+from .balances import opening_balance
+from .balances import stored_balances
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+from .models import Period
+from .snapshots import snapshot_of
+from .tree import chart_tree
+
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 36
+FONT = 'Helvetica'
+FONT_BOLD = 'Helvetica-Bold'
+FONT_SIZE = 8
+LINE_HEIGHT = 11
+HEADER_HEIGHT = 48
+FOOTER_HEIGHT = 24
+LINES_PER_PAGE = int((PAGE_HEIGHT - 2 * MARGIN - HEADER_HEIGHT - FOOTER_HEIGHT) // LINE_HEIGHT)
+
+CHUNK_PAGES = 200
+
+ZERO_UUID = uuid.UUID(int=0)
+
+Column = namedtuple('Column', 'title x size align')
+
+Task = namedtuple('Task', 'report index start skip lines first_page directory')
+
+
+def money(value):
+    u"""Formata um valor no padrão brasileiro, vazio para zero."""
+    if not value:
+        return ''
+    return '{0:,.2f}'.format(value).replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def balance(value):
+    u"""Formata um saldo com o indicador de devedor (D) ou credor (C)."""
+    return '{0} {1}'.format(money(abs(value)) or '0,00', 'C' if value >= 0 else 'D')
+
+
+def _day(value):
+    return value.strftime('%d/%m/%Y') if value else ''
+
+
+class Report(object):
+    u"""Relatório de leiaute fixo.
+
+    As subclasses definem ``title``, ``columns``, :meth:`keys` e :meth:`rows`. O objeto é
+    enviado aos processos do ``Pool``, portanto guarda somente valores simples.
+    """
+
+    title = ''
+    columns = ()
+
+    def __init__(self, empresa_id, subtitle=''):
+        u"""Inicializa o relatório da empresa, com o cabeçalho montado uma única vez."""
+        empresa = Empresa.objects.get(pk=empresa_id)
+        self.empresa_id = empresa_id
+        self.heading = '{0} - CNPJ {1}'.format(empresa.razao_social, empresa.cnpj)
+        self.subtitle = subtitle
+
+    def keys(self):
+        u"""Gera, na ordem do relatório, ``(chave, quantidade de linhas)`` de cada registro."""
+        raise NotImplementedError
+
+    def rows(self, start):
+        u"""Gera ``(valores, negrito)`` de cada linha, a partir da primeira linha da chave ``start``."""
+        raise NotImplementedError
+
+
+class JournalReport(Report):
+    u"""Livro Diário: cada lançamento seguido das suas partidas."""
+
+    title = 'Livro Diário'
+    columns = (
+        Column('Data', MARGIN, 12, 'left'),
+        Column('Histórico / Conta', MARGIN + 58, 60, 'left'),
+        Column('Débito', PAGE_WIDTH - MARGIN - 90, 16, 'right'),
+        Column('Crédito', PAGE_WIDTH - MARGIN, 16, 'right'),
+    )
+
+    KEYS_SQL = '''
+    SELECT e.date, e.id, COUNT(*)
+      FROM {entry} e
+      JOIN {item} i ON i.entry_id = e.id
+     WHERE e.empresa_id = %s AND e.date >= %s AND e.date <= %s
+     GROUP BY e.date, e.id
+     ORDER BY e.date, e.id
+    '''
+
+    ROWS_SQL = '''
+    SELECT e.date, e.id, e.memo, a.codigo, a.nome, i.debit_value, i.credit_value
+      FROM {entry} e
+      JOIN {item} i ON i.entry_id = e.id
+      JOIN {conta} a ON a.id = i.account_id
+     WHERE e.empresa_id = %s AND (e.date, e.id) >= (%s::date, %s::uuid) AND e.date <= %s
+     ORDER BY e.date, e.id, i.debit_value = 0, a.codigo, i.id
+    '''
+
+    def __init__(self, empresa_id, start, end):
+        u"""Inicializa o Diário entre as datas informadas."""
+        super(JournalReport, self).__init__(empresa_id, '{0} a {1}'.format(_day(start), _day(end)))
+        self.start = start
+        self.end = end
+
+    def _sql(self, sql):
+        return sql.format(entry=Entry._meta.db_table, item=EntryItem._meta.db_table, conta=Conta._meta.db_table)
+
+    def keys(self):
+        u"""Chaves ``(data, lançamento)``: uma linha do lançamento mais uma por partida."""
+        for day, entry_id, items in server_side_rows(self._sql(self.KEYS_SQL), [self.empresa_id, self.start,
+                                                                                self.end]):
+            yield (day, entry_id), items + 1
+
+    def rows(self, start):
+        u"""Linhas dos lançamentos a partir da chave ``start``."""
+        day, entry_id = start
+        current = None
+        for day, entry_id, memo, codigo, nome, debit, credit in server_side_rows(
+                self._sql(self.ROWS_SQL), [self.empresa_id, day, str(entry_id), self.end]):
+            if entry_id != current:
+                current = entry_id
+                yield (_day(day), memo, '', ''), True
+            yield ('', '    {0} - {1}'.format(codigo, nome), money(debit), money(credit)), False
+
+
+class LedgerReport(Report):
+    u"""Razão de uma conta (com as suas filhas), com saldo acumulado linha a linha."""
+
+    title = 'Razão'
+    columns = (
+        Column('Data', MARGIN, 12, 'left'),
+        Column('Histórico', MARGIN + 50, 42, 'left'),
+        Column('Conta', MARGIN + 240, 14, 'left'),
+        Column('Débito', PAGE_WIDTH - MARGIN - 150, 16, 'right'),
+        Column('Crédito', PAGE_WIDTH - MARGIN - 80, 16, 'right'),
+        Column('Saldo', PAGE_WIDTH - MARGIN, 18, 'right'),
+    )
+
+    ITEMS_SQL = '''
+    SELECT {fields}
+      FROM {item} i
+      JOIN {entry} e ON e.id = i.entry_id
+      JOIN {conta} a ON a.id = i.account_id
+     WHERE i.empresa_id = %s
+       AND a.tree_id = %s AND a.lft BETWEEN %s AND %s
+       AND e.date >= %s AND e.date <= %s
+       AND (e.date, e.id, i.id) {operator} (%s::date, %s::uuid, %s::uuid)
+     {order}
+    '''
+
+    def __init__(self, empresa_id, account_id, start, end):
+        u"""Inicializa o Razão da conta entre as datas informadas."""
+        account = Conta.objects.all_empresas().get(pk=account_id, empresa_id=empresa_id)
+        super(LedgerReport, self).__init__(empresa_id, '{0} - {1}: {2} a {3}'.format(
+            account.codigo, account.nome, _day(start), _day(end)))
+        self.account_id = account_id
+        self.start = start
+        self.end = end
+
+    def _items(self, fields, operator, key, order=''):
+        account = chart_tree(self.empresa_id).node(self.account_id)
+        sql = self.ITEMS_SQL.format(fields=fields, item=EntryItem._meta.db_table, entry=Entry._meta.db_table,
+                                    conta=Conta._meta.db_table, operator=operator, order=order)
+        return sql, [self.empresa_id, account.tree_id, account.lft, account.rght, self.start, self.end] + [
+            key[0], str(key[1]), str(key[2])]
+
+    def keys(self):
+        u"""A linha do saldo anterior (chave ``None``) e uma chave por partida."""
+        yield None, 1
+        sql, params = self._items('e.date, e.id, i.id', '>=', (self.start, ZERO_UUID, ZERO_UUID),
+                                  'ORDER BY e.date, e.id, i.id')
+        for key in server_side_rows(sql, params):
+            yield key, 1
+
+    def rows(self, start):
+        u"""Linhas do Razão a partir da chave ``start``, com o saldo acumulado até ela."""
+        account = Conta.objects.all_empresas().get(pk=self.account_id)
+        running = opening_balance(account, self.start)
+        if start is None:
+            yield ('', 'Saldo anterior', '', '', '', balance(running)), True
+            start = (self.start, ZERO_UUID, ZERO_UUID)
+        else:
+            sql, params = self._items('COALESCE(SUM(i.credit_value - i.debit_value), 0)', '<', start)
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                running += cursor.fetchone()[0]
+        sql, params = self._items('e.date, e.memo, a.codigo, i.debit_value, i.credit_value', '>=', start,
+                                  'ORDER BY e.date, e.id, i.id')
+        for day, memo, codigo, debit, credit in server_side_rows(sql, params):
+            running += credit - debit
+            yield (_day(day), memo, codigo, money(debit), money(credit), balance(running)), False
+
+
+class TrialBalanceReport(Report):
+    u"""Balancete de verificação de um período."""
+
+    title = 'Balancete de Verificação'
+    columns = (
+        Column('Conta', MARGIN, 60, 'left'),
+        Column('Saldo anterior', PAGE_WIDTH - MARGIN - 210, 18, 'right'),
+        Column('Débitos', PAGE_WIDTH - MARGIN - 140, 16, 'right'),
+        Column('Créditos', PAGE_WIDTH - MARGIN - 75, 16, 'right'),
+        Column('Saldo atual', PAGE_WIDTH - MARGIN, 18, 'right'),
+    )
+
+    def __init__(self, empresa_id, period):
+        u"""Inicializa o Balancete do período."""
+        super(TrialBalanceReport, self).__init__(empresa_id, '{0} a {1}'.format(_day(period.start_date),
+                                                                                _day(period.end_date)))
+        self.period_id = period.pk
+        self.closed = period.status == Period.CLOSED
+
+    def _balances(self):
+        saldos = snapshot_of(self.period_id) if self.closed else None
+        if saldos is None:
+            period = Period.objects.all_empresas().get(pk=self.period_id)
+            saldos = dict((account_id, (saldo.initial_balance, saldo.debit_value, saldo.credit_value,
+                                        saldo.final_balance))
+                          for (_, account_id), saldo in stored_balances(self.empresa_id, [period]).items())
+        return [(node, saldos[node.id]) for node in chart_tree(self.empresa_id).order
+                if node.id in saldos and any(saldos[node.id])]
+
+    def keys(self):
+        u"""Uma chave, a posição no balancete, por conta com saldo ou movimento."""
+        for position in range(len(self._balances())):
+            yield position, 1
+
+    def rows(self, start):
+        u"""Linhas do Balancete a partir da posição ``start``."""
+        for node, (initial, debit, credit, final) in self._balances()[start:]:
+            label = '{0}{1} - {2}'.format('  ' * node.level, node.codigo, node.nome)
+            yield (label, balance(initial), money(debit), money(credit), balance(final)), not node.is_leaf
+
+
+class PageWriter(object):
+    u"""Desenha as linhas de um relatório, quebrando as páginas e numerando-as."""
+
+    def __init__(self, canvas, report, first_page):
+        u"""Prepara o modelo de cabeçalho da parte, desenhado uma vez e reutilizado em cada página."""
+        self.canvas = canvas
+        self.report = report
+        self.page = first_page - 1
+        self.pages = 0
+        self.line = LINES_PER_PAGE
+        self.top = PAGE_HEIGHT - MARGIN - HEADER_HEIGHT
+        canvas.beginForm('header')
+        canvas.setFont(FONT_BOLD, FONT_SIZE + 4)
+        canvas.drawString(MARGIN, PAGE_HEIGHT - MARGIN - 10, report.title)
+        canvas.setFont(FONT, FONT_SIZE)
+        canvas.drawString(MARGIN, PAGE_HEIGHT - MARGIN - 24, report.heading)
+        canvas.drawString(MARGIN, PAGE_HEIGHT - MARGIN - 35, report.subtitle)
+        canvas.setFont(FONT_BOLD, FONT_SIZE)
+        self._draw(report.columns, [column.title for column in report.columns], self.top + LINE_HEIGHT - 2)
+        canvas.line(MARGIN, self.top + 5, PAGE_WIDTH - MARGIN, self.top + 5)
+        canvas.endForm()
+
+    def _draw(self, columns, values, y):
+        for column, value in zip(columns, values):
+            value = str(value)[:column.size * 2 if column.align == 'left' else None]
+            if column.align == 'right':
+                self.canvas.drawRightString(column.x, y, value)
+            else:
+                self.canvas.drawString(column.x, y, value)
+
+    def new_page(self):
+        u"""Fecha a página atual e inicia outra com cabeçalho e rodapé."""
+        if self.pages:
+            self.canvas.showPage()
+        self.page += 1
+        self.pages += 1
+        self.line = 0
+        self.canvas.doForm('header')
+        self.canvas.setFont(FONT, FONT_SIZE)
+        self.canvas.drawRightString(PAGE_WIDTH - MARGIN, MARGIN, 'Página {0}'.format(self.page))
+
+    def write(self, values, bold=False):
+        u"""Desenha uma linha do relatório."""
+        if self.line >= LINES_PER_PAGE:
+            self.new_page()
+        self.canvas.setFont(FONT_BOLD if bold else FONT, FONT_SIZE)
+        self._draw(self.report.columns, values, self.top - self.line * LINE_HEIGHT)
+        self.line += 1
+
+    def finish(self):
+        u"""Fecha a última página; um relatório vazio tem uma página só com o cabeçalho."""
+        if not self.pages:
+            self.new_page()
+        self.canvas.showPage()
+
+
+def plan(report, chunk_pages=CHUNK_PAGES):
+    u"""Divide o relatório em blocos de páginas.
+
+    Retorna a lista de ``(chave inicial, linhas a pular, linhas, primeira página)``: cada
+    bloco começa na primeira linha de uma página, possivelmente no meio de um registro.
+    """
+    chunk_lines = chunk_pages * LINES_PER_PAGE
+    chunks = []
+    total = 0
+    for key, lines in report.keys():
+        boundary = len(chunks) * chunk_lines
+        while total + lines > boundary:
+            chunks.append([key, boundary - total, chunk_lines, len(chunks) * chunk_pages + 1])
+            boundary += chunk_lines
+        total += lines
+    if chunks:
+        chunks[-1][2] = total - (len(chunks) - 1) * chunk_lines
+    return [tuple(chunk) for chunk in chunks]
+
+
+def _init_worker():
+    # Carrega as métricas das fontes uma única vez por processo.
+    for font in (FONT, FONT_BOLD):
+        pdfmetrics.getFont(font)
+
+
+def render_part(task):
+    u"""Desenha um bloco de páginas em um PDF parcial, retornando ``(arquivo, páginas)``."""
+    path = os.path.join(task.directory, 'part-{0:06d}.pdf'.format(task.index))
+    canvas = Canvas(path, pagesize=A4, pageCompression=1)
+    writer = PageWriter(canvas, task.report, task.first_page)
+    rows = task.report.rows(task.start)
+    try:
+        for values, bold in islice(rows, task.skip, task.skip + task.lines):
+            writer.write(values, bold)
+    finally:
+        rows.close()
+    writer.finish()
+    canvas.save()
+    return path, writer.pages
+
+
+def render(report, path, processes=None, chunk_pages=CHUNK_PAGES):
+    u"""Gera o relatório em ``path``, desenhando os blocos de páginas em paralelo.
+
+    Retorna a quantidade de páginas. As conexões com o banco são fechadas antes de criar
+    os processos, de modo que cada processo abre a sua.
+    """
+    directory = tempfile.mkdtemp(prefix='gestaolivre-report-')
+    try:
+        tasks = [Task(report, index, start, skip, lines, first_page, directory)
+                 for index, (start, skip, lines, first_page) in enumerate(plan(report, chunk_pages))]
+        if not tasks:
+            tasks = [Task(report, 0, None, 0, 0, 1, directory)]
+        if len(tasks) == 1 or processes == 1:
+            _init_worker()
+            parts = [render_part(task) for task in tasks]
+        else:
+            connections.close_all()
+            pool = Pool(processes, initializer=_init_worker)
+            try:
+                parts = list(pool.imap(render_part, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        if len(parts) == 1:
+            shutil.move(parts[0][0], path)
+        else:
+            merger = PdfFileMerger()
+            for part, _ in parts:
+                merger.append(part)
+            with open(path, 'wb') as output:
+                merger.write(output)
+            merger.close()
+        return sum(pages for _, pages in parts)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+u"""Cópias imutáveis dos saldos dos períodos fechados.
+
+Ao fechar um período, os saldos de todas as contas são gravados em uma única linha, com
+uma soma de verificação. Os relatórios, demonstrações e saldos em uma data leem os
+períodos fechados dessas cópias, que ficam em cache em cada processo, sem voltar aos
+lançamentos ou aos saldos periódicos.
+"""
+
+import hashlib
+import json
+import uuid
+from decimal import Decimal
+
+from gestaolivre.apps.utils.cache import VersionedCache
+
+from .models import Period
+from .models import PeriodSnapshot
+
+
+def checksum(balances):
+    u"""Soma de verificação SHA-256 da representação canônica dos saldos."""
+    text = json.dumps(balances, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def snapshot_balances(period):
+    u"""Saldos gravados do período no formato da cópia: ``{conta: [inicial, débito, crédito, final]}``."""
+    from .balances import stored_balances
+    return dict((str(account_id), [str(saldo.initial_balance), str(saldo.debit_value), str(saldo.credit_value),
+                                   str(saldo.final_balance)])
+                for (_, account_id), saldo in stored_balances(period.empresa_id, [period]).items())
+
+
+def create_snapshot(period):
+    u"""Grava a cópia dos saldos do período."""
+    balances = snapshot_balances(period)
+    return PeriodSnapshot.objects.create(empresa_id=period.empresa_id, period=period, balances=balances,
+                                         checksum=checksum(balances))
+
+
+def _build(period_id):
+    balances = PeriodSnapshot.objects.all_empresas().filter(period_id=period_id).values_list(
+        'balances', flat=True).first()
+    if balances is None:
+        return None
+    return dict((uuid.UUID(account_id), tuple(Decimal(value) for value in values))
+                for account_id, values in balances.items())
+
+
+_cache = VersionedCache('contabil.snapshots', _build, ttl=60)
+
+
+def period_snapshot(period):
+    u"""Saldos do período fechado, ``{conta: (inicial, débito, crédito, final)}``, ou ``None``.
+
+    Períodos abertos não têm cópia e retornam ``None`` sem consultar o banco.
+    """
+    if period.status != Period.CLOSED:
+        return None
+    return snapshot_of(period.pk)
+
+
+def snapshot_of(period_id):
+    u"""Saldos da cópia do período pelo id, ou ``None`` se o período não tiver cópia."""
+    return _cache.get(period_id)
+
+
+def invalidate_snapshot(period):
+    u"""Descarta a cópia do período em todos os processos."""
+    _cache.invalidate(period.pk)
+
+
+def verify_snapshot(snapshot):
+    u"""Confere a soma de verificação da cópia gravada."""
+    return checksum(snapshot.balances) == snapshot.checksum
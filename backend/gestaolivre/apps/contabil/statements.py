@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+u"""Demonstrações contábeis: Balanço Patrimonial e DRE.
+
+Os saldos periódicos de uma empresa são carregados em matrizes densas do NumPy, com uma
+linha por conta, na ordem da árvore, e uma coluna por período. As demonstrações,
+comparativos, acumulados do exercício e variações são calculados com operações
+vetorizadas sobre essas matrizes. Os valores são mantidos em centavos, como inteiros.
+"""
+
+from decimal import Decimal
+
+import numpy as np
+
+from .balances import stored_balances
+from .models import Conta
+from .snapshots import period_snapshot
+from .tree import chart_tree
+
+
+BALANCE_SHEET_GROUPS = ('1', '2')
+INCOME_STATEMENT_GROUPS = ('3', '4', '5', '6', '7', '8', '9')
+
+CENTS = Decimal('0.01')
+
+
+class BalanceMatrix(object):
+    u"""Saldos de uma empresa em uma matriz conta × período."""
+
+    def __init__(self, accounts, periods, initial, debit, credit):
+        u"""Inicializa a matriz.
+
+        ``accounts`` é a lista de ``(id, código, nome, nível, natureza)`` na ordem da
+        árvore, ``periods`` a lista de períodos em ordem cronológica e ``initial``,
+        ``debit`` e ``credit`` matrizes de centavos com ``len(accounts)`` linhas e
+        ``len(periods)`` colunas.
+        """
+        self.accounts = accounts
+        self.periods = periods
+        self.initial = initial
+        self.debit = debit
+        self.credit = credit
+        self.codes = np.array([account[1] for account in accounts], dtype=object)
+        self.levels = np.array([account[3] for account in accounts], dtype=np.int64)
+        self.signs = np.array([-1 if account[4] == Conta.DEBITO else 1 for account in accounts], dtype=np.int64)
+
+    @classmethod
+    def load(cls, empresa_id, periods):
+        u"""Carrega os saldos da empresa nos períodos.
+
+        Os períodos fechados são lidos das cópias de saldos; os abertos, dos saldos
+        periódicos somados às variações ainda não compactadas.
+        """
+        periods = sorted(periods, key=lambda period: (period.start_date, period.end_date))
+        accounts = [(node.id, node.codigo, node.nome, node.level, node.nature)
+                    for node in chart_tree(empresa_id).order]
+        account_index = dict((account[0], index) for index, account in enumerate(accounts))
+        period_index = dict((period.pk, index) for index, period in enumerate(periods))
+        snapshots = dict((period.pk, period_snapshot(period)) for period in periods)
+        rows = [(account_id, period_id, values[0], values[1], values[2])
+                for period_id, snapshot in snapshots.items() if snapshot is not None
+                for account_id, values in snapshot.items() if account_id in account_index]
+        open_periods = [period for period in periods if snapshots[period.pk] is None]
+        if open_periods:
+            rows.extend((account_id, period_id, saldo.initial_balance, saldo.debit_value, saldo.credit_value)
+                        for (period_id, account_id), saldo in stored_balances(empresa_id, open_periods).items()
+                        if account_id in account_index)
+        shape = (len(accounts), len(periods))
+        initial, debit, credit = np.zeros(shape, np.int64), np.zeros(shape, np.int64), np.zeros(shape, np.int64)
+        if rows:
+            account_ids, period_ids, initials, debits, credits = zip(*rows)
+            position = (np.array([account_index[pk] for pk in account_ids]),
+                        np.array([period_index[pk] for pk in period_ids]))
+            initial[position] = _cents(initials)
+            debit[position] = _cents(debits)
+            credit[position] = _cents(credits)
+        return cls(accounts, periods, initial, debit, credit)
+
+    @property
+    def final(self):
+        u"""Saldos finais: saldo inicial mais créditos menos débitos."""
+        return self.initial + self.credit - self.debit
+
+    @property
+    def movement(self):
+        u"""Movimento líquido de cada período: créditos menos débitos."""
+        return self.credit - self.debit
+
+    def year_to_date(self, values):
+        u"""Acumula ``values`` ao longo das colunas, reiniciando a cada exercício."""
+        totals = np.cumsum(values, axis=1)
+        year_start = np.zeros(len(self.periods), np.int64)
+        for index in range(1, len(self.periods)):
+            same_year = self.periods[index].year_id == self.periods[index - 1].year_id
+            year_start[index] = year_start[index - 1] if same_year else index
+        before = np.where(year_start > 0, totals[:, year_start - 1], 0)
+        return totals - before
+
+    def rows_in(self, groups, max_level=None):
+        u"""Máscara das contas cujo código começa por um dos grupos informados."""
+        mask = np.array([code.split('.')[0] in groups for code in self.codes], dtype=bool)
+        if max_level is not None:
+            mask &= self.levels <= max_level
+        return mask
+
+    def balance_sheet(self, max_level=None):
+        u"""Balanço Patrimonial: saldo final de cada período."""
+        return Statement(self, self.rows_in(BALANCE_SHEET_GROUPS, max_level), self.final)
+
+    def income_statement(self, max_level=None, cumulative=False):
+        u"""DRE: resultado de cada período ou, com ``cumulative``, acumulado no exercício."""
+        values = self.year_to_date(self.movement) if cumulative else self.movement
+        return Statement(self, self.rows_in(INCOME_STATEMENT_GROUPS, max_level), values)
+
+
+class Statement(object):
+    u"""Uma demonstração: contas selecionadas da matriz e os valores de cada período."""
+
+    def __init__(self, matrix, mask, values):
+        u"""Seleciona as linhas da matriz e apresenta os valores pela natureza da conta."""
+        self.matrix = matrix
+        self.indexes = np.flatnonzero(mask)
+        self.values = values[self.indexes] * matrix.signs[self.indexes, np.newaxis]
+
+    def variance(self, base=None):
+        u"""Variação absoluta e percentual de cada coluna.
+
+        Sem ``base``, cada coluna é comparada com a anterior (a primeira não tem
+        variação); com ``base``, todas são comparadas com a coluna desse índice.
+        """
+        if base is None:
+            reference = np.concatenate([self.values[:, :1], self.values[:, :-1]], axis=1)
+        else:
+            reference = np.repeat(self.values[:, base:base + 1], self.values.shape[1], axis=1)
+        absolute = self.values - reference
+        percent = np.zeros(absolute.shape)
+        np.divide(absolute * 100.0, np.abs(reference), out=percent, where=reference != 0)
+        return absolute, percent
+
+    def nonzero(self):
+        u"""Remove as contas sem valor em todos os períodos."""
+        keep = np.any(self.values != 0, axis=1)
+        self.indexes = self.indexes[keep]
+        self.values = self.values[keep]
+        return self
+
+    def as_dict(self, variance=False, base=None):
+        u"""Representa a demonstração em tipos serializáveis, com valores em reais."""
+        columns = [str(period) for period in self.matrix.periods]
+        data = {'columns': columns, 'rows': []}
+        absolute, percent = self.variance(base) if variance else (None, None)
+        values = self.values.tolist()
+        for row, index in enumerate(self.indexes.tolist()):
+            _, codigo, nome, level, _ = self.matrix.accounts[index]
+            line = {'codigo': codigo, 'nome': nome, 'level': level, 'values': [_money(v) for v in values[row]]}
+            if variance:
+                line['variance'] = [_money(v) for v in absolute[row].tolist()]
+                line['variance_percent'] = [round(v, 2) for v in percent[row].tolist()]
+            data['rows'].append(line)
+        return data
+
+
+def _cents(values):
+    return np.array([int(value * 100) for value in values], dtype=np.int64)
+
+
+def _money(cents):
+    return str((Decimal(cents) * CENTS).quantize(CENTS))
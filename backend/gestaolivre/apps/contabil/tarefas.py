@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+u"""Tarefas em segundo plano do aplicativo contábil.
+
+Os parâmetros chegam como gravados em JSON: ids como texto e datas no formato
+``AAAA-MM-DD``.
+"""
+
+from django.utils.dateparse import parse_date
+
+from gestaolivre.apps.tarefas.execucao import TarefaError
+from gestaolivre.apps.tarefas.execucao import registrar
+
+from .balances import calculate_fiscal_year
+from .balances import compact_balances
+from .closing import ClosingError
+from .closing import close_period
+from .ecd import export_ecd
+from .models import FiscalYear
+from .models import Period
+from .reports import JournalReport
+from .reports import LedgerReport
+from .reports import TrialBalanceReport
+from .reports import render
+
+
+REPORTS = ('journal', 'ledger', 'trial-balance')
+
+
+@registrar('contabil.ecd')
+def ecd(contexto, fiscal_year):
+    u"""Gera o arquivo da ECD do exercício."""
+    fiscal_year = FiscalYear.objects.select_related('empresa').get(pk=fiscal_year)
+    compact_balances(fiscal_year.empresa_id)
+    contexto.progresso(0, mensagem='Gerando a ECD de {0}.'.format(fiscal_year.year))
+    lines = export_ecd(fiscal_year.empresa, fiscal_year, contexto.arquivo('ECD-{0}.txt'.format(fiscal_year.year)))
+    return {'lines': lines}
+
+
+@registrar('contabil.recompute')
+def recompute(contexto, fiscal_year):
+    u"""Recalcula os saldos de todos os períodos do exercício."""
+    fiscal_year = FiscalYear.objects.get(pk=fiscal_year)
+
+    def progress(period, index, total):
+        contexto.progresso(index, total, str(period))
+
+    return {'balances': len(calculate_fiscal_year(fiscal_year, progress))}
+
+
+@registrar('contabil.close_period')
+def close(contexto, period):
+    u"""Fecha o período."""
+    try:
+        period = close_period(Period.objects.get(pk=period))
+    except ClosingError as error:
+        raise TarefaError(str(error))
+    return {'period': str(period.pk), 'status': period.status}
+
+
+@registrar('contabil.report')
+def report(contexto, report, start=None, end=None, account=None, period=None, processes=None):
+    u"""Gera um relatório em PDF: Diário, Razão ou Balancete."""
+    empresa_id = contexto.tarefa.empresa_id
+    if report == 'trial-balance':
+        instance = TrialBalanceReport(empresa_id, Period.objects.get(pk=period))
+    elif report == 'journal':
+        instance = JournalReport(empresa_id, parse_date(start), parse_date(end))
+    elif report == 'ledger':
+        instance = LedgerReport(empresa_id, account, parse_date(start), parse_date(end))
+    else:
+        raise TarefaError('Relatório desconhecido: {0}.'.format(report))
+    contexto.progresso(0, mensagem='Gerando o relatório.')
+    return {'pages': render(instance, contexto.arquivo('{0}.pdf'.format(report)), processes)}
@@ -0,0 +1,873 @@
+# -*- coding: utf-8 -*-
+u"""Testes do aplicativo contábil."""
+
+import csv
+import io
+import os
+import tempfile
+import threading
+import uuid
+from datetime import date
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from django.core.exceptions import ValidationError
+from django.db import TransactionManagementError
+from django.db import connection
+from django.db import transaction
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.utils import timezone
+
+from gestaolivre.apps.geral.models import Empresa
+from gestaolivre.apps.geral.models import current_empresa
+
+from .balances import ClosedPeriodError
+from .balances import apply_movements
+from .balances import balance_at
+from .balances import calculate_fiscal_year
+from .balances import calculate_period
+from .balances import compact_balances
+from .balances import opening_balance
+from .balances import roll_up
+from .balances import stored_balances
+from .balances import verify_period
+from .balances import Saldo
+from .chart import ChartImportError
+from .chart import build_chart
+from .closing import close_period
+from .ecd import ecd_lines
+from .export import ENTRIES
+from .export import copy_csv
+from .export import csv_chunks
+from .journal import EntryImporter
+from .journal import check_utf8
+from .journal import import_entries
+from .ledger import InvalidCursor
+from .ledger import ledger_page
+from .maintenance import by_size
+from .maintenance import run
+from .models import BalanceDelta
+from .models import Conta
+from .models import Entry
+from .models import EntryItem
+from .models import FiscalYear
+from .models import Period
+from .models import PeriodicBalance
+from .models import PeriodSnapshot
+from .models import Reconciliation
+from .models import StatementLine
+from .ofx import read_transactions
+from .periods import PeriodIndex
+from .periods import period_index
+from .reconciliation import AmountIndex
+from .reconciliation import Reconciler
+from .reconciliation import Record
+from .reports import LINES_PER_PAGE
+from .reports import plan
+from .statements import BalanceMatrix
+from .tree import ChartTree
+from .workflow import INVALID
+from .workflow import LOCKED
+from .workflow import UNBALANCED
+from .workflow import UPDATED
+from .workflow import transition_entries
+
+
+EMPRESA = uuid.uuid4()
+
+
+def _ids(count):
+    return [uuid.uuid4() for _ in range(count)]
+
+
+def _empresa():
+    u"""Cria uma empresa com uma conta analítica de natureza devedora."""
+    empresa = Empresa.objects.create(cnpj='11222333000181', razao_social='Empresa', nome_fantasia='Empresa')
+    account = Conta.objects.create(empresa=empresa, codigo='1', nome='Caixa', nature=Conta.DEBITO)
+    return empresa, account
+
+
+def _periods(empresa, year):
+    u"""Cria o exercício, com os seus doze períodos, e os retorna em ordem."""
+    fiscal_year = FiscalYear.objects.create(empresa=empresa, year=year, start_date=date(year, 1, 1),
+                                            end_date=date(year, 12, 31))
+    return period_index(empresa.pk).year(fiscal_year.pk)
+
+
+def _post(account, day, debit=0, credit=0):
+    u"""Grava um lançamento de um único item na conta."""
+    entry = Entry.objects.create(empresa_id=account.empresa_id, date=day, memo='Teste', value=debit or credit)
+    return EntryItem.objects.create(empresa_id=account.empresa_id, entry=entry, account=account,
+                                    debit_value=debit, credit_value=credit)
+
+
+class RollUpTest(SimpleTestCase):
+    u"""Propagação dos totais às contas sintéticas."""
+
+    def test_totals_reach_every_ancestor(self):
+        u"""Cada conta soma os totais das suas descendentes, sem misturar árvores."""
+        a, b, c, d, e = _ids(5)
+        accounts = [(a, 1, 1, 8), (b, 1, 2, 5), (c, 1, 3, 4), (d, 1, 6, 7), (e, 2, 1, 2)]
+        totals = {c: (Decimal('10'), Decimal('1')), d: (Decimal('5'), Decimal('2')), e: (Decimal('3'), Decimal('3'))}
+        result = roll_up(accounts, totals)
+        self.assertEqual(result[a], [Decimal('15'), Decimal('3')])
+        self.assertEqual(result[b], [Decimal('10'), Decimal('1')])
+        self.assertEqual(result[c], [Decimal('10'), Decimal('1')])
+        self.assertEqual(result[d], [Decimal('5'), Decimal('2')])
+        self.assertEqual(result[e], [Decimal('3'), Decimal('3')])
+
+    def test_accounts_without_totals_are_zero(self):
+        u"""Contas sem movimento aparecem zeradas."""
+        a, b = _ids(2)
+        self.assertEqual(roll_up([(a, 1, 1, 4), (b, 1, 2, 3)], {}), {a: [0, 0], b: [0, 0]})
+
+
+class PeriodIndexTest(SimpleTestCase):
+    u"""Busca dos períodos em memória."""
+
+    def setUp(self):
+        u"""Monta dois exercícios com dois períodos cada e um período de ajuste."""
+        self.year_2015, self.year_2016 = _ids(2)
+        self.nov = self._period(self.year_2015, date(2015, 11, 1), date(2015, 11, 30), Period.CLOSED)
+        self.dec = self._period(self.year_2015, date(2015, 12, 1), date(2015, 12, 31))
+        self.adjustment = self._period(self.year_2015, date(2015, 12, 31), date(2015, 12, 31),
+                                       period_type=Period.ADJUSTMENT)
+        self.jan = self._period(self.year_2016, date(2016, 1, 1), date(2016, 1, 31))
+        self.feb = self._period(self.year_2016, date(2016, 2, 1), date(2016, 2, 29))
+        self.index = PeriodIndex([self.feb, self.adjustment, self.jan, self.dec, self.nov])
+
+    def _period(self, year_id, start, end, status=Period.OPEN, period_type=Period.STANDARD):
+        return Period(empresa_id=EMPRESA, year_id=year_id, start_date=start, end_date=end, status=status,
+                      type=period_type)
+
+    def test_find(self):
+        u"""Encontra o período normal que contém a data, ignorando os de ajuste."""
+        self.assertIs(self.index.find(date(2015, 11, 1)), self.nov)
+        self.assertIs(self.index.find(date(2015, 12, 31)), self.dec)
+        self.assertIs(self.index.find(date(2016, 2, 29)), self.feb)
+        self.assertIsNone(self.index.find(date(2015, 10, 31)))
+        self.assertIsNone(self.index.find(date(2016, 3, 1)))
+
+    def test_is_open(self):
+        u"""Somente datas de períodos abertos são aceitas."""
+        self.assertFalse(self.index.is_open(date(2015, 11, 15)))
+        self.assertTrue(self.index.is_open(date(2016, 1, 15)))
+        self.assertFalse(self.index.is_open(date(2017, 1, 1)))
+
+    def test_neighbours(self):
+        u"""O anterior e o seguinte atravessam o fim do exercício."""
+        self.assertIs(self.index.next(self.dec), self.jan)
+        self.assertIs(self.index.previous(self.jan), self.dec)
+        self.assertIsNone(self.index.previous(self.nov))
+        self.assertIsNone(self.index.next(self.feb))
+
+    def test_year_and_following(self):
+        u"""Os períodos seguintes continuam nos exercícios posteriores."""
+        self.assertEqual(self.index.year(self.year_2016), [self.jan, self.feb])
+        self.assertEqual(self.index.following(self.nov), [self.dec, self.adjustment, self.jan, self.feb])
+        self.assertEqual(self.index.following(self.jan), [self.feb])
+        self.assertEqual(self.index.following(self.feb), [])
+
+
+class ChartTreeTest(SimpleTestCase):
+    u"""Plano de contas em memória."""
+
+    def setUp(self):
+        u"""Monta uma árvore com duas raízes."""
+        self.ativo, self.circulante, self.caixa, self.bancos, self.passivo = _ids(5)
+        rows = [
+            (self.ativo, '1', 'Ativo', Conta.DEBITO, Conta.SINTETICA, None, 1, 1, 8, 0),
+            (self.circulante, '1.1', 'Circulante', Conta.DEBITO, Conta.SINTETICA, self.ativo, 1, 2, 7, 1),
+            (self.caixa, '1.1.1', 'Caixa', Conta.DEBITO, Conta.ANALITICA, self.circulante, 1, 3, 4, 2),
+            (self.bancos, '1.1.2', 'Bancos', Conta.DEBITO, Conta.ANALITICA, self.circulante, 1, 5, 6, 2),
+            (self.passivo, '2', 'Passivo', Conta.CREDITO, Conta.ANALITICA, None, 2, 1, 2, 0),
+        ]
+        self.tree = ChartTree(rows)
+
+    def test_lookup(self):
+        u"""Busca por id e por código."""
+        self.assertEqual(len(self.tree), 5)
+        self.assertEqual(self.tree.node(self.caixa).codigo, '1.1.1')
+        self.assertEqual(self.tree.by_codigo('1.1.2').id, self.bancos)
+        self.assertIsNone(self.tree.node(uuid.uuid4()))
+        self.assertEqual(self.tree.leaves, {self.caixa, self.bancos, self.passivo})
+
+    def test_ancestors(self):
+        u"""As ancestrais vão da raiz até a mãe."""
+        self.assertEqual(self.tree.ancestors(self.bancos), (self.ativo, self.circulante))
+        self.assertEqual(self.tree.ancestors(self.bancos, include_self=True),
+                         (self.ativo, self.circulante, self.bancos))
+        self.assertEqual(self.tree.ancestors(self.passivo), ())
+
+    def test_descendants(self):
+        u"""As descendentes são obtidas pelo intervalo, sem invadir a árvore seguinte."""
+        self.assertEqual([node.id for node in self.tree.descendants(self.ativo)],
+                         [self.circulante, self.caixa, self.bancos])
+        self.assertEqual([node.id for node in self.tree.descendants(self.circulante, include_self=True)],
+                         [self.circulante, self.caixa, self.bancos])
+        self.assertEqual(self.tree.descendants(self.passivo), [])
+        self.assertEqual(self.tree.subtree_range(self.circulante), (1, 2, 7))
+
+
+class BuildChartTest(SimpleTestCase):
+    u"""Cálculo dos campos da árvore na carga do plano de contas."""
+
+    def test_tree_fields(self):
+        u"""``lft``/``rght``/``level``/``tree_id`` seguem a ordem dos códigos."""
+        rows = [
+            {'codigo': '2', 'nome': 'Passivo', 'type': Conta.SINTETICA},
+            {'codigo': '1.1.1.02', 'nome': 'Bancos'},
+            {'codigo': '1', 'nome': 'Ativo'},
+            {'codigo': '1.1.1.01', 'nome': 'Caixa'},
+            {'codigo': '1.1', 'nome': 'Circulante'},
+            {'codigo': '1.1.1', 'nome': 'Disponível'},
+        ]
+        accounts = dict((account.codigo, account) for account in build_chart(EMPRESA, rows, 5))
+        fields = dict((codigo, (account.tree_id, account.lft, account.rght, account.level))
+                      for codigo, account in accounts.items())
+        self.assertEqual(fields, {
+            '1': (5, 1, 10, 0),
+            '1.1': (5, 2, 9, 1),
+            '1.1.1': (5, 3, 8, 2),
+            '1.1.1.01': (5, 4, 5, 3),
+            '1.1.1.02': (5, 6, 7, 3),
+            '2': (6, 1, 2, 0),
+        })
+        self.assertEqual(accounts['1.1.1.01'].parent_id, accounts['1.1.1'].pk)
+        self.assertIsNone(accounts['1'].parent_id)
+        self.assertEqual(accounts['1.1.1.01'].type, Conta.ANALITICA)
+        self.assertEqual(accounts['1.1'].type, Conta.SINTETICA)
+
+    def test_errors(self):
+        u"""Todos os problemas são relatados juntos."""
+        rows = [{'codigo': '1', 'nome': 'Ativo'}, {'codigo': '1', 'nome': 'Repetida'},
+                {'codigo': 'x', 'nome': 'Inválida'}, {'codigo': '3.1', 'nome': 'Órfã'}]
+        with self.assertRaises(ChartImportError) as raised:
+            build_chart(EMPRESA, rows, 1)
+        errors = raised.exception.errors
+        self.assertIn('Linha 2: código repetido: 1.', errors)
+        self.assertTrue(any(error.startswith('Linha 3: o código deve estar no formato') for error in errors))
+        self.assertIn('Conta mãe 3 não encontrada para 3.1.', errors)
+
+
+SGML = (b'OFXHEADER:100\r\nDATA:OFXSGML\r\nCHARSET:1252\r\n\r\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>'
+        b'<BANKTRANLIST><DTSTART>20160101<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20160105120000<TRNAMT>-100.00'
+        b'<FITID>1<MEMO>Pagamento \xe7\r\n</STMTTRN><STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20160106'
+        b'<TRNAMT>50,00<FITID>2<NAME>Dep\xf3sito<MEMO>Outro</STMTTRN></BANKTRANLIST></STMTRS></STMTTRNRS>'
+        b'</BANKMSGSRSV1></OFX>')
+
+XML = ('<?xml version="1.0" encoding="UTF-8"?><?OFX OFXHEADER="200" VERSION="211"?><OFX><BANKTRANLIST>'
+       '<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20160107</DTPOSTED><TRNAMT>-7.50</TRNAMT>'
+       '<FITID>3</FITID><MEMO>Café</MEMO></STMTTRN></BANKTRANLIST></OFX>').encode('utf-8')
+
+
+class ReadTransactionsTest(SimpleTestCase):
+    u"""Leitura das transações do OFX em blocos."""
+
+    def test_sgml(self):
+        u"""OFX 1.x em cp1252, com blocos menores que as tags."""
+        for read_size in (7, 64, 64 * 1024):
+            transactions = list(read_transactions(io.BytesIO(SGML), read_size))
+            self.assertEqual(transactions, [
+                {'TRNTYPE': 'DEBIT', 'DTPOSTED': '20160105120000', 'TRNAMT': '-100.00', 'FITID': '1',
+                 'MEMO': 'Pagamento ç'},
+                {'TRNTYPE': 'CREDIT', 'DTPOSTED': '20160106', 'TRNAMT': '50,00', 'FITID': '2', 'NAME': 'Depósito',
+                 'MEMO': 'Outro'},
+            ], read_size)
+
+    def test_xml(self):
+        u"""OFX 2.x em UTF-8, ignorando as tags de fechamento."""
+        self.assertEqual(list(read_transactions(io.BytesIO(XML))), [
+            {'TRNTYPE': 'DEBIT', 'DTPOSTED': '20160107', 'TRNAMT': '-7.50', 'FITID': '3', 'MEMO': 'Café'}])
+
+
+class ReconciliationMatchTest(SimpleTestCase):
+    u"""Conciliação automática em memória."""
+
+    start = date(2016, 1, 1)
+
+    def _day(self, day):
+        return self.start + timedelta(days=day - 1)
+
+    def test_best_respects_window_and_use(self):
+        u"""Cada registro é usado uma vez e somente dentro da janela de datas."""
+        near = Record(('near',), self._day(6), 1000, 'Luz')
+        far = Record(('far',), self._day(20), 1000, 'Luz')
+        index = AmountIndex([far, near])
+        line = Record(('line',), self._day(5), 1000, 'Luz')
+        self.assertEqual(index.best(line, timedelta(days=3))[0], near)
+        self.assertEqual(index.best(line, timedelta(days=3)), (None, 0))
+        self.assertEqual(index.best(Record(('other',), self._day(5), 999, ''), timedelta(days=3)), (None, 0))
+
+    def test_best_prefers_similar_memo(self):
+        u"""Entre candidatos à mesma distância, vence o histórico mais parecido."""
+        index = AmountIndex([Record(('rent',), self._day(4), 500, 'Aluguel'),
+                             Record(('power',), self._day(6), 500, 'Energia elétrica')])
+        found, score = index.best(Record(('line',), self._day(5), 500, 'ENERGIA ELETRICA'), timedelta(days=3))
+        self.assertEqual(found.ids, ('power',))
+        self.assertGreater(score, 0.5)
+
+    def test_match(self):
+        u"""Conciliações um para um, uma linha para vários itens e várias linhas para um item."""
+        lines = [Record(('l1',), self._day(5), 10000, 'PAGAMENTO LUZ'),
+                 Record(('l2',), self._day(10), 15000, 'TED'),
+                 Record(('l3',), self._day(20), 7000, 'DEP'),
+                 Record(('l4',), self._day(20), 3000, 'DEP'),
+                 Record(('l5',), self._day(25), 123, 'TARIFA')]
+        items = [Record(('i1',), self._day(6), 10000, 'Pagamento luz'),
+                 Record(('i2',), self._day(10), 10000, 'Cliente A'),
+                 Record(('i3',), self._day(10), 5000, 'Cliente B'),
+                 Record(('i4',), self._day(20), 10000, 'Depósitos')]
+        reconciler = Reconciler(EMPRESA, uuid.uuid4(), self.start, self._day(31))
+        matches = dict((kind, (set(line_ids), set(item_ids)))
+                       for kind, line_ids, item_ids, _ in reconciler.match(lines, items))
+        self.assertEqual(matches, {
+            Reconciliation.ONE_TO_ONE: ({'l1'}, {'i1'}),
+            Reconciliation.ONE_TO_MANY: ({'l2'}, {'i2', 'i3'}),
+            Reconciliation.MANY_TO_ONE: ({'l3', 'l4'}, {'i4'}),
+        })
+
+
+class FakeReport(object):
+    u"""Relatório com registros de tamanhos conhecidos."""
+
+    def __init__(self, sizes):
+        u"""Inicializa o relatório com ``(chave, linhas)`` de cada registro."""
+        self.sizes = sizes
+
+    def keys(self):
+        u"""Gera as chaves e as quantidades de linhas."""
+        return iter(self.sizes)
+
+
+class PlanTest(SimpleTestCase):
+    u"""Divisão dos relatórios em blocos de páginas."""
+
+    def test_chunks_start_at_page_boundaries(self):
+        u"""Um bloco pode começar no meio de um registro, pulando as linhas já impressas."""
+        page, half = LINES_PER_PAGE, LINES_PER_PAGE // 2
+        report = FakeReport([('a', page), ('b', half), ('c', page)])
+        self.assertEqual(plan(report, chunk_pages=1), [
+            ('a', 0, page, 1),
+            ('b', 0, page, 2),
+            ('c', page - half, half, 3),
+        ])
+
+    def test_single_chunk(self):
+        u"""Um relatório menor que um bloco tem um único bloco com todas as linhas."""
+        self.assertEqual(plan(FakeReport([(1, 3), (2, 4)]), chunk_pages=10), [(1, 0, 7, 1)])
+        self.assertEqual(plan(FakeReport([])), [])
+
+
+class BalanceMatrixTest(SimpleTestCase):
+    u"""Demonstrações calculadas sobre a matriz de saldos."""
+
+    def setUp(self):
+        u"""Monta uma matriz com uma conta de ativo e uma de receita em três períodos de dois exercícios."""
+        year_2015, year_2016 = _ids(2)
+        periods = [Period(empresa_id=EMPRESA, year_id=year_2015, start_date=date(2015, 12, 1),
+                          end_date=date(2015, 12, 31)),
+                   Period(empresa_id=EMPRESA, year_id=year_2016, start_date=date(2016, 1, 1),
+                          end_date=date(2016, 1, 31)),
+                   Period(empresa_id=EMPRESA, year_id=year_2016, start_date=date(2016, 2, 1),
+                          end_date=date(2016, 2, 29))]
+        accounts = [(uuid.uuid4(), '1.1.1.01', 'Caixa', 3, Conta.DEBITO),
+                    (uuid.uuid4(), '3.1.1.01', 'Vendas', 3, Conta.CREDITO)]
+        initial = np.array([[0, -10000, -25000], [0, 0, 0]], np.int64)
+        debit = np.array([[10000, 15000, 5000], [0, 0, 0]], np.int64)
+        credit = np.array([[0, 0, 0], [10000, 15000, 5000]], np.int64)
+        self.matrix = BalanceMatrix(accounts, periods, initial, debit, credit)
+
+    def test_balance_sheet(self):
+        u"""O saldo final do ativo é apresentado positivo, pela natureza devedora."""
+        statement = self.matrix.balance_sheet()
+        self.assertEqual(statement.values.tolist(), [[10000, 25000, 30000]])
+
+    def test_income_statement(self):
+        u"""O acumulado do exercício recomeça no primeiro período de cada exercício."""
+        self.assertEqual(self.matrix.income_statement().values.tolist(), [[10000, 15000, 5000]])
+        self.assertEqual(self.matrix.income_statement(cumulative=True).values.tolist(), [[10000, 15000, 20000]])
+
+    def test_variance(self):
+        u"""Variações contra a coluna anterior e contra uma coluna base."""
+        statement = self.matrix.income_statement()
+        absolute, percent = statement.variance()
+        self.assertEqual(absolute.tolist(), [[0, 5000, -10000]])
+        self.assertEqual(percent.round(2).tolist(), [[0.0, 50.0, -66.67]])
+        absolute, _ = statement.variance(base=0)
+        self.assertEqual(absolute.tolist(), [[0, 5000, -5000]])
+
+    def test_as_dict(self):
+        u"""Os valores são representados em reais."""
+        data = self.matrix.income_statement(max_level=3).as_dict()
+        self.assertEqual(data['rows'], [{'codigo': '3.1.1.01', 'nome': 'Vendas', 'level': 3,
+                                         'values': ['100.00', '150.00', '50.00']}])
+        self.assertEqual(self.matrix.income_statement(max_level=2).as_dict()['rows'], [])
+
+
+@override_settings(CONTABIL_INCREMENTAL_BALANCES=True, CONTABIL_BALANCE_DELTAS=True)
+class StoredBalancesTest(TestCase):
+    u"""Saldos gravados somados às variações pendentes, antes e depois da compactação."""
+
+    def setUp(self):
+        u"""Cria uma conta com saldo gravado em janeiro e variações em janeiro, fevereiro e março."""
+        self.empresa, self.account = _empresa()
+        self.periods = _periods(self.empresa, 2016)[:3]
+        jan, feb, mar = self.periods
+        PeriodicBalance.objects.create(empresa=self.empresa, account=self.account, period=jan,
+                                       initial_balance=0, debit_value=0, credit_value=100, final_balance=100)
+        for period, initial, debit, credit in ((jan, 0, 30, 0), (feb, -30, 0, 50), (mar, 20, 0, 0)):
+            BalanceDelta.objects.create(empresa=self.empresa, account=self.account, period=period,
+                                        initial_balance=initial, debit_value=debit, credit_value=credit)
+
+    def _balances(self):
+        balances = stored_balances(self.empresa.pk, self.periods)
+        return [balances.get((period.pk, self.account.pk)) for period in self.periods]
+
+    def test_pending_deltas_are_merged(self):
+        u"""Períodos sem saldo gravado partem do saldo final gravado mais recente."""
+        self.assertEqual(self._balances(), [Saldo(Decimal(0), Decimal(30), Decimal(100)),
+                                            Saldo(Decimal(70), Decimal(0), Decimal(50)),
+                                            Saldo(Decimal(120), Decimal(0), Decimal(0))])
+
+    def test_compaction_keeps_the_balances(self):
+        u"""A compactação grava os mesmos saldos e apaga as variações."""
+        before = self._balances()
+        self.assertEqual(compact_balances(self.empresa.pk), 3)
+        self.assertFalse(BalanceDelta.objects.all_empresas().filter(empresa=self.empresa).exists())
+        self.assertEqual(self._balances(), before)
+        finals = dict(PeriodicBalance.objects.all_empresas().filter(empresa=self.empresa).values_list(
+            'period', 'final_balance'))
+        self.assertEqual([finals[period.pk] for period in self.periods], [70, 120, 120])
+
+
+class ClosePeriodTest(TestCase):
+    u"""Saldos de períodos fechados."""
+
+    def setUp(self):
+        u"""Fecha janeiro com um lançamento."""
+        self.empresa, self.account = _empresa()
+        self.periods = _periods(self.empresa, 2016)
+        _post(self.account, date(2016, 1, 10), debit=25)
+        close_period(self.periods[0])
+
+    def test_recalculation_keeps_closed_periods(self):
+        u"""O recálculo recusa o período fechado e o exercício grava apenas os abertos."""
+        with self.assertRaises(ClosedPeriodError):
+            calculate_period(self.periods[0])
+        rows = calculate_fiscal_year(self.periods[0].year)
+        self.assertEqual(set(row.period_id for row in rows), set(period.pk for period in self.periods[1:]))
+        stored = PeriodicBalance.objects.all_empresas().get(period=self.periods[0], account=self.account)
+        self.assertEqual((stored.debit_value, stored.final_balance), (25, -25))
+
+
+class ClosePeriodRaceTest(TransactionTestCase):
+    u"""Fechamento simultâneo a um lançamento no período."""
+
+    def test_close_waits_for_posting(self):
+        u"""O fechamento espera o lançamento em andamento e o inclui na cópia dos saldos."""
+        empresa, account = _empresa()
+        january = _periods(empresa, 2016)[0]
+        posted, release, errors = threading.Event(), threading.Event(), []
+
+        def post():
+            try:
+                with transaction.atomic():
+                    _post(account, date(2016, 1, 10), debit=25)
+                    posted.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        def close():
+            try:
+                close_period(january)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        posting = threading.Thread(target=post)
+        posting.start()
+        self.assertTrue(posted.wait(10))
+        closing = threading.Thread(target=close)
+        closing.start()
+        closing.join(1)
+        self.assertTrue(closing.is_alive())
+        release.set()
+        posting.join(10)
+        closing.join(10)
+        self.assertEqual(errors, [])
+        balances = PeriodSnapshot.objects.all_empresas().get(period=january).balances[str(account.pk)]
+        self.assertEqual([Decimal(value) for value in balances], [0, 25, 0, -25])
+
+
+class ApplyMovementsTransactionTest(TransactionTestCase):
+    u"""Variações dos saldos gravadas na transação dos lançamentos."""
+
+    def setUp(self):
+        u"""Cria a empresa e o exercício."""
+        self.empresa, self.account = _empresa()
+        self.periods = _periods(self.empresa, 2016)
+
+    def test_requires_transaction(self):
+        u"""Fora de uma transação as variações são recusadas."""
+        with self.assertRaises(TransactionManagementError):
+            apply_movements(self.empresa.pk, [(self.account.pk, date(2016, 1, 10), Decimal(10), Decimal(0))])
+        self.assertFalse(BalanceDelta.objects.all_empresas().exists())
+
+    def test_save_opens_the_transaction(self):
+        u"""Gravar um item em autocommit grava também a sua variação."""
+        _post(self.account, date(2016, 1, 10), debit=25)
+        delta = BalanceDelta.objects.all_empresas().get(period=self.periods[0], account=self.account)
+        self.assertEqual(delta.debit_value, 25)
+
+
+class CrossYearPostingTest(TestCase):
+    u"""Lançamento em um exercício anterior."""
+
+    def test_later_years_are_updated(self):
+        u"""A variação chega aos saldos iniciais do exercício seguinte e confere com o recálculo."""
+        empresa, account = _empresa()
+        periods_2015 = _periods(empresa, 2015)
+        periods_2016 = _periods(empresa, 2016)
+        calculate_fiscal_year(periods_2015[0].year)
+        calculate_fiscal_year(periods_2016[0].year)
+        _post(account, date(2015, 6, 15), credit=40)
+        balances = stored_balances(empresa.pk, [periods_2015[-1], periods_2016[0], periods_2016[-1]])
+        self.assertEqual([balances[(period.pk, account.pk)].initial_balance
+                          for period in (periods_2015[-1], periods_2016[0], periods_2016[-1])], [40, 40, 40])
+        for period in periods_2015 + periods_2016:
+            self.assertEqual(verify_period(period), [], period)
+
+
+class ReconcilerClosedPeriodTest(TestCase):
+    u"""Conciliação de linhas de extrato em períodos fechados."""
+
+    def _line(self, day, amount):
+        entry = _post(self.account, day, debit=max(amount, 0), credit=max(-amount, 0)).entry
+        return StatementLine.objects.create(empresa=self.empresa, account=self.account, fitid=str(day),
+                                            date=day, amount=amount, memo='Teste', entry=entry)
+
+    def test_closed_lines_stay_unmatched(self):
+        u"""A linha do período fechado fica sem conciliação e a do período aberto é conciliada."""
+        self.empresa, self.account = _empresa()
+        january = _periods(self.empresa, 2016)[0]
+        _post(self.account, date(2016, 1, 10), debit=25)
+        _post(self.account, date(2016, 2, 10), credit=30)
+        closed, opened = self._line(date(2016, 1, 10), 25), self._line(date(2016, 2, 10), -30)
+        close_period(january)
+        reconciler = Reconciler(self.empresa.pk, self.account.pk, date(2016, 1, 1), date(2016, 2, 29))
+        summary = reconciler.run()
+        self.assertEqual((summary['one_to_one'], summary['unmatched_lines']), (1, 1))
+        self.assertEqual([line['id'] for line in reconciler.unmatched()['statement_lines']], [closed.pk])
+        self.assertTrue(Entry.objects.all_empresas().filter(pk=closed.entry_id).exists())
+        self.assertFalse(Entry.objects.all_empresas().filter(pk=opened.entry_id).exists())
+
+
+class TransitionEntriesTest(TransactionTestCase):
+    u"""Mudança de status em lote com linhas bloqueadas por outra transação."""
+
+    def setUp(self):
+        u"""Cria dois lançamentos balanceados e um com um único item, todos em rascunho."""
+        self.empresa, self.account = _empresa()
+        _periods(self.empresa, 2016)
+        self.first = _post(self.account, date(2016, 1, 10), debit=10).entry
+        self.second = _post(self.account, date(2016, 1, 11), debit=20).entry
+        for entry in (self.first, self.second):
+            EntryItem.objects.create(empresa=self.empresa, entry=entry, account=self.account, debit_value=0,
+                                     credit_value=entry.value)
+        self.single = _post(self.account, date(2016, 1, 12), debit=30).entry
+
+    def _outcomes(self, outcomes):
+        return dict((outcome.id, (outcome.status, outcome.outcome)) for outcome in outcomes)
+
+    def test_transitions(self):
+        u"""Lançamentos sem partidas dobradas e status de origem inválidos não mudam."""
+        outcomes = self._outcomes(transition_entries(self.empresa.pk, Entry.PENDING,
+                                                     ids=[self.first.pk, self.second.pk, self.single.pk]))
+        self.assertEqual(outcomes, {self.first.pk: (Entry.DRAFT, UPDATED), self.second.pk: (Entry.DRAFT, UPDATED),
+                                    self.single.pk: (Entry.DRAFT, UNBALANCED)})
+        outcomes = self._outcomes(transition_entries(self.empresa.pk, Entry.FROZEN, start=date(2016, 1, 10),
+                                                     end=date(2016, 1, 10)))
+        self.assertEqual(outcomes, {self.first.pk: (Entry.PENDING, INVALID)})
+        self.assertEqual(Entry.objects.all_empresas().get(pk=self.first.pk).status, Entry.PENDING)
+
+    def test_locked_rows_are_skipped(self):
+        u"""O lançamento bloqueado por outra transação é pulado sem esperar por ela."""
+        locked, release = threading.Event(), threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    list(Entry.objects.all_empresas().select_for_update().filter(pk=self.first.pk))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            outcomes = self._outcomes(transition_entries(self.empresa.pk, Entry.PENDING,
+                                                         ids=[self.first.pk, self.second.pk]))
+        finally:
+            release.set()
+            holder.join(10)
+        self.assertEqual(outcomes, {self.first.pk: (Entry.DRAFT, LOCKED), self.second.pk: (Entry.DRAFT, UPDATED)})
+        self.assertEqual(Entry.objects.all_empresas().get(pk=self.first.pk).status, Entry.DRAFT)
+
+
+class ContaManagerTest(TestCase):
+    u"""Gerenciador das contas: filtro da empresa e operações da árvore."""
+
+    def setUp(self):
+        u"""Cria uma conta sintética com uma filha e uma segunda empresa."""
+        self.empresa, self.ativo = _empresa()
+        self.caixa = Conta.objects.create(empresa=self.empresa, codigo='1.1', nome='Caixa', parent=self.ativo)
+        self.outra = Empresa.objects.create(cnpj='11444777000161', razao_social='Outra', nome_fantasia='Outra')
+
+    def test_tree_methods(self):
+        u"""As consultas e a reconstrução da árvore estão disponíveis em ``objects``."""
+        descendants = Conta.objects.get_queryset_descendants(Conta.objects.filter(codigo='1'))
+        self.assertEqual(list(descendants), [self.caixa])
+        Conta.objects.rebuild()
+        self.assertEqual(Conta.objects.get(pk=self.caixa.pk).parent_id, self.ativo.pk)
+
+    def test_tenant_filter(self):
+        u"""``objects`` filtra pela empresa corrente; o gerenciador da árvore não."""
+        with current_empresa(self.outra):
+            self.assertFalse(Conta.objects.exists())
+            self.assertEqual(Conta._tree_manager.count(), 2)
+        with current_empresa(self.empresa):
+            self.assertEqual(list(Conta.objects.values_list('codigo', flat=True)), ['1', '1.1'])
+
+
+class EntryCleanTest(TestCase):
+    u"""Validação da data dos lançamentos pela empresa do próprio lançamento."""
+
+    def test_open_period(self):
+        u"""A data deve estar em um período aberto da empresa, com ou sem empresa corrente."""
+        empresa, _ = _empresa()
+        _periods(empresa, 2016)
+        outra = Empresa.objects.create(cnpj='11444777000161', razao_social='Outra', nome_fantasia='Outra')
+        Entry(empresa=empresa, date=date(2016, 1, 10), memo='Teste').clean()
+        with current_empresa(outra):
+            Entry(empresa=empresa, date=date(2016, 1, 10), memo='Teste').clean()
+        with self.assertRaises(ValidationError) as raised:
+            Entry(empresa=empresa, date=date(2017, 1, 10), memo='Teste').clean()
+        self.assertIn('date', raised.exception.message_dict)
+
+
+class EntryImporterTest(TestCase):
+    u"""Validação dos lançamentos importados em lote."""
+
+    def setUp(self):
+        u"""Cria duas contas analíticas e o exercício."""
+        self.empresa, self.caixa = _empresa()
+        Conta.objects.create(empresa=self.empresa, codigo='2', nome='Capital', nature=Conta.CREDITO)
+        _periods(self.empresa, 2016)
+
+    def _entry(self, **changes):
+        data = {'date': '2016-01-10', 'memo': 'Integralização',
+                'items': [{'account': '1', 'debit': '10.00'}, {'account': '2', 'credit': '10.00'}]}
+        data.update(changes)
+        return data
+
+    def test_valid(self):
+        u"""Um lançamento válido não tem erros."""
+        _, items, errors = EntryImporter(self.empresa.pk).build(self._entry())
+        self.assertEqual((len(items), errors), (2, []))
+
+    def test_invalid_types(self):
+        u"""Valores de tipos inesperados são erros da linha, não exceções."""
+        importer = EntryImporter(self.empresa.pk)
+        for data in (self._entry(memo=['a']), self._entry(memo=10), self._entry(items='ab'),
+                     self._entry(items=[{'account': ['1'], 'debit': '10'}, {'account': {'a': 1}, 'credit': '10'}]),
+                     self._entry(items=[{'account': '1', 'debit': 'NaN'}, {'account': '2', 'credit': 'Infinity'}]),
+                     self._entry(items=[{'account': '1', 'debit': {'v': 1}}, {'account': '2', 'credit': [10]}])):
+            self.assertTrue(importer.build(data)[2], data)
+
+    def test_total_range(self):
+        u"""O total do lançamento deve caber no campo de valor."""
+        items = [{'account': '1', 'debit': '9999999999.99'}, {'account': '1', 'debit': '1.00'},
+                 {'account': '2', 'credit': '9999999999.99'}, {'account': '2', 'credit': '1.00'}]
+        errors = EntryImporter(self.empresa.pk).build(self._entry(items=items))[2]
+        self.assertEqual(errors, ['O total do lançamento excede 9999999999.99.'])
+
+    def test_import_reports_rows(self):
+        u"""A importação grava as linhas válidas e relata as demais."""
+        lines = ['{"date": "2016-01-10", "memo": "Ok", "items": [{"account": "1", "debit": 5}, '
+                 '{"account": "2", "credit": 5}]}', '{"date": "2016-01-10", "memo": 7, "items": []}', 'x']
+        result = import_entries(self.empresa.pk, lines)
+        self.assertEqual(result.created, 1)
+        self.assertEqual([row for row, _ in result.errors], [2, 3])
+
+    def test_check_utf8(self):
+        u"""Arquivos em outra codificação são recusados antes da importação."""
+        stream = io.BytesIO('{"memo": "Café"}'.encode('utf-8'))
+        check_utf8(stream, read_size=11)
+        self.assertEqual(stream.tell(), 0)
+        with self.assertRaises(UnicodeDecodeError):
+            check_utf8(io.BytesIO('{"memo": "Café"}'.encode('cp1252')))
+
+
+class CalculateFiscalYearTest(TestCase):
+    u"""Recálculo do exercício inteiro em uma passada."""
+
+    def test_matches_period_by_period(self):
+        u"""Os saldos gravados conferem com o cálculo de cada período e somam as contas filhas."""
+        empresa, parent = _empresa()
+        child = Conta.objects.create(empresa=empresa, codigo='1.1', nome='Caixa', parent=parent, nature=Conta.DEBITO)
+        periods = _periods(empresa, 2016)
+        _post(child, date(2016, 1, 10), debit=25)
+        _post(child, date(2016, 3, 5), credit=10)
+        progress = []
+        calculate_fiscal_year(periods[0].year, lambda period, position, total: progress.append((position, total)))
+        self.assertEqual(progress, [(position, 12) for position in range(1, 13)])
+        for period in periods:
+            self.assertEqual(verify_period(period), [], period)
+        balances = stored_balances(empresa.pk, [periods[1], periods[-1]])
+        self.assertEqual([balances[(period.pk, account.pk)].final_balance
+                          for period in (periods[1], periods[-1]) for account in (parent, child)], [-25, -25, -15, -15])
+
+
+class BalanceAtTest(TestCase):
+    u"""Saldo de uma conta em uma data qualquer."""
+
+    def setUp(self):
+        u"""Lança em janeiro e em fevereiro em uma conta filha."""
+        self.empresa, self.parent = _empresa()
+        self.child = Conta.objects.create(empresa=self.empresa, codigo='1.1', nome='Caixa', parent=self.parent,
+                                          nature=Conta.DEBITO)
+        self.periods = _periods(self.empresa, 2016)
+        _post(self.child, date(2016, 1, 10), debit=25)
+        _post(self.child, date(2016, 2, 5), credit=10)
+        _post(self.child, date(2016, 2, 20), debit=3)
+
+    def test_balance_at(self):
+        u"""O saldo parte do período anterior e soma os itens do período até o dia, também na conta pai."""
+        for account in Conta.objects.all_empresas().filter(pk__in=[self.parent.pk, self.child.pk]):
+            self.assertEqual(balance_at(account, date(2016, 2, 10)), Saldo(Decimal(-25), Decimal(0), Decimal(10)))
+            self.assertEqual(opening_balance(account, date(2016, 2, 20)), -15)
+            self.assertEqual(opening_balance(account, date(2016, 1, 10)), 0)
+        self.assertIsNone(balance_at(account, date(2017, 1, 1)))
+
+    def test_closed_period(self):
+        u"""No fim de um período fechado o saldo vem da cópia do fechamento."""
+        close_period(self.periods[0])
+        parent = Conta.objects.all_empresas().get(pk=self.parent.pk)
+        self.assertEqual(balance_at(parent, date(2016, 1, 31)), Saldo(Decimal(0), Decimal(25), Decimal(0)))
+        self.assertEqual(opening_balance(parent, date(2016, 2, 1)), -25)
+
+
+class LedgerPageTest(TestCase):
+    u"""Páginas do razão com saldo acumulado."""
+
+    def setUp(self):
+        u"""Lança em janeiro e duas vezes em fevereiro."""
+        self.empresa, self.account = _empresa()
+        _periods(self.empresa, 2016)
+        _post(self.account, date(2016, 1, 10), debit=25)
+        _post(self.account, date(2016, 2, 5), credit=10)
+        _post(self.account, date(2016, 2, 20), debit=3)
+        self.account = Conta.objects.all_empresas().get(pk=self.account.pk)
+
+    def test_pages(self):
+        u"""O saldo continua de uma página para a outra a partir do saldo no início do intervalo."""
+        start, end = date(2016, 2, 1), date(2016, 2, 29)
+        opening, rows, cursor = ledger_page(self.account, start, end, limit=1)
+        self.assertEqual((opening, [row['balance'] for row in rows]), (-25, ['-15.00']))
+        opening, rows, cursor = ledger_page(self.account, start, end, cursor=cursor, limit=1)
+        self.assertEqual(([row['balance'] for row in rows], cursor), (['-18.00'], None))
+        rows = ledger_page(self.account, date(2016, 1, 1), end)[1]
+        self.assertEqual([row['balance'] for row in rows], ['-25.00', '-15.00', '-18.00'])
+
+    def test_cursor_scope(self):
+        u"""O cursor só é aceito na consulta que o gerou."""
+        cursor = ledger_page(self.account, date(2016, 1, 1), date(2016, 2, 29), limit=1)[2]
+        with self.assertRaises(InvalidCursor):
+            ledger_page(self.account, date(2016, 2, 1), date(2016, 2, 29), cursor=cursor)
+        with self.assertRaises(InvalidCursor):
+            ledger_page(self.account, date(2016, 1, 1), date(2016, 2, 29), cursor=cursor[:-2])
+
+
+class ExportTest(TestCase):
+    u"""Exportação das partidas em CSV."""
+
+    def setUp(self):
+        u"""Lança duas partidas em 2016."""
+        self.empresa, self.account = _empresa()
+        _periods(self.empresa, 2016)
+        self.items = [_post(self.account, date(2016, 1, 10), debit=25),
+                      _post(self.account, date(2016, 2, 5), credit=10)]
+
+    def _rows(self, text):
+        return list(csv.reader(io.StringIO(text)))
+
+    def test_stream_and_copy(self):
+        u"""A resposta em blocos e o ``COPY`` geram as mesmas linhas."""
+        streamed = self._rows(''.join(csv_chunks(self.empresa.pk, ENTRIES)))
+        self.assertEqual(streamed[0], [name for name, _ in ENTRIES.columns])
+        self.assertEqual([(row[0], row[2], row[3], row[8], row[9]) for row in streamed[1:]],
+                         [(str(self.items[0].pk), '2016', '2016-01-10', '25.00', '0.00'),
+                          (str(self.items[1].pk), '2016', '2016-02-05', '0.00', '10.00')])
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'entries.csv')
+        try:
+            copy_csv(self.empresa.pk, ENTRIES, path)
+            with io.open(path, encoding='utf-8', newline='') as copied:
+                copied = self._rows(copied.read())
+        finally:
+            os.remove(path)
+            os.rmdir(directory)
+        self.assertEqual([row[:-1] for row in copied], [row[:-1] for row in streamed])
+
+    def test_since(self):
+        u"""Com ``since``, somente as linhas alteradas depois da marca são exportadas."""
+        since = timezone.now()
+        self.assertEqual(len(self._rows(''.join(csv_chunks(self.empresa.pk, ENTRIES, since)))), 1)
+        self.assertEqual(len(self._rows(''.join(csv_chunks(self.empresa.pk, ENTRIES, since - timedelta(1))))), 3)
+
+
+class EcdTest(TestCase):
+    u"""Geração do arquivo da ECD."""
+
+    def test_lines(self):
+        u"""Os lançamentos e os totais são gerados sem compactar as variações pendentes."""
+        empresa, account = _empresa()
+        periods = _periods(empresa, 2016)
+        _post(account, date(2016, 1, 10), debit=25)
+        _post(account, date(2016, 2, 5), credit=10)
+        lines = list(ecd_lines(empresa, periods[0].year))
+        registros = [line.split('|')[1] for line in lines]
+        self.assertEqual((registros.count('I200'), registros.count('I250'), registros.count('I155')), (2, 2, 12))
+        self.assertEqual(lines[-1], '|9999|{0}|\r\n'.format(len(lines)))
+        self.assertTrue(BalanceDelta.objects.all_empresas().filter(empresa=empresa).exists())
+
+
+class MaintenanceTest(TestCase):
+    u"""Manutenção dos saldos de várias empresas."""
+
+    def test_run(self):
+        u"""As empresas maiores vêm primeiro e cada uma executa as tarefas em ordem."""
+        empresa, account = _empresa()
+        outra = Empresa.objects.create(cnpj='11444777000161', razao_social='Outra', nome_fantasia='Outra')
+        other_account = Conta.objects.create(empresa=outra, codigo='1', nome='Caixa', nature=Conta.DEBITO)
+        for owner, owned in ((empresa, account), (outra, other_account)):
+            _periods(owner, 2016)
+            _post(owned, date(2016, 1, 10), debit=25)
+        _post(other_account, date(2016, 2, 5), credit=10)
+        self.assertEqual(by_size([empresa.pk, outra.pk]), [outra.pk, empresa.pk])
+        outcomes = list(run(['recompute', 'compact', 'verify'], [empresa.pk, outra.pk], processes=1))
+        self.assertEqual([(outcome.empresa_id, outcome.task, outcome.error) for outcome in outcomes],
+                         [(empresa_id, task, None) for empresa_id in (outra.pk, empresa.pk)
+                          for task in ('recompute', 'compact', 'verify')])
+        self.assertEqual([outcome.result for outcome in outcomes if outcome.task != 'compact'], [12, 0, 12, 0])
+        self.assertFalse(BalanceDelta.objects.all_empresas().exists())
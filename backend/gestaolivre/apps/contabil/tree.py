@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+u"""Cópia em memória do plano de contas de cada empresa.
+
+O plano de contas muda raramente, mas é consultado a cada cálculo de saldo, importação e
+validação de conta. A árvore de cada empresa é carregada uma única vez, com uma consulta,
+e compartilhada por todo o código do processo, oferecendo busca por id e por código,
+ancestrais, folhas e o intervalo de descendentes de cada conta. A cópia é descartada
+sempre que uma conta da empresa é gravada, apagada ou movida.
+"""
+
+from gestaolivre.apps.utils.cache import VersionedCache
+
+from .models import Conta
+
+
+class ChartNode(object):
+    u"""Uma conta do plano de contas."""
+
+    __slots__ = ('id', 'codigo', 'nome', 'nature', 'type', 'parent_id', 'tree_id', 'lft', 'rght', 'level',
+                 'ancestors', 'position', 'end')
+
+    def __init__(self, id, codigo, nome, nature, type, parent_id, tree_id, lft, rght, level):
+        u"""Inicializa a conta com os valores lidos do banco."""
+        self.id = id
+        self.codigo = codigo
+        self.nome = nome
+        self.nature = nature
+        self.type = type
+        self.parent_id = parent_id
+        self.tree_id = tree_id
+        self.lft = lft
+        self.rght = rght
+        self.level = level
+
+    @property
+    def is_leaf(self):
+        u"""Indica se a conta não tem filhas."""
+        return self.rght == self.lft + 1
+
+    def __repr__(self):
+        u"""Representação desta conta."""
+        return '<ChartNode: {0} - {1}>'.format(self.codigo, self.nome)
+
+
+class ChartTree(object):
+    u"""Plano de contas de uma empresa, na ordem da árvore."""
+
+    FIELDS = ('id', 'codigo', 'nome', 'nature', 'type', 'parent_id', 'tree_id', 'lft', 'rght', 'level')
+
+    def __init__(self, rows):
+        u"""Monta a árvore a partir das linhas ordenadas por ``tree_id`` e ``lft``."""
+        self.order = [ChartNode(*row) for row in rows]
+        self.nodes = {}
+        self.by_code = {}
+        self.leaves = set()
+        for position, node in enumerate(self.order):
+            parent = self.nodes.get(node.parent_id)
+            node.ancestors = parent.ancestors + (parent.id,) if parent else ()
+            node.position = position
+            node.end = position + 1 + (node.rght - node.lft - 1) // 2
+            self.nodes[node.id] = node
+            self.by_code[node.codigo] = node
+            if node.is_leaf:
+                self.leaves.add(node.id)
+        self.accounts = [(node.id, node.tree_id, node.lft, node.rght) for node in self.order]
+
+    def __len__(self):
+        u"""Quantidade de contas."""
+        return len(self.order)
+
+    def node(self, account_id):
+        u"""Obtém a conta pelo id, ou ``None``."""
+        return self.nodes.get(account_id)
+
+    def by_codigo(self, codigo):
+        u"""Obtém a conta pelo código, ou ``None``."""
+        return self.by_code.get(codigo)
+
+    def ancestors(self, account_id, include_self=False):
+        u"""Ids das ancestrais da conta, da raiz até a mãe (e a própria conta, se pedido)."""
+        node = self.nodes[account_id]
+        return node.ancestors + (node.id,) if include_self else node.ancestors
+
+    def descendants(self, account_id, include_self=False):
+        u"""Contas descendentes, na ordem da árvore, pelo intervalo da conta."""
+        node = self.nodes[account_id]
+        return self.order[node.position if include_self else node.position + 1:node.end]
+
+    def subtree_range(self, account_id):
+        u"""Intervalo ``(tree_id, lft, rght)`` que contém a conta e suas descendentes."""
+        node = self.nodes[account_id]
+        return node.tree_id, node.lft, node.rght
+
+
+def _build(empresa_id):
+    return ChartTree(Conta.objects.all_empresas().filter(empresa_id=empresa_id)
+                     .order_by('tree_id', 'lft').values_list(*ChartTree.FIELDS))
+
+
+_cache = VersionedCache('contabil.chart', _build)
+
+
+def chart_tree(empresa_id, verify=False):
+    u"""Obtém o plano de contas da empresa.
+
+    Com ``verify``, a versão da cópia local é conferida no banco imediatamente, e não
+    apenas após o intervalo do cache, garantindo que nenhum outro processo alterou o
+    plano de contas desde que ela foi montada.
+    """
+    return _cache.get(empresa_id, verify=verify)
+
+
+def invalidate_chart(empresa_id):
+    u"""Descarta a cópia do plano de contas da empresa em todos os processos."""
+    _cache.invalidate(empresa_id)
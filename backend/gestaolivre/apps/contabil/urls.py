@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+u"""Configurações de URL do aplicativo contábil."""
+
+from django.conf.urls import url
+
+from . import views
+
+
+app_name = 'accounting'
+
+urlpatterns = [
+    url(r'^accounts/import$', views.chart_import, name='chart_import'),
+    url(r'^entries/import$', views.entries_import, name='entries_import'),
+    url(r'^entries/status$', views.entries_status, name='entries_status'),
+    url(r'^accounts/(?P<pk>[0-9a-f-]+)/balance$', views.account_balance, name='account_balance'),
+    url(r'^accounts/(?P<pk>[0-9a-f-]+)/ledger$', views.account_ledger, name='account_ledger'),
+    url(r'^accounts/(?P<pk>[0-9a-f-]+)/reconciliation$', views.account_reconciliation,
+        name='account_reconciliation'),
+    url(r'^accounts/(?P<pk>[0-9a-f-]+)/statements/import$', views.statement_import, name='statement_import'),
+    url(r'^export/(?P<dataset>accounts|periods|entries)\.csv$', views.dataset_export, name='dataset_export'),
+    url(r'^fiscal-years/(?P<pk>[0-9a-f-]+)/ecd$', views.fiscal_year_ecd, name='fiscal_year_ecd'),
+    url(r'^fiscal-years/(?P<pk>[0-9a-f-]+)/recompute$', views.fiscal_year_recompute, name='fiscal_year_recompute'),
+    url(r'^periods/(?P<pk>[0-9a-f-]+)/close$', views.period_close, name='period_close'),
+    url(r'^periods/(?P<pk>[0-9a-f-]+)/reopen$', views.period_reopen, name='period_reopen'),
+    url(r'^periods/(?P<pk>[0-9a-f-]+)/balance-sheet$', views.balance_sheet, name='balance_sheet'),
+    url(r'^periods/(?P<pk>[0-9a-f-]+)/income-statement$', views.income_statement, name='income_statement'),
+    url(r'^reports/(?P<report>journal|ledger|trial-balance)$', views.report_render, name='report_render'),
+]
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+u"""Views do aplicativo contábil."""
+
+import codecs
+import uuid
+
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.decorators import parser_classes
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from gestaolivre.apps.geral.models import get_current_empresa_pk
+from gestaolivre.apps.tarefas.execucao import enfileirar
+from gestaolivre.apps.tarefas.views import resposta_tarefa
+
+from .balances import balance_at
+from .chart import ChartImportError
+from .chart import load_chart
+from .chart import read_chart_csv
+from .chart import read_chart_json
+from .closing import ClosingError
+from .closing import reopen_period
+from .ecd import encoded_lines
+from .export import DATASETS
+from .export import csv_chunks
+from .export import watermark
+from .journal import check_utf8
+from .journal import import_entries
+from .ledger import InvalidCursor
+from .ledger import ledger_page
+from .models import Conta
+from .models import FiscalYear
+from .models import Period
+from .ofx import import_statement
+from .reconciliation import Reconciler
+from .statements import BalanceMatrix
+from .workflow import TransitionError
+from .workflow import summarize
+from .workflow import transition_entries
+
+
+MAX_COMPARATIVE_PERIODS = 60
+
+LEDGER_PAGE_SIZE = 100
+MAX_LEDGER_PAGE_SIZE = 1000
+
+
+def _int_param(request, name, default=None, maximum=None):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Informe um número inteiro.'})
+    if value < 1 or (maximum and value > maximum):
+        raise ValidationError({name: 'Valor fora do intervalo permitido.'})
+    return value
+
+
+def _date_param(request, name):
+    try:
+        value = parse_date(request.query_params.get(name) or '')
+    except ValueError:
+        value = None
+    if value is None:
+        raise ValidationError({name: 'Informe uma data no formato AAAA-MM-DD.'})
+    return value
+
+
+def _uuid_param(request, name):
+    try:
+        return uuid.UUID(str(request.data.get(name) or request.query_params.get(name) or ''))
+    except ValueError:
+        return None
+
+
+def _statement_matrix(request, pk):
+    period = get_object_or_404(Period, pk=pk, empresa_id=get_current_empresa_pk(request))
+    count = _int_param(request, 'periods', 1, MAX_COMPARATIVE_PERIODS)
+    periods = Period.objects.filter(empresa_id=period.empresa_id,
+                                    start_date__lte=period.start_date).order_by('-start_date')[:count]
+    return BalanceMatrix.load(period.empresa_id, list(periods))
+
+
+def _statement_response(request, statement):
+    variance = request.query_params.get('variance')
+    if variance not in (None, '', 'previous', 'first'):
+        raise ValidationError({'variance': 'Use "previous" ou "first".'})
+    return Response(statement.nonzero().as_dict(variance=bool(variance), base=0 if variance == 'first' else None))
+
+
+@api_view(['GET'])
+def balance_sheet(request, pk):
+    u"""Balanço Patrimonial do período, com comparativo dos períodos anteriores.
+
+    Parâmetros: ``periods`` (quantidade de períodos, terminando no informado), ``level``
+    (nível máximo das contas) e ``variance`` (``previous`` ou ``first``).
+    """
+    matrix = _statement_matrix(request, pk)
+    return _statement_response(request, matrix.balance_sheet(_int_param(request, 'level')))
+
+
+@api_view(['GET'])
+def income_statement(request, pk):
+    u"""DRE do período, com os mesmos parâmetros do Balanço e ``cumulative`` para o acumulado do exercício."""
+    matrix = _statement_matrix(request, pk)
+    cumulative = request.query_params.get('cumulative') in ('1', 'true')
+    return _statement_response(request, matrix.income_statement(_int_param(request, 'level'), cumulative))
+
+
+@api_view(['POST'])
+def period_close(request, pk):
+    u"""Enfileira o fechamento do período, que grava a cópia imutável dos seus saldos.
+
+    Retorna a tarefa; o fechamento confere antes todos os saldos com um recálculo.
+    """
+    period = get_object_or_404(Period, pk=pk, empresa_id=get_current_empresa_pk(request))
+    if period.status == Period.CLOSED:
+        raise ValidationError({'status': 'O período já está fechado.'})
+    return resposta_tarefa(request, enfileirar('contabil.close_period', period.empresa_id, {'period': str(period.pk)}))
+
+
+@api_view(['POST'])
+def period_reopen(request, pk):
+    u"""Reabre o período fechado, descartando a cópia dos seus saldos."""
+    period = get_object_or_404(Period, pk=pk, empresa_id=get_current_empresa_pk(request))
+    try:
+        period = reopen_period(period)
+    except ClosingError as error:
+        raise ValidationError({'status': str(error)})
+    return Response({'id': period.pk, 'status': period.status})
+
+
+@api_view(['POST'])
+def fiscal_year_recompute(request, pk):
+    u"""Enfileira o recálculo dos saldos de todos os períodos do exercício."""
+    fiscal_year = get_object_or_404(FiscalYear, pk=pk, empresa_id=get_current_empresa_pk(request))
+    return resposta_tarefa(request, enfileirar('contabil.recompute', fiscal_year.empresa_id,
+                                               {'fiscal_year': str(fiscal_year.pk)}))
+
+
+@api_view(['POST'])
+def report_render(request, report):
+    u"""Enfileira a geração do relatório em PDF: ``journal``, ``ledger`` ou ``trial-balance``.
+
+    O Diário e o Razão recebem ``start`` e ``end``; o Razão também ``account``; o
+    Balancete, ``period``. O PDF fica no arquivo de resultado da tarefa.
+    """
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    params = {'report': report}
+    if report == 'trial-balance':
+        period = Period.objects.filter(pk=_uuid_param(request, 'period'), empresa_id=empresa_pk).first()
+        if period is None:
+            raise ValidationError({'period': 'Informe o período.'})
+        params['period'] = str(period.pk)
+    else:
+        for name in ('start', 'end'):
+            value = request.data.get(name)
+            if not isinstance(value, str) or parse_date(value) is None:
+                raise ValidationError({name: 'Informe uma data no formato AAAA-MM-DD.'})
+            params[name] = value
+    if report == 'ledger':
+        account = Conta.objects.filter(pk=_uuid_param(request, 'account'), empresa_id=empresa_pk).first()
+        if account is None:
+            raise ValidationError({'account': 'Informe a conta.'})
+        params['account'] = str(account.pk)
+    return resposta_tarefa(request, enfileirar('contabil.report', empresa_pk, params))
+
+
+@api_view(['GET'])
+def account_balance(request, pk):
+    u"""Saldo da conta, ou da conta sintética com suas filhas, ao fim da data ``date``."""
+    account = get_object_or_404(Conta, pk=pk, empresa_id=get_current_empresa_pk(request))
+    day = _date_param(request, 'date')
+    saldo = balance_at(account, day)
+    if saldo is None:
+        raise ValidationError({'date': 'Não há período para esta data.'})
+    return Response({
+        'account': account.codigo,
+        'date': day,
+        'initial_balance': str(saldo.initial_balance),
+        'debit_value': str(saldo.debit_value),
+        'credit_value': str(saldo.credit_value),
+        'balance': str(saldo.final_balance),
+    })
+
+
+@api_view(['GET'])
+def account_ledger(request, pk):
+    u"""Razão da conta entre ``start`` e ``end``, com saldo acumulado por linha.
+
+    A paginação é por cursor: ``next`` traz a URL da página seguinte. ``page_size``
+    controla a quantidade de linhas por página.
+    """
+    account = get_object_or_404(Conta, pk=pk, empresa_id=get_current_empresa_pk(request))
+    start, end = _date_param(request, 'start'), _date_param(request, 'end')
+    limit = _int_param(request, 'page_size', LEDGER_PAGE_SIZE, MAX_LEDGER_PAGE_SIZE)
+    try:
+        opening, rows, cursor = ledger_page(account, start, end, request.query_params.get('cursor'), limit)
+    except InvalidCursor as error:
+        raise ValidationError({'cursor': str(error)})
+    url = request.build_absolute_uri()
+    return Response({
+        'account': account.codigo,
+        'start': start,
+        'end': end,
+        'opening_balance': str(opening),
+        'next': replace_query_param(url, 'cursor', cursor) if cursor else None,
+        'results': rows,
+    })
+
+
+@api_view(['POST'])
+@parser_classes((MultiPartParser,))
+def chart_import(request):
+    u"""Carrega o plano de contas da empresa a partir do arquivo enviado em ``file``.
+
+    ``format`` indica o formato: ``csv`` (padrão) ou ``json``. A empresa não pode ter
+    contas cadastradas; o arquivo é rejeitado por inteiro se alguma conta for inválida.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ValidationError({'file': 'Envie o arquivo do plano de contas.'})
+    file_format = request.data.get('format') or request.query_params.get('format') or 'csv'
+    if file_format not in ('csv', 'json'):
+        raise ValidationError({'format': 'Use "csv" ou "json".'})
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    try:
+        if file_format == 'json':
+            rows = read_chart_json(upload.read().decode('utf-8'))
+        else:
+            rows = read_chart_csv(codecs.iterdecode(upload, 'utf-8'))
+        created = load_chart(empresa_pk, rows)
+    except ChartImportError as error:
+        raise ValidationError({'errors': error.errors})
+    except ValueError as error:
+        raise ValidationError({'file': str(error)})
+    return Response({'created': created}, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@parser_classes((MultiPartParser,))
+def entries_import(request):
+    u"""Importa em lote os lançamentos do arquivo enviado em ``file``.
+
+    ``format`` indica o formato: ``jsonl`` (padrão) ou ``csv``. A resposta traz a
+    quantidade de lançamentos gravados e os erros de cada linha rejeitada.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ValidationError({'file': 'Envie o arquivo de lançamentos.'})
+    file_format = request.data.get('format') or request.query_params.get('format') or 'jsonl'
+    if file_format not in ('jsonl', 'csv'):
+        raise ValidationError({'format': 'Use "jsonl" ou "csv".'})
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    try:
+        check_utf8(upload)
+    except UnicodeDecodeError:
+        raise ValidationError({'file': 'O arquivo deve estar codificado em UTF-8.'})
+    result = import_entries(empresa_pk, codecs.iterdecode(upload, 'utf-8'), file_format)
+    return Response(result.as_dict(), status=status.HTTP_400_BAD_REQUEST if result.errors and not result.created
+                    else status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def entries_status(request):
+    u"""Muda o status de um conjunto de lançamentos.
+
+    ``status`` é o novo status; os lançamentos são selecionados por ``ids`` e pelos
+    filtros ``start``, ``end`` e ``from`` (status atual). Lançamentos em uso por outra
+    transação são pulados. A resposta traz a contagem e o resultado de cada lançamento.
+    """
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    ids = request.data.get('ids')
+    if ids is not None:
+        try:
+            ids = [uuid.UUID(str(pk)) for pk in ids]
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': 'Informe uma lista de ids.'})
+    dates = {}
+    for name in ('start', 'end'):
+        value = request.data.get(name)
+        dates[name] = parse_date(value) if isinstance(value, str) else None
+        if value and dates[name] is None:
+            raise ValidationError({name: 'Informe uma data no formato AAAA-MM-DD.'})
+    try:
+        outcomes = transition_entries(empresa_pk, request.data.get('status'), ids=ids, current=request.data.get('from'),
+                                      **dates)
+    except TransitionError as error:
+        raise ValidationError({'status': str(error)})
+    return Response(summarize(outcomes))
+
+
+@api_view(['POST'])
+@parser_classes((MultiPartParser,))
+def statement_import(request, pk):
+    u"""Importa o extrato OFX enviado em ``file`` para a conta do banco.
+
+    ``counterpart`` é o código da conta analítica usada como contrapartida nos lançamentos
+    provisórios. Transações já importadas para a conta são ignoradas e contadas em
+    ``duplicates``.
+    """
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    account = get_object_or_404(Conta, pk=pk, empresa_id=empresa_pk)
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ValidationError({'file': 'Envie o arquivo OFX.'})
+    counterpart = Conta.objects.filter(empresa_id=empresa_pk, codigo=request.data.get('counterpart')).first()
+    if counterpart is None:
+        raise ValidationError({'counterpart': 'Informe o código da conta de contrapartida.'})
+    try:
+        result = import_statement(empresa_pk, account.pk, counterpart.pk, upload)
+    except ValueError as error:
+        raise ValidationError({'account': str(error)})
+    return Response(result.as_dict(), status=status.HTTP_400_BAD_REQUEST if result.errors and not result.created
+                    else status.HTTP_200_OK)
+
+
+@api_view(['GET', 'POST'])
+def account_reconciliation(request, pk):
+    u"""Conciliação bancária da conta no período ``period``.
+
+    ``GET`` lista as linhas de extrato e os itens de lançamento ainda não conciliados;
+    ``POST`` executa a conciliação automática e retorna o resumo das conciliações feitas.
+    """
+    empresa_pk = get_current_empresa_pk(request)
+    account = get_object_or_404(Conta, pk=pk, empresa_id=empresa_pk)
+    try:
+        period_pk = uuid.UUID(request.query_params.get('period') or request.data.get('period') or '')
+    except ValueError:
+        period_pk = None
+    period = Period.objects.filter(pk=period_pk, empresa_id=empresa_pk).first() if period_pk else None
+    if period is None:
+        raise ValidationError({'period': 'Informe o período.'})
+    reconciler = Reconciler(empresa_pk, account.pk, period.start_date, period.end_date)
+    if request.method == 'POST':
+        return Response(reconciler.run())
+    return Response(reconciler.unmatched())
+
+
+@api_view(['GET', 'POST'])
+def fiscal_year_ecd(request, pk):
+    u"""Arquivo da ECD (SPED Contábil) do exercício.
+
+    ``GET`` gera o arquivo enquanto ele é enviado; ``POST`` enfileira a geração e retorna
+    a tarefa, cujo arquivo de resultado é a ECD.
+    """
+    fiscal_year = get_object_or_404(FiscalYear, pk=pk, empresa_id=get_current_empresa_pk(request))
+    if request.method == 'POST':
+        return resposta_tarefa(request, enfileirar('contabil.ecd', fiscal_year.empresa_id,
+                                                   {'fiscal_year': str(fiscal_year.pk)}))
+    response = StreamingHttpResponse(encoded_lines(fiscal_year.empresa, fiscal_year),
+                                     content_type='text/plain; charset=iso-8859-1')
+    response['Content-Disposition'] = 'attachment; filename="ECD-{0}.txt"'.format(fiscal_year.year)
+    return response
+
+
+@api_view(['GET'])
+def dataset_export(request, dataset):
+    u"""Exporta o conjunto de dados ``accounts``, ``periods`` ou ``entries`` em CSV.
+
+    Com ``since`` (data e hora ISO 8601), somente as linhas alteradas depois dessa marca
+    são exportadas. O cabeçalho ``X-Watermark`` traz a marca a usar na próxima exportação.
+    """
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    since = request.query_params.get('since')
+    if since:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            raise ValidationError({'since': 'Informe a data e hora no formato ISO 8601.'})
+    mark = watermark()
+    response = StreamingHttpResponse(csv_chunks(empresa_pk, DATASETS[dataset], since or None),
+                                     content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="{0}.csv"'.format(dataset)
+    response['X-Watermark'] = mark.isoformat()
+    return response
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+u"""Mudança de status de lançamentos em lote.
+
+Os lançamentos selecionados mudam de status em um único comando SQL. As linhas são
+bloqueadas com ``FOR UPDATE SKIP LOCKED``: lançamentos que outra transação está
+alterando (um usuário editando, outro aprovador) são pulados e informados como
+``locked``, em vez de bloquear a operação. As partidas dobradas de cada lançamento são
+conferidas no próprio comando, pela soma dos débitos e créditos dos seus itens; somente
+a volta para rascunho aceita lançamentos incompletos.
+"""
+
+from collections import namedtuple
+
+from django.db import connection
+
+from .models import Entry
+from .models import EntryItem
+
+
+# Status de origem aceitos para cada status de destino.
+TRANSITIONS = {
+    Entry.DRAFT: (Entry.PENDING,),
+    Entry.PENDING: (Entry.DRAFT,),
+    Entry.APPROVED: (Entry.PENDING,),
+    Entry.FROZEN: (Entry.APPROVED,),
+}
+
+UPDATED = 'updated'
+LOCKED = 'locked'
+UNBALANCED = 'unbalanced'
+INVALID = 'invalid'
+
+Outcome = namedtuple('Outcome', 'id status outcome')
+
+TRANSITION_SQL = '''
+WITH matching AS (
+    SELECT e.id, e.status
+      FROM {entry} e
+     WHERE e.empresa_id = %s {where}
+), candidates AS (
+    SELECT e.id
+      FROM {entry} e
+     WHERE e.empresa_id = %s {where} AND e.status IN %s
+       FOR UPDATE SKIP LOCKED
+), totals AS (
+    SELECT c.id, COALESCE(SUM(i.debit_value), 0) AS debit, COALESCE(SUM(i.credit_value), 0) AS credit,
+           COUNT(i.id) AS items
+      FROM candidates c
+      LEFT JOIN {item} i ON i.entry_id = c.id
+     GROUP BY c.id
+), updated AS (
+    UPDATE {entry} e
+       SET status = %s, modified = now()
+      FROM totals t
+     WHERE e.id = t.id AND (%s OR (t.items > 0 AND t.debit = t.credit))
+ RETURNING e.id
+)
+SELECT m.id, m.status,
+       CASE WHEN u.id IS NOT NULL THEN %s
+            WHEN t.id IS NOT NULL THEN %s
+            WHEN m.status IN %s THEN %s
+            ELSE %s END
+  FROM matching m
+  LEFT JOIN totals t ON t.id = m.id
+  LEFT JOIN updated u ON u.id = m.id
+ ORDER BY m.id
+'''
+
+
+class TransitionError(ValueError):
+    u"""A mudança de status pedida não é permitida."""
+
+
+def _filters(ids, start, end, current):
+    where, params = [], []
+    if ids is not None:
+        where.append('AND e.id = ANY(%s::uuid[])')
+        params.append([str(pk) for pk in ids])
+    if start is not None:
+        where.append('AND e.date >= %s')
+        params.append(start)
+    if end is not None:
+        where.append('AND e.date <= %s')
+        params.append(end)
+    if current is not None:
+        where.append('AND e.status = %s')
+        params.append(current)
+    return ' '.join(where), params
+
+
+def transition_entries(empresa_id, status, ids=None, start=None, end=None, current=None):
+    u"""Muda para ``status`` os lançamentos da empresa selecionados pelos filtros.
+
+    Os filtros são os ids, o intervalo de datas e o status atual. Retorna a lista de
+    :class:`Outcome`, uma por lançamento selecionado, com o status anterior e o
+    resultado: ``updated``, ``locked`` (em uso por outra transação), ``unbalanced``
+    (sem itens ou com débitos diferentes dos créditos) ou ``invalid`` (status atual não
+    permite a mudança).
+    """
+    if status not in TRANSITIONS:
+        raise TransitionError('Status inválido: {0}.'.format(status))
+    if ids is None and start is None and end is None and current is None:
+        raise TransitionError('Informe os lançamentos ou um filtro.')
+    sources = TRANSITIONS[status]
+    where, filter_params = _filters(ids, start, end, current)
+    sql = TRANSITION_SQL.format(entry=Entry._meta.db_table, item=EntryItem._meta.db_table, where=where)
+    params = ([empresa_id] + filter_params + [empresa_id] + filter_params +
+              [sources, status, status == Entry.DRAFT, UPDATED, UNBALANCED, sources, LOCKED, INVALID])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [Outcome(*row) for row in cursor.fetchall()]
+
+
+def summarize(outcomes):
+    u"""Resume o resultado da mudança de status, com a contagem por resultado."""
+    summary = dict((outcome, 0) for outcome in (UPDATED, LOCKED, UNBALANCED, INVALID))
+    for outcome in outcomes:
+        summary[outcome.outcome] += 1
+    summary['entries'] = [{'id': outcome.id, 'status': outcome.status, 'outcome': outcome.outcome}
+                          for outcome in outcomes]
+    return summary
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+u"""Autenticação JWT com cache dos usuários.
+
+O usuário de cada token e as suas empresas ficam em um cache local ao processo,
+limitado em tamanho e conferido periodicamente com a versão do usuário (:class:`Versao`),
+que é incrementada sempre que o usuário, a sua senha ou as suas empresas mudam. Assim os
+requests autenticados não consultam o banco para obter o usuário.
+"""
+
+import copy
+
+from django.utils.translation import ugettext as _
+
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.settings import api_settings
+
+from gestaolivre.apps.utils.cache import VersionedCache
+
+from .models import Usuario
+
+
+def _build(user_id):
+    user = Usuario.objects.filter(pk=user_id).first()
+    if user is None:
+        return None
+    empresas = [[empresa.cnpj.format('r'), str(empresa.pk)] for empresa in user.empresa.all()]
+    return user, empresas
+
+
+_cache = VersionedCache('geral.usuarios', _build, ttl=30, maxsize=4096)
+
+
+def usuario_cacheado(user_id):
+    u"""Obtém ``(usuário, empresas)`` do cache, ou ``None`` se o usuário não existir.
+
+    As empresas são pares ``[cnpj, id]``, no formato do token. O usuário guardado é
+    compartilhado entre os requests e não deve ser alterado.
+    """
+    return _cache.get(str(user_id))
+
+
+def invalidar_usuario(user_id):
+    u"""Descarta o usuário do cache em todos os processos."""
+    _cache.invalidate(str(user_id))
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    u"""Autenticação JWT que obtém o usuário do cache em vez do banco."""
+
+    def authenticate(self, request):
+        u"""Autentica o request e guarda nele as empresas permitidas ao usuário."""
+        result = super(CachedJSONWebTokenAuthentication, self).authenticate(request)
+        if result is not None:
+            http_request = getattr(request, '_request', request)
+            http_request.empresas_permitidas = result[0].empresas_permitidas
+        return result
+
+    def authenticate_credentials(self, payload):
+        u"""Obtém o usuário ativo do ``user_id`` do token, conferindo o email."""
+        username = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+        if not username or not payload.get('user_id'):
+            raise exceptions.AuthenticationFailed(_('Invalid payload.'))
+        cached = usuario_cacheado(payload['user_id'])
+        if cached is None or cached[0].get_username() != username:
+            raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+        if not cached[0].is_active:
+            raise exceptions.AuthenticationFailed(_('User account is disabled.'))
+        user = copy.copy(cached[0])
+        user.empresas_permitidas = cached[1]
+        return user
@@ -1,28 +1,100 @@
 # -*- coding: utf-8 -*-
-u"""Modelos gerais do Gestão Livre."""
+u"""Autenticação por email do Gestão Livre.
 
+O login é o caminho mais exposto da API, portanto:
+
+* o usuário é encontrado pelo email normalizado, uma coluna indexada;
+* um email desconhecido também calcula um hash de senha, para que o tempo da resposta
+  não revele quais emails estão cadastrados;
+* uma senha correta gravada com outro algoritmo ou custo é gravada de novo com o
+  hasher atual (``PASSWORD_HASHERS``/``SENHA_ITERACOES``);
+* as tentativas são contadas por conta e por IP no cache compartilhado (``CACHES``), e
+  rajadas acima de ``LOGIN_LIMITE_IP`` ou ``LOGIN_LIMITE_CONTA`` na janela de
+  ``LOGIN_JANELA`` segundos são recusadas antes de calcular qualquer hash. O IP é o
+  ``REMOTE_ADDR``, ou o ``X-Real-IP`` com ``LOGIN_PROXY_CONFIAVEL``, quando a aplicação
+  só é acessível através do proxy que define esse cabeçalho.
+"""
+
+import hashlib
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.utils.crypto import get_random_string
+
+from gestaolivre.apps.utils.middleware import GlobalRequestMiddleware
+
+from .models import normalizar_email
 
 
 User = get_user_model()
 
+_hash_falso = []
+
+
+def hash_falso():
+    u"""Hash de uma senha aleatória, calculado uma vez com o hasher atual."""
+    if not _hash_falso:
+        _hash_falso.append(make_password(get_random_string(20)))
+    return _hash_falso[0]
+
+
+def _ip(request):
+    u"""Endereço do cliente; o ``X-Real-IP`` só é usado atrás de um proxy confiável."""
+    if request is None:
+        return None
+    if getattr(settings, 'LOGIN_PROXY_CONFIAVEL', False):
+        return request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR')
+    return request.META.get('REMOTE_ADDR')
+
+
+def _chave(tipo, valor):
+    return 'geral.login.{0}.{1}'.format(tipo, hashlib.sha1(valor.encode('utf-8')).hexdigest())
+
+
+def _contar(chave, janela):
+    u"""Incrementa o contador da chave, criando-o com a validade da janela."""
+    if cache.add(chave, 1, janela):
+        return 1
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        cache.set(chave, 1, janela)
+        return 1
+
 
 class EmailModelBackend(object):
-    u"""This is a ModelBacked that allows authentication with an email address."""
+    u"""Backend de autenticação pelo email e senha do usuário."""
 
-    def authenticate(self, **credentials):
-        u"""Authenticate user by email."""
-        print("Ops: " + str(credentials))
-        try:
-            user = User.objects.get(email=credentials['email'])
-            if user.check_password(credentials['password']):
-                return user
-        except User.DoesNotExist:
+    def authenticate(self, email=None, password=None, username=None, **kwargs):
+        u"""Autentica o usuário pelo email, limitando as tentativas por conta e por IP."""
+        email = normalizar_email(email or username)
+        if not email or password is None:
+            return None
+        janela = getattr(settings, 'LOGIN_JANELA', 300)
+        conta = _chave('conta', email)
+        ip = _ip(GlobalRequestMiddleware.get_current_request())
+        if ip is not None and _contar(_chave('ip', ip), janela) > getattr(settings, 'LOGIN_LIMITE_IP', 100):
+            raise PermissionDenied('Muitas tentativas de login deste endereço.')
+        if (cache.get(conta) or 0) >= getattr(settings, 'LOGIN_LIMITE_CONTA', 10):
+            raise PermissionDenied('Muitas tentativas de login para esta conta.')
+        user = User.objects.filter(email_normalizado=email).first()
+        if user is None:
+            check_password(password, hash_falso())
+            _contar(conta, janela)
+            return None
+        if not user.check_password(password) or not user.is_active:
+            _contar(conta, janela)
             return None
+        cache.delete(conta)
+        return user
 
-    def get_user(self, username):
-        u"""Get user by its email."""
+    def get_user(self, user_id):
+        u"""Obtém o usuário pela chave."""
         try:
-            return User.objects.get(email=username)
-        except User.DoesNotExist:
+            return User.objects.get(pk=user_id)
+        except (User.DoesNotExist, ValueError):
             return None
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+u"""Algoritmos de hash de senhas do Gestão Livre."""
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    u"""PBKDF2 com a quantidade de iterações de ``SENHA_ITERACOES``.
+
+    Usa o mesmo nome de algoritmo do hasher padrão, portanto as senhas já gravadas
+    continuam válidas e são gravadas de novo com o novo custo no próximo login.
+    """
+
+    @property
+    def iterations(self):
+        u"""Quantidade de iterações configurada."""
+        return getattr(settings, 'SENHA_ITERACOES', PBKDF2PasswordHasher.iterations)
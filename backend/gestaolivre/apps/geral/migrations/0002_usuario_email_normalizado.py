@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-06-11 09:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def normalizar(apps, schema_editor):
+    Usuario = apps.get_model('geral', 'Usuario')
+    for pk, email in Usuario.objects.values_list('pk', 'email'):
+        Usuario.objects.filter(pk=pk).update(email_normalizado=(email or '').strip().lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='email_normalizado',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(normalizar, migrations.RunPython.noop),
+    ]
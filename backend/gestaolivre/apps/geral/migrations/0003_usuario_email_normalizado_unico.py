@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-06-25 11:20
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def resolver_colisoes(apps, schema_editor):
+    u"""Mantém o email normalizado no usuário com o login mais recente de cada grupo.
+
+    Os demais usuários cujo email difere apenas em maiúsculas ou espaços recebem um valor
+    único prefixado pela chave, que não corresponde a nenhum email, e precisam ter o email
+    corrigido para voltar a entrar.
+    """
+    Usuario = apps.get_model('geral', 'Usuario')
+    grupos = defaultdict(list)
+    for pk, email, last_login in Usuario.objects.values_list('pk', 'email', 'last_login'):
+        grupos[(email or '').strip().lower()].append((last_login is not None, last_login, pk))
+    for email, usuarios in grupos.items():
+        usuarios.sort(key=lambda usuario: usuario[:2], reverse=True)
+        Usuario.objects.filter(pk=usuarios[0][2]).update(email_normalizado=email)
+        for _, _, pk in usuarios[1:]:
+            Usuario.objects.filter(pk=pk).update(email_normalizado='{0}:{1}'.format(pk, email)[:255])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geral', '0002_usuario_email_normalizado'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolver_colisoes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='usuario',
+            name='email_normalizado',
+            field=models.CharField(editable=False, max_length=255, unique=True),
+        ),
+    ]
@@ -1,28 +1,127 @@
 # -*- coding: utf-8 -*-
 u"""Modelos gerais do Gestão Livre."""
 
+import re
 import uuid
+from contextlib import contextmanager
+from threading import local
 
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import BaseUserManager
 from django.contrib.postgres.fields import JSONField
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils.functional import cached_property
 
 from brazil_fields.fields import CNPJField
 
 from gestaolivre.apps.utils.middleware import GlobalRequestMiddleware
 
 
-def get_current_empresa(request=None):
-    u"""Obtem a empresa selecionada através das informações do request."""
-    if not request:
-        request = GlobalRequestMiddleware.get_current_request()
-    return request.user.domainuser.domains.first()
+_tenant = local()
+
+
+def normalizar_email(email):
+    u"""Forma normalizada do email, usada para encontrar o usuário no login."""
+    return (email or '').strip().lower()
+
+
+@contextmanager
+def current_empresa(empresa):
+    u"""Define a empresa corrente para o código executado fora de um request.
+
+    Usado por comandos de gestão e processamentos em lote: dentro do bloco, a empresa
+    informada (objeto ou chave) é a empresa corrente, sem consultas ao banco.
+    """
+    previous = getattr(_tenant, 'empresa_pk', None)
+    _tenant.empresa_pk = _as_uuid(getattr(empresa, 'pk', empresa))
+    try:
+        yield
+    finally:
+        _tenant.empresa_pk = previous
+
+
+def _as_uuid(value):
+    if value is None or isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _token_empresas(request):
+    u"""Obtém as empresas autorizadas pelo token JWT do request, sem consultas ao banco.
+
+    O token traz em ``empresas`` a lista de ``[cnpj, id]`` das empresas do usuário.
+    Retorna ``None`` se o request não tiver um token válido com essa informação.
+    """
+    import jwt
+    from rest_framework.authentication import get_authorization_header
+    from rest_framework_jwt.settings import api_settings
+
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != api_settings.JWT_AUTH_HEADER_PREFIX.lower().encode():
+        return None
+    try:
+        payload = api_settings.JWT_DECODE_HANDLER(auth[1].decode())
+    except (jwt.InvalidTokenError, UnicodeError):
+        return None
+    return payload.get('empresas')
+
+
+def _resolve_empresa_pk(request):
+    selected = request.META.get('HTTP_X_EMPRESA', '').strip()
+    empresas = _token_empresas(request)
+    # Empresas atuais do usuário, guardadas pela autenticação com cache.
+    permitidas = getattr(getattr(request, '_request', request), 'empresas_permitidas', None)
+    if empresas is not None and permitidas is not None:
+        empresas = [empresa for empresa in empresas if empresa in permitidas]
+    if empresas is not None:
+        for cnpj, pk in empresas:
+            if not selected or selected in (cnpj, pk) or re.sub(r'\D', '', selected) == cnpj:
+                return _as_uuid(pk)
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated():
+        return None
+    empresas = user.empresa.all()
+    if selected:
+        selected_pk = _as_uuid(selected)
+        empresas = empresas.filter(pk=selected_pk) if selected_pk else empresas.filter(cnpj=re.sub(r'\D', '', selected))
+    return empresas.values_list('pk', flat=True).first()
 
 
 def get_current_empresa_pk(request=None):
+    u"""Obtem a chave da empresa selecionada através das informações do request.
+
+    A empresa vem de :func:`current_empresa`, quando em uso, ou do request atual: do
+    cabeçalho ``X-Empresa`` (CNPJ ou chave) validado pelas empresas do token JWT, do
+    primeiro item dessas empresas ou, sem token, das empresas do usuário. O resultado é
+    guardado no request, de modo que a resolução acontece uma única vez por request.
+    """
+    if request is None:
+        empresa_pk = getattr(_tenant, 'empresa_pk', None)
+        if empresa_pk is not None:
+            return empresa_pk
+        request = GlobalRequestMiddleware.get_current_request()
+        if request is None:
+            return None
+    http_request = getattr(request, '_request', request)
+    if not hasattr(http_request, 'empresa_pk'):
+        http_request.empresa_pk = _resolve_empresa_pk(request)
+    return http_request.empresa_pk
+
+
+def get_current_empresa(request=None):
     u"""Obtem a empresa selecionada através das informações do request."""
-    return get_current_empresa(request).pk
+    empresa_pk = get_current_empresa_pk(request)
+    return Empresa.objects.filter(pk=empresa_pk).first() if empresa_pk else None
 
 
 class BaseModel(models.Model):
@@ -56,6 +155,11 @@ class Empresa(BaseModel):
         verbose_name = 'empresa'
         verbose_name_plural = 'empresas'
 
+    @cached_property
+    def cnpj_numeros(self):
+        u"""CNPJ somente com os números, como usado nas URLs e no token."""
+        return self.cnpj.format('r')
+
 
 class UsuarioManager(BaseUserManager):
     u"""TODO: Documentar."""
@@ -91,6 +195,7 @@ class Usuario(AbstractBaseUser, BaseModel):
         max_length=255,
         unique=True,
     )
+    email_normalizado = models.CharField(max_length=255, unique=True, editable=False)
     is_active = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
     empresa = models.ManyToManyField(Empresa)
@@ -100,6 +205,21 @@ class Usuario(AbstractBaseUser, BaseModel):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['nome']
 
+    def clean(self):
+        u"""Não permite emails que diferem de outro usuário apenas em maiúsculas e espaços."""
+        super(Usuario, self).clean()
+        email = normalizar_email(self.email)
+        if email and Usuario.objects.filter(email_normalizado=email).exclude(pk=self.pk).exists():
+            raise ValidationError({'email': 'Já existe um usuário com este email.'})
+
+    def save(self, *args, **kwargs):
+        u"""Grava o usuário, mantendo o email normalizado."""
+        self.email_normalizado = normalizar_email(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'email_normalizado'}
+        super(Usuario, self).save(*args, **kwargs)
+
     def get_full_name(self):
         u"""TODO: Documentar."""
         return self.nome
@@ -137,10 +257,93 @@ class PublicoModel(BaseModel):
         abstract = True
 
 
+class EmpresaQuerySet(models.QuerySet):
+    u"""QuerySet de modelos privados de uma empresa."""
+
+    def da_empresa(self, empresa):
+        u"""Filtra os objetos da empresa informada (objeto ou chave)."""
+        return self.filter(empresa_id=getattr(empresa, 'pk', empresa))
+
+
+class EmpresaManager(models.Manager.from_queryset(EmpresaQuerySet)):
+    u"""Gerenciador que filtra automaticamente pela empresa corrente.
+
+    Dentro de um request, ou de :func:`current_empresa`, as consultas ficam restritas à
+    empresa corrente; num request sem empresa selecionada não retornam nada. Fora desses
+    contextos, como em migrações, não há filtro. :meth:`all_empresas` ignora o filtro.
+    """
+
+    def get_queryset(self):
+        u"""Obtém o QuerySet restrito à empresa corrente."""
+        queryset = super(EmpresaManager, self).get_queryset()
+        empresa_pk = get_current_empresa_pk()
+        if empresa_pk is not None:
+            return queryset.filter(empresa_id=empresa_pk)
+        if GlobalRequestMiddleware.get_current_request() is not None:
+            return queryset.none()
+        return queryset
+
+    def all_empresas(self):
+        u"""Obtém o QuerySet sem o filtro da empresa corrente."""
+        return super(EmpresaManager, self).get_queryset()
+
+
 class EmpresaModel(BaseModel):
     u"""Modelo privado de uma empresa."""
 
     empresa = models.ForeignKey(Empresa, default=get_current_empresa_pk)
 
+    objects = EmpresaManager()
+
     class Meta(object):
         abstract = True
+
+
+def _invalidar_usuarios(user_ids):
+    from .authentication import invalidar_usuario
+    for user_id in user_ids:
+        invalidar_usuario(user_id)
+
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def invalidar_usuario_alterado(sender, instance, **kwargs):
+    u"""Descarta do cache de autenticação o usuário alterado, inclusive na troca de senha."""
+    _invalidar_usuarios([instance.pk])
+
+
+@receiver(m2m_changed, sender=Usuario.empresa.through)
+def invalidar_empresas_do_usuario(sender, instance, action, reverse, pk_set, **kwargs):
+    u"""Descarta do cache de autenticação os usuários cujas empresas mudaram."""
+    if reverse and action == 'pre_clear':
+        _invalidar_usuarios(list(instance.usuario_set.values_list('pk', flat=True)))
+    elif not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        _invalidar_usuarios([instance.pk])
+    elif reverse and action in ('post_add', 'post_remove'):
+        _invalidar_usuarios(pk_set or ())
+
+
+@receiver(post_save, sender=Empresa)
+def invalidar_usuarios_da_empresa(sender, instance, created, **kwargs):
+    u"""Descarta do cache de autenticação os usuários da empresa alterada, cujo CNPJ pode ter mudado."""
+    if not created:
+        _invalidar_usuarios(list(instance.usuario_set.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Empresa)
+def invalidar_usuarios_da_empresa_apagada(sender, instance, **kwargs):
+    u"""Descarta do cache de autenticação os usuários da empresa apagada.
+
+    A exclusão apaga as associações com os usuários sem enviar ``m2m_changed``. A versão
+    dos usuários é incrementada na mesma transação, portanto os outros processos só a
+    percebem junto com a exclusão.
+    """
+    _invalidar_usuarios(list(instance.usuario_set.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=Empresa)
+@receiver(post_delete, sender=Empresa)
+def versionar_empresas(sender, instance, **kwargs):
+    u"""Incrementa a versão do recurso de empresas da API, invalidando os seus ETags."""
+    from gestaolivre.apps.utils.api import invalidate_resource
+    invalidate_resource('geral.empresas')
@@ -2,16 +2,18 @@
 u"""Serializadores do aplicativo geral."""
 
 from rest_framework import serializers
-from rest_framework.reverse import reverse
+
+from gestaolivre.apps.utils.api import SparseFieldsMixin
+from gestaolivre.apps.utils.api import TemplatedHyperlinkField
 
 from .models import Empresa
 
 
-class EmpresaSerializer(serializers.HyperlinkedModelSerializer):
+class EmpresaSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     u"""Serializador do modelo Empresa."""
 
-    self = serializers.SerializerMethodField()
-    cnpj = serializers.SerializerMethodField()
+    self = TemplatedHyperlinkField('empresa-detail', lookup_field='cnpj_numeros', lookup_url_kwarg='cnpj')
+    cnpj = serializers.CharField(source='cnpj_numeros', read_only=True)
 
     class Meta:
         model = Empresa
@@ -19,13 +21,3 @@ class EmpresaSerializer(serializers.HyperlinkedModelSerializer):
         extra_kwargs = {
             'parent': {'lookup_field': 'cnpj'}
         }
-
-    def get_self(self, obj):
-        u"""Obtem um link para este objeto."""
-        request = self.context['request']
-        return reverse(self.Meta.model.__name__.lower() + '-detail', kwargs={'cnpj': obj.cnpj.format('r')},
-                       request=request)
-
-    def get_cnpj(self, obj):
-        u"""Obtem um link para este objeto."""
-        return obj.cnpj.format('r')
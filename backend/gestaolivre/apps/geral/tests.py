@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+u"""Testes do aplicativo geral."""
+
+from datetime import datetime
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test import override_settings
+
+from rest_framework import exceptions
+from rest_framework_jwt.settings import api_settings
+
+from gestaolivre.apps.utils.middleware import GlobalRequestMiddleware
+
+from .authentication import CachedJSONWebTokenAuthentication
+from .authentication import usuario_cacheado
+from .backends import EmailModelBackend
+from .models import Empresa
+from .models import Usuario
+from .models import current_empresa
+from .models import get_current_empresa_pk
+
+
+@override_settings(SENHA_ITERACOES=1000, LOGIN_JANELA=60, LOGIN_LIMITE_CONTA=3, LOGIN_LIMITE_IP=5)
+class EmailModelBackendTest(TestCase):
+    u"""Login pelo email normalizado, com limite de tentativas."""
+
+    def setUp(self):
+        u"""Cria o usuário e limpa os contadores de tentativas."""
+        cache.clear()
+        self.backend = EmailModelBackend()
+        self.middleware = GlobalRequestMiddleware()
+        self.usuario = Usuario.objects.create_user('Fulano@Exemplo.com', 'Fulano', 'senha')
+
+    def tearDown(self):
+        u"""Descarta o request da thread."""
+        self.middleware.process_response(None, HttpResponse())
+
+    def _request(self, ip, **headers):
+        self.middleware.process_request(RequestFactory().post('/', REMOTE_ADDR=ip, **headers))
+
+    def test_email_normalizado(self):
+        u"""O email é encontrado sem diferenciar maiúsculas e espaços e não pode ser repetido assim."""
+        self.assertEqual(self.usuario.email_normalizado, 'fulano@exemplo.com')
+        self.assertEqual(self.backend.authenticate(email=' FULANO@exemplo.COM ', password='senha'), self.usuario)
+        self.assertIsNone(self.backend.authenticate(email='fulano@exemplo.com', password='outra'))
+        with self.assertRaises(ValidationError):
+            Usuario(email='fulano@EXEMPLO.com ', nome='Outro').clean()
+
+    def test_limite_conta(self):
+        u"""Depois do limite de senhas erradas, nem a senha certa é aceita; o acerto zera o contador."""
+        for _ in range(2):
+            self.assertIsNone(self.backend.authenticate(email='fulano@exemplo.com', password='errada'))
+        self.assertEqual(self.backend.authenticate(email='fulano@exemplo.com', password='senha'), self.usuario)
+        for _ in range(3):
+            self.assertIsNone(self.backend.authenticate(email='FULANO@exemplo.com', password='errada'))
+        with self.assertRaises(PermissionDenied):
+            self.backend.authenticate(email='fulano@exemplo.com', password='senha')
+
+    def test_limite_ip(self):
+        u"""As tentativas contam pelo ``REMOTE_ADDR``; o ``X-Real-IP`` sem proxy confiável é ignorado."""
+        for numero in range(5):
+            self._request('10.0.0.1', HTTP_X_REAL_IP='10.0.1.{0}'.format(numero))
+            self.assertIsNone(self.backend.authenticate(email='{0}@exemplo.com'.format(numero), password='x'))
+        with self.assertRaises(PermissionDenied):
+            self.backend.authenticate(email='fulano@exemplo.com', password='senha')
+        self._request('10.0.0.2')
+        self.assertEqual(self.backend.authenticate(email='fulano@exemplo.com', password='senha'), self.usuario)
+
+    def test_limite_ip_proxy_confiavel(self):
+        u"""Com proxy confiável, as tentativas contam pelo ``X-Real-IP``."""
+        with self.settings(LOGIN_PROXY_CONFIAVEL=True):
+            for numero in range(5):
+                self._request('10.0.0.1', HTTP_X_REAL_IP='10.0.1.1')
+                self.backend.authenticate(email='{0}@exemplo.com'.format(numero), password='x')
+            self._request('10.0.0.1', HTTP_X_REAL_IP='10.0.1.2')
+            self.assertEqual(self.backend.authenticate(email='fulano@exemplo.com', password='senha'), self.usuario)
+
+    def test_novo_custo(self):
+        u"""A senha correta é gravada de novo com o custo atual."""
+        with self.settings(SENHA_ITERACOES=2000):
+            self.backend.authenticate(email='fulano@exemplo.com', password='senha')
+        self.assertTrue(Usuario.objects.get(pk=self.usuario.pk).password.startswith('pbkdf2_sha256$2000$'))
+
+
+class UsuarioCacheadoTest(TestCase):
+    u"""Cache de autenticação descartado quando o usuário ou as suas empresas mudam."""
+
+    def setUp(self):
+        u"""Cria o usuário com uma empresa e o carrega no cache."""
+        self.usuario = Usuario.objects.create_user('fulano@exemplo.com', 'Fulano', 'senha')
+        self.primeira = Empresa.objects.create(cnpj='11222333000181', razao_social='Primeira',
+                                               nome_fantasia='Primeira')
+        self.segunda = Empresa.objects.create(cnpj='11444777000161', razao_social='Segunda', nome_fantasia='Segunda')
+        self.usuario.empresa.add(self.primeira)
+        self.assertEqual(self._empresas(), [str(self.primeira.pk)])
+
+    def _empresas(self):
+        return sorted(pk for _, pk in usuario_cacheado(self.usuario.pk)[1])
+
+    def _autenticar(self, email='fulano@exemplo.com'):
+        payload = {'user_id': str(self.usuario.pk), 'username': email}
+        return CachedJSONWebTokenAuthentication().authenticate_credentials(payload)
+
+    def test_empresas(self):
+        u"""Associações feitas pelos dois lados e a exclusão da empresa atualizam o cache."""
+        self.segunda.usuario_set.add(self.usuario)
+        self.assertEqual(self._empresas(), sorted([str(self.primeira.pk), str(self.segunda.pk)]))
+        self.usuario.empresa.remove(self.primeira)
+        self.assertEqual(self._empresas(), [str(self.segunda.pk)])
+        self.segunda.delete()
+        self.assertEqual(self._empresas(), [])
+
+    def test_credenciais(self):
+        u"""O token só vale para o email atual do usuário ativo."""
+        self.assertEqual(self._autenticar().empresas_permitidas, usuario_cacheado(self.usuario.pk)[1])
+        self.usuario.email = 'beltrano@exemplo.com'
+        self.usuario.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self._autenticar()
+        self.assertEqual(self._autenticar('beltrano@exemplo.com').pk, self.usuario.pk)
+        self.usuario.is_active = False
+        self.usuario.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self._autenticar('beltrano@exemplo.com')
+
+
+class EmpresaCorrenteTest(TestCase):
+    u"""Resolução da empresa selecionada no request."""
+
+    def setUp(self):
+        u"""Cria o usuário com duas empresas e o seu token."""
+        self.usuario = Usuario.objects.create_user('fulano@exemplo.com', 'Fulano', 'senha')
+        self.primeira = Empresa.objects.create(cnpj='11222333000181', razao_social='Primeira',
+                                               nome_fantasia='Primeira')
+        self.segunda = Empresa.objects.create(cnpj='11444777000161', razao_social='Segunda', nome_fantasia='Segunda')
+        self.usuario.empresa.add(self.primeira, self.segunda)
+        self.empresas = [[empresa.cnpj_numeros, str(empresa.pk)] for empresa in (self.primeira, self.segunda)]
+        token = api_settings.JWT_ENCODE_HANDLER({'user_id': self.usuario.pk, 'username': self.usuario.email,
+                                                 'exp': datetime.utcnow() + timedelta(minutes=5),
+                                                 'empresas': self.empresas})
+        self.autorizacao = 'Bearer {0}'.format(token)
+
+    def _request(self, **headers):
+        return RequestFactory().get('/', HTTP_AUTHORIZATION=self.autorizacao, **headers)
+
+    def test_token(self):
+        u"""A empresa vem do token, pelo CNPJ em qualquer formato ou pela chave, sem consultas."""
+        with self.assertNumQueries(0):
+            self.assertEqual(get_current_empresa_pk(self._request()), self.primeira.pk)
+            for selecionada in ('11.444.777/0001-61', '11444777000161', str(self.segunda.pk)):
+                self.assertEqual(get_current_empresa_pk(self._request(HTTP_X_EMPRESA=selecionada)), self.segunda.pk)
+            self.assertIsNone(get_current_empresa_pk(self._request(HTTP_X_EMPRESA='11222333000100')))
+
+    def test_empresas_permitidas(self):
+        u"""Empresas retiradas do usuário depois da emissão do token são recusadas."""
+        request = self._request(HTTP_X_EMPRESA=str(self.segunda.pk))
+        request.empresas_permitidas = self.empresas[:1]
+        self.assertIsNone(get_current_empresa_pk(request))
+
+    def test_resolvida_uma_vez(self):
+        u"""O resultado fica guardado no request; ``current_empresa`` tem precedência sobre o request."""
+        request = self._request(HTTP_X_EMPRESA=str(self.segunda.pk))
+        self.assertEqual(get_current_empresa_pk(request), self.segunda.pk)
+        request.META['HTTP_X_EMPRESA'] = str(self.primeira.pk)
+        self.assertEqual(get_current_empresa_pk(request), self.segunda.pk)
+        middleware = GlobalRequestMiddleware()
+        middleware.process_request(request)
+        try:
+            with current_empresa(self.primeira):
+                self.assertEqual(get_current_empresa_pk(), self.primeira.pk)
+            self.assertEqual(get_current_empresa_pk(), self.segunda.pk)
+        finally:
+            middleware.process_response(request, HttpResponse())
@@ -4,13 +4,17 @@ u"""Views do aplicativo geral."""
 from rest_framework import permissions
 from rest_framework import viewsets
 
+from gestaolivre.apps.utils.api import ConditionalMixin
+
 from .models import Empresa
 from .serializers import EmpresaSerializer
 
 
-class EmpresaViewSet(viewsets.ModelViewSet):
+class EmpresaViewSet(ConditionalMixin, viewsets.ModelViewSet):
     u"""API da empresa."""
 
+    resource = 'geral.empresas'
+    per_empresa = False
     queryset = Empresa.objects.all()
     lookup_field = 'cnpj'
     lookup_value_regex = '[0-9]+'
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+u"""Aplicativo de tarefas em segundo plano do Gestão Livre."""
+
+default_app_config = 'gestaolivre.apps.tarefas.apps.TarefasAppConfig'
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+u"""Configurações do aplicativo de tarefas."""
+
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class TarefasAppConfig(AppConfig):
+    u"""Configuração do aplicativo de tarefas."""
+
+    name = 'gestaolivre.apps.tarefas'
+    verbose_name = 'tarefas'
+
+    def ready(self):
+        u"""Registra os tipos de tarefa definidos no módulo ``tarefas`` de cada aplicativo."""
+        autodiscover_modules('tarefas')
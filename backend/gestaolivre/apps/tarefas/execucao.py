@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+u"""Fila de tarefas em segundo plano, mantida no próprio PostgreSQL.
+
+As tarefas são gravadas em :class:`Tarefa` e reservadas pelos processos de
+``executar_tarefas`` com ``SELECT ... FOR UPDATE SKIP LOCKED``: cada processo pega a
+próxima tarefa livre sem esperar pelos demais. Cada empresa tem no máximo
+``TAREFAS_LIMITE_EMPRESA`` tarefas em execução ao mesmo tempo. Tarefas que falham são
+repetidas com espera crescente até ``max_tentativas``.
+
+Enquanto a tarefa executa, uma linha de execução renova a reserva periodicamente, de modo
+que tarefas longas não são reservadas de novo por outro processo. A reserva só expira se
+o processo parar; nesse caso a tarefa é reservada por outro, e o resultado do processo
+antigo, se ele ainda terminar, é descartado: a conclusão só é gravada pelo dono da reserva.
+
+Os tipos de tarefa são funções registradas com :func:`registrar` no módulo ``tarefas``
+de cada aplicativo. Elas recebem um :class:`Contexto`, para informar o progresso e gravar
+o arquivo de resultado, e os parâmetros da tarefa; o valor retornado é gravado em
+``resultado``.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+
+from gestaolivre.apps.geral.models import current_empresa
+
+from .models import Tarefa
+
+
+RESERVA = timedelta(minutes=5)
+
+RENOVACAO = RESERVA.total_seconds() / 3
+
+ESPERA_TENTATIVA = timedelta(seconds=30)
+
+INTERVALO = 2
+
+LOCK_EMPRESA = 0x746172
+
+CANDIDATA_SQL = '''
+SELECT t.id, t.empresa_id
+  FROM {tarefa} t
+ WHERE t.executar_apos <= now()
+   AND (t.situacao = %(pendente)s OR (t.situacao = %(executando)s AND t.reservada_ate < now()))
+   AND (SELECT COUNT(*) FROM {tarefa} r
+         WHERE r.empresa_id = t.empresa_id AND r.situacao = %(executando)s AND r.reservada_ate >= now()) < %(limite)s
+ ORDER BY t.executar_apos
+ LIMIT 1
+   FOR UPDATE OF t SKIP LOCKED
+'''
+
+EM_EXECUCAO_SQL = '''
+SELECT COUNT(*) FROM {tarefa}
+ WHERE empresa_id = %s AND situacao = %s AND reservada_ate >= now()
+'''
+
+RESERVAR_SQL = '''
+UPDATE {tarefa}
+   SET situacao = %s, tentativas = tentativas + 1, reservada_ate = now() + %s, trabalhador = %s,
+       iniciada = now(), progresso = 0, mensagem = ''
+ WHERE id = %s
+'''
+
+_tipos = {}
+
+
+class TarefaError(Exception):
+    u"""Erro de uma tarefa que não adianta repetir; a mensagem é mostrada ao usuário."""
+
+
+def registrar(tipo):
+    u"""Registra a função decorada como executora das tarefas do tipo informado."""
+    def decorator(funcao):
+        _tipos[tipo] = funcao
+        return funcao
+    return decorator
+
+
+def limite_empresa():
+    u"""Quantidade máxima de tarefas de uma mesma empresa em execução ao mesmo tempo."""
+    return getattr(settings, 'TAREFAS_LIMITE_EMPRESA', 1)
+
+
+def nome_trabalhador():
+    u"""Identificação do processo que executa as tarefas."""
+    return '{0}:{1}'.format(socket.gethostname(), os.getpid())[:100]
+
+
+def _da_reserva(tarefa):
+    u"""A tarefa, somente enquanto a reserva for deste trabalhador."""
+    return Tarefa.objects.all_empresas().filter(pk=tarefa.pk, trabalhador=tarefa.trabalhador,
+                                                tentativas=tarefa.tentativas, situacao=Tarefa.EXECUTANDO)
+
+
+def renovar(tarefa):
+    u"""Renova a reserva da tarefa; retorna ``False`` se a reserva não for mais deste trabalhador."""
+    return bool(_da_reserva(tarefa).update(reservada_ate=timezone.now() + RESERVA))
+
+
+class Renovacao(threading.Thread):
+    u"""Renova a reserva da tarefa a cada ``intervalo`` segundos, até :meth:`parar`."""
+
+    def __init__(self, tarefa, intervalo=RENOVACAO):
+        u"""Inicializa a renovação da reserva da tarefa."""
+        super(Renovacao, self).__init__(name='renovacao-{0}'.format(tarefa.pk), daemon=True)
+        self.tarefa = tarefa
+        self.intervalo = intervalo
+        self._parada = threading.Event()
+
+    def run(self):
+        u"""Renova a reserva até a parada ou a perda da reserva."""
+        try:
+            while not self._parada.wait(self.intervalo):
+                if not renovar(self.tarefa):
+                    break
+        finally:
+            connection.close()
+
+    def parar(self):
+        u"""Interrompe a renovação e espera a linha de execução terminar."""
+        self._parada.set()
+        self.join()
+
+
+class Contexto(object):
+    u"""Acesso da função executora à tarefa em execução."""
+
+    def __init__(self, tarefa):
+        u"""Inicializa o contexto da tarefa."""
+        self.tarefa = tarefa
+        self.diretorio = None
+        self.caminho = None
+        self._ultimo = None
+
+    def progresso(self, atual, total=None, mensagem=''):
+        u"""Informa o progresso, em percentual ou em ``atual`` de ``total``, e renova a reserva."""
+        percentual = int(atual * 100 / total) if total else int(atual)
+        percentual = max(0, min(99, percentual))
+        if (percentual, mensagem) == self._ultimo:
+            return
+        self._ultimo = (percentual, mensagem)
+        _da_reserva(self.tarefa).update(progresso=percentual, mensagem=mensagem[:200],
+                                        reservada_ate=timezone.now() + RESERVA)
+
+    def arquivo(self, nome):
+        u"""Caminho temporário onde gravar o arquivo de resultado, guardado ao fim da tarefa."""
+        if self.diretorio is None:
+            self.diretorio = tempfile.mkdtemp(prefix='gestaolivre-tarefa-')
+        self.caminho = os.path.join(self.diretorio, nome)
+        return self.caminho
+
+    def limpar(self):
+        u"""Remove os arquivos temporários da tarefa."""
+        if self.diretorio is not None:
+            shutil.rmtree(self.diretorio, ignore_errors=True)
+
+
+def enfileirar(tipo, empresa_id, parametros=None, max_tentativas=None):
+    u"""Cria uma tarefa pendente do tipo informado para a empresa.
+
+    Os parâmetros devem ser serializáveis em JSON; são passados como argumentos nomeados
+    para a função executora.
+    """
+    if tipo not in _tipos:
+        raise TarefaError('Tipo de tarefa desconhecido: {0}.'.format(tipo))
+    tarefa = Tarefa(empresa_id=empresa_id, tipo=tipo, parametros=parametros or {})
+    if max_tentativas is not None:
+        tarefa.max_tentativas = max_tentativas
+    tarefa.save()
+    return tarefa
+
+
+def reservar(trabalhador, limite=None):
+    u"""Reserva a próxima tarefa livre para o trabalhador, ou retorna ``None``.
+
+    As empresas que já têm ``limite`` tarefas em execução são ignoradas. A contagem é
+    conferida de novo sob um bloqueio da empresa, de modo que dois processos não reservam
+    ao mesmo tempo a última vaga de uma empresa.
+    """
+    limite = limite or limite_empresa()
+    table = Tarefa._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(CANDIDATA_SQL.format(tarefa=table), {
+            'pendente': Tarefa.PENDENTE, 'executando': Tarefa.EXECUTANDO, 'limite': limite})
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        tarefa_id, empresa_id = row
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', [LOCK_EMPRESA, str(empresa_id)])
+        cursor.execute(EM_EXECUCAO_SQL.format(tarefa=table), [empresa_id, Tarefa.EXECUTANDO])
+        if cursor.fetchone()[0] >= limite:
+            return None
+        cursor.execute(RESERVAR_SQL.format(tarefa=table), [Tarefa.EXECUTANDO, RESERVA, trabalhador, tarefa_id])
+    return Tarefa.objects.all_empresas().get(pk=tarefa_id)
+
+
+def _finalizar(tarefa, **campos):
+    u"""Grava os campos se a reserva ainda for deste trabalhador; retorna se gravou."""
+    if not _da_reserva(tarefa).update(**campos):
+        return False
+    for nome, valor in campos.items():
+        setattr(tarefa, nome, valor)
+    return True
+
+
+def _concluir(tarefa, contexto, resultado):
+    arquivo = tarefa.arquivo
+    if contexto.caminho and os.path.exists(contexto.caminho):
+        with open(contexto.caminho, 'rb') as conteudo:
+            arquivo.save(os.path.basename(contexto.caminho), File(conteudo), save=False)
+    gravada = _finalizar(tarefa, situacao=Tarefa.CONCLUIDA, progresso=100, mensagem='', resultado=resultado,
+                         erro='', concluida=timezone.now(), reservada_ate=None, arquivo=arquivo.name or '')
+    if not gravada and arquivo:
+        arquivo.delete(save=False)
+
+
+def _falhar(tarefa, erro, definitiva):
+    if definitiva:
+        _finalizar(tarefa, erro=erro, reservada_ate=None, situacao=Tarefa.FALHOU, concluida=timezone.now())
+    else:
+        _finalizar(tarefa, erro=erro, reservada_ate=None, situacao=Tarefa.PENDENTE,
+                   executar_apos=timezone.now() + ESPERA_TENTATIVA * 2 ** (tarefa.tentativas - 1))
+
+
+def executar(tarefa):
+    u"""Executa a tarefa reservada, gravando o resultado ou o erro."""
+    funcao = _tipos.get(tarefa.tipo)
+    if funcao is None:
+        _falhar(tarefa, 'Tipo de tarefa desconhecido: {0}.'.format(tarefa.tipo), definitiva=True)
+        return tarefa
+    if tarefa.tentativas > tarefa.max_tentativas:
+        _falhar(tarefa, 'O processo que executava a tarefa foi interrompido.', definitiva=True)
+        return tarefa
+    contexto = Contexto(tarefa)
+    renovacao = Renovacao(tarefa)
+    renovacao.start()
+    try:
+        with current_empresa(tarefa.empresa_id):
+            resultado = funcao(contexto, **tarefa.parametros)
+    except TarefaError as error:
+        close_old_connections()
+        _falhar(tarefa, str(error), definitiva=True)
+    except Exception:
+        close_old_connections()
+        _falhar(tarefa, traceback.format_exc(), definitiva=tarefa.tentativas >= tarefa.max_tentativas)
+    else:
+        _concluir(tarefa, contexto, resultado)
+    finally:
+        renovacao.parar()
+        contexto.limpar()
+    return tarefa
+
+
+def trabalhar(parar, intervalo=INTERVALO, ate_esvaziar=False):
+    u"""Executa tarefas até que ``parar()`` seja verdadeiro.
+
+    Sem tarefas livres, espera ``intervalo`` segundos antes de procurar de novo; com
+    ``ate_esvaziar``, termina assim que não houver tarefa livre. Retorna a quantidade de
+    tarefas executadas.
+    """
+    trabalhador = nome_trabalhador()
+    executadas = 0
+    while not parar():
+        close_old_connections()
+        tarefa = reservar(trabalhador)
+        if tarefa is None:
+            if ate_esvaziar:
+                break
+            time.sleep(intervalo)
+            continue
+        executar(tarefa)
+        executadas += 1
+    return executadas
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+u"""Comandos de gestão do aplicativo de tarefas."""
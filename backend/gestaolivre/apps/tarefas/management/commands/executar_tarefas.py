@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+u"""Executa as tarefas em segundo plano, com um ou mais processos."""
+
+import signal
+from multiprocessing import Event
+from multiprocessing import Process
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from gestaolivre.apps.tarefas.execucao import INTERVALO
+from gestaolivre.apps.tarefas.execucao import trabalhar
+
+
+def _processo(parar, intervalo, ate_esvaziar):
+    signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    signal.signal(signal.SIGINT, lambda *args: parar.set())
+    trabalhar(parar.is_set, intervalo, ate_esvaziar)
+
+
+class Command(BaseCommand):
+    u"""Executa as tarefas em segundo plano, com um ou mais processos."""
+
+    help = 'Executa as tarefas em segundo plano até receber SIGTERM ou SIGINT.'
+
+    def add_arguments(self, parser):
+        u"""Adiciona as opções do comando."""
+        parser.add_argument('--processos', type=int, default=2, help='Quantidade de processos.')
+        parser.add_argument('--intervalo', type=float, default=INTERVALO,
+                            help='Segundos de espera quando não há tarefas.')
+        parser.add_argument('--ate-esvaziar', action='store_true', default=False,
+                            help='Termina quando não houver mais tarefas livres.')
+
+    def handle(self, *args, **options):
+        u"""Inicia os processos e espera que terminem a tarefa em andamento ao receber o sinal de parada."""
+        parar = Event()
+        if options['processos'] <= 1:
+            _processo(parar, options['intervalo'], options['ate_esvaziar'])
+            return
+        # Cada processo abre a sua própria conexão com o banco.
+        connections.close_all()
+        processos = [Process(target=_processo, args=(parar, options['intervalo'], options['ate_esvaziar']))
+                     for _ in range(options['processos'])]
+        for processo in processos:
+            processo.start()
+        signal.signal(signal.SIGTERM, lambda *args: parar.set())
+        signal.signal(signal.SIGINT, lambda *args: parar.set())
+        for processo in processos:
+            processo.join()
+        self.stdout.write('Processos de tarefas encerrados.')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-06-04 10:21
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import gestaolivre.apps.geral.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('geral', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarefa',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('tipo', models.CharField(max_length=100)),
+                ('parametros', django.contrib.postgres.fields.jsonb.JSONField(default=dict, verbose_name='parâmetros')),
+                ('situacao', models.CharField(choices=[('P', 'pendente'), ('E', 'executando'), ('C', 'concluída'), ('F', 'falhou')], default='P', max_length=1, verbose_name='situação')),
+                ('progresso', models.PositiveSmallIntegerField(default=0)),
+                ('mensagem', models.CharField(blank=True, max_length=200)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('max_tentativas', models.PositiveSmallIntegerField(default=3, verbose_name='máximo de tentativas')),
+                ('executar_apos', models.DateTimeField(default=django.utils.timezone.now, verbose_name='executar após')),
+                ('reservada_ate', models.DateTimeField(blank=True, null=True, verbose_name='reservada até')),
+                ('trabalhador', models.CharField(blank=True, max_length=100)),
+                ('resultado', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('arquivo', models.FileField(blank=True, upload_to='tarefas/%Y/%m')),
+                ('erro', models.TextField(blank=True)),
+                ('criada', models.DateTimeField(auto_now_add=True)),
+                ('iniciada', models.DateTimeField(blank=True, null=True)),
+                ('concluida', models.DateTimeField(blank=True, null=True, verbose_name='concluída')),
+                ('empresa', models.ForeignKey(default=gestaolivre.apps.geral.models.get_current_empresa_pk, on_delete=django.db.models.deletion.CASCADE, to='geral.Empresa')),
+            ],
+            options={
+                'verbose_name': 'tarefa',
+                'verbose_name_plural': 'tarefas',
+                'ordering': ('-criada',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='tarefa',
+            index_together=set([('situacao', 'executar_apos'), ('empresa', 'situacao')]),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+u"""Modelos do aplicativo de tarefas."""
+
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+from django.utils import timezone
+
+from gestaolivre.apps.geral.models import EmpresaModel
+
+
+class Tarefa(EmpresaModel):
+    u"""Tarefa demorada executada em segundo plano por ``executar_tarefas``.
+
+    A tarefa é reservada por um processo por um tempo limitado, renovado a cada
+    atualização do progresso; se o processo morrer, a reserva expira e a tarefa volta a
+    ser executada.
+    """
+
+    PENDENTE = 'P'
+    EXECUTANDO = 'E'
+    CONCLUIDA = 'C'
+    FALHOU = 'F'
+    SITUACAO_CHOICES = (
+        (PENDENTE, 'pendente'),
+        (EXECUTANDO, 'executando'),
+        (CONCLUIDA, 'concluída'),
+        (FALHOU, 'falhou'),
+    )
+
+    tipo = models.CharField(max_length=100)
+    parametros = JSONField(default=dict, verbose_name='parâmetros')
+    situacao = models.CharField(max_length=1, choices=SITUACAO_CHOICES, default=PENDENTE, verbose_name='situação')
+    progresso = models.PositiveSmallIntegerField(default=0)
+    mensagem = models.CharField(max_length=200, blank=True)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    max_tentativas = models.PositiveSmallIntegerField(default=3, verbose_name='máximo de tentativas')
+    executar_apos = models.DateTimeField(default=timezone.now, verbose_name='executar após')
+    reservada_ate = models.DateTimeField(null=True, blank=True, verbose_name='reservada até')
+    trabalhador = models.CharField(max_length=100, blank=True)
+    resultado = JSONField(null=True, blank=True)
+    arquivo = models.FileField(upload_to='tarefas/%Y/%m', blank=True)
+    erro = models.TextField(blank=True)
+    criada = models.DateTimeField(auto_now_add=True)
+    iniciada = models.DateTimeField(null=True, blank=True)
+    concluida = models.DateTimeField(null=True, blank=True, verbose_name='concluída')
+
+    class Meta(object):
+        verbose_name = 'tarefa'
+        verbose_name_plural = 'tarefas'
+        ordering = ('-criada',)
+        index_together = (('situacao', 'executar_apos'), ('empresa', 'situacao'))
+
+    def __str__(self):
+        u"""String que representa este objeto."""
+        return '{0} ({1})'.format(self.tipo, self.get_situacao_display())
+
+    @property
+    def finalizada(self):
+        u"""Indica se a tarefa terminou, com ou sem sucesso."""
+        return self.situacao in (self.CONCLUIDA, self.FALHOU)
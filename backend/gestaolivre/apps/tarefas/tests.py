@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+u"""Testes da fila de tarefas."""
+
+from datetime import timedelta
+
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from gestaolivre.apps.geral.models import Empresa
+
+from .execucao import TarefaError
+from .execucao import executar
+from .execucao import registrar
+from .execucao import renovar
+from .execucao import reservar
+from .models import Tarefa
+
+
+@registrar('tarefas.teste')
+def _teste(contexto, falha=None):
+    if falha == 'definitiva':
+        raise TarefaError('Falha definitiva.')
+    if falha:
+        raise ValueError('Falha temporária.')
+    contexto.progresso(1, 2)
+    return {'ok': True}
+
+
+class FilaTest(TransactionTestCase):
+    u"""Reserva das tarefas pelos processos."""
+
+    def setUp(self):
+        u"""Cria duas empresas, a primeira com duas tarefas e a segunda com uma."""
+        self.primeira = Empresa.objects.create(cnpj='11222333000181', razao_social='Primeira',
+                                               nome_fantasia='Primeira')
+        self.segunda = Empresa.objects.create(cnpj='11444777000161', razao_social='Segunda', nome_fantasia='Segunda')
+        agora = timezone.now()
+        self.tarefas = [self._criar(empresa, agora - timedelta(minutes=minutos))
+                        for empresa, minutos in ((self.primeira, 3), (self.primeira, 2), (self.segunda, 1))]
+
+    def _criar(self, empresa, executar_apos, **parametros):
+        return Tarefa.objects.create(empresa=empresa, tipo='tarefas.teste', parametros=parametros,
+                                     executar_apos=executar_apos)
+
+    def test_limite_empresa(self):
+        u"""A empresa com o limite de tarefas em execução é ignorada até uma delas terminar."""
+        primeira = reservar('um', limite=1)
+        self.assertEqual((primeira.pk, primeira.situacao, primeira.trabalhador, primeira.tentativas),
+                         (self.tarefas[0].pk, Tarefa.EXECUTANDO, 'um', 1))
+        self.assertEqual(reservar('dois', limite=1).pk, self.tarefas[2].pk)
+        self.assertIsNone(reservar('tres', limite=1))
+        executar(primeira)
+        self.assertEqual(reservar('tres', limite=1).pk, self.tarefas[1].pk)
+
+    def test_reserva_expirada(self):
+        u"""A tarefa com a reserva vencida é reservada por outro processo, que passa a ser o dono."""
+        antiga = reservar('um', limite=1)
+        self.assertTrue(renovar(antiga))
+        Tarefa.objects.all_empresas().filter(pk=antiga.pk).update(
+            reservada_ate=timezone.now() - timedelta(minutes=1))
+        nova = reservar('dois', limite=1)
+        self.assertEqual((nova.pk, nova.tentativas), (antiga.pk, 2))
+        self.assertFalse(renovar(antiga))
+        self.assertTrue(renovar(nova))
+        executar(antiga)
+        tarefa = Tarefa.objects.all_empresas().get(pk=antiga.pk)
+        self.assertEqual((tarefa.situacao, tarefa.trabalhador), (Tarefa.EXECUTANDO, 'dois'))
+
+    def test_resultados(self):
+        u"""Conclusão, nova tentativa após erro e falha definitiva."""
+        Tarefa.objects.all_empresas().delete()
+        passado = timezone.now() - timedelta(minutes=1)
+        concluida = self._criar(self.primeira, passado)
+        temporaria = self._criar(self.segunda, passado + timedelta(seconds=1), falha='temporaria')
+        definitiva = self._criar(self.segunda, passado + timedelta(seconds=2), falha='definitiva')
+        for tarefa in (concluida, temporaria, definitiva):
+            reservada = reservar('um', limite=1)
+            self.assertEqual(reservada.pk, tarefa.pk)
+            executar(reservada)
+        situacoes = dict(Tarefa.objects.all_empresas().values_list('pk', 'situacao'))
+        self.assertEqual(situacoes, {concluida.pk: Tarefa.CONCLUIDA, temporaria.pk: Tarefa.PENDENTE,
+                                     definitiva.pk: Tarefa.FALHOU})
+        concluida = Tarefa.objects.all_empresas().get(pk=concluida.pk)
+        self.assertEqual((concluida.resultado, concluida.progresso), ({'ok': True}, 100))
+        self.assertGreater(Tarefa.objects.all_empresas().get(pk=temporaria.pk).executar_apos, timezone.now())
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+u"""Configurações de URL do aplicativo de tarefas."""
+
+from django.conf.urls import url
+
+from . import views
+
+
+app_name = 'tarefas'
+
+urlpatterns = [
+    url(r'^$', views.tarefa_lista, name='tarefa_lista'),
+    url(r'^(?P<pk>[0-9a-f-]+)$', views.tarefa_detalhe, name='tarefa_detalhe'),
+    url(r'^(?P<pk>[0-9a-f-]+)/arquivo$', views.tarefa_arquivo, name='tarefa_arquivo'),
+]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+u"""Views do aplicativo de tarefas."""
+
+from django.core.urlresolvers import reverse
+from django.http import FileResponse
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.response import Response
+
+from gestaolivre.apps.geral.models import get_current_empresa_pk
+
+from .models import Tarefa
+
+
+MAX_TAREFAS = 50
+
+
+def representar(request, tarefa):
+    u"""Representa a tarefa em tipos serializáveis."""
+    return {
+        'id': tarefa.pk,
+        'tipo': tarefa.tipo,
+        'situacao': tarefa.situacao,
+        'progresso': tarefa.progresso,
+        'mensagem': tarefa.mensagem,
+        'tentativas': tarefa.tentativas,
+        'resultado': tarefa.resultado,
+        'erro': tarefa.erro.strip().splitlines()[-1] if tarefa.erro else '',
+        'arquivo': request.build_absolute_uri(reverse('tarefas:tarefa_arquivo', kwargs={'pk': tarefa.pk}))
+        if tarefa.arquivo else None,
+        'criada': tarefa.criada,
+        'iniciada': tarefa.iniciada,
+        'concluida': tarefa.concluida,
+    }
+
+
+def resposta_tarefa(request, tarefa):
+    u"""Resposta ``202 Accepted`` de uma view que enfileirou a tarefa, com o endereço para acompanhá-la."""
+    url = request.build_absolute_uri(reverse('tarefas:tarefa_detalhe', kwargs={'pk': tarefa.pk}))
+    return Response(representar(request, tarefa), status=status.HTTP_202_ACCEPTED, headers={'Location': url})
+
+
+@api_view(['GET'])
+def tarefa_lista(request):
+    u"""Tarefas mais recentes da empresa, opcionalmente filtradas pela ``situacao``."""
+    empresa_pk = get_current_empresa_pk(request)
+    if empresa_pk is None:
+        raise PermissionDenied('Nenhuma empresa selecionada.')
+    tarefas = Tarefa.objects.filter(empresa_id=empresa_pk)
+    if request.query_params.get('situacao'):
+        tarefas = tarefas.filter(situacao=request.query_params['situacao'])
+    return Response([representar(request, tarefa) for tarefa in tarefas[:MAX_TAREFAS]])
+
+
+@api_view(['GET'])
+def tarefa_detalhe(request, pk):
+    u"""Situação e progresso da tarefa."""
+    tarefa = get_object_or_404(Tarefa, pk=pk, empresa_id=get_current_empresa_pk(request))
+    return Response(representar(request, tarefa))
+
+
+@api_view(['GET'])
+def tarefa_arquivo(request, pk):
+    u"""Arquivo de resultado da tarefa concluída."""
+    tarefa = get_object_or_404(Tarefa, pk=pk, empresa_id=get_current_empresa_pk(request))
+    if not tarefa.arquivo:
+        raise Http404('A tarefa não tem arquivo de resultado.')
+    response = FileResponse(tarefa.arquivo.open('rb'))
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(tarefa.arquivo.name.rsplit('/', 1)[-1])
+    return response
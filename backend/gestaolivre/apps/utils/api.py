@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+u"""Respostas condicionais e seleção de campos para a API REST.
+
+Cada recurso da API tem um contador de versão (:class:`Versao`) por empresa, incrementado
+sempre que um objeto do recurso é gravado ou excluído (:func:`invalidate_resource`). O
+``ETag`` e o ``Last-Modified`` das respostas derivam desse contador, portanto um
+``If-None-Match`` ou ``If-Modified-Since`` atual é respondido com 304 sem consultar os
+objetos nem serializá-los.
+"""
+
+import hashlib
+import math
+import time
+from urllib.parse import quote
+
+from django.utils.http import http_date
+from django.utils.http import parse_http_date_safe
+from django.utils.http import quote_etag
+
+from rest_framework import serializers
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+
+from gestaolivre.apps.geral.models import get_current_empresa_pk
+
+from .models import Versao
+
+
+def resource_key(resource, empresa_id=None):
+    u"""Chave da :class:`Versao` do recurso da empresa, ou do recurso sem empresa."""
+    return 'api:{0}:{1}'.format(resource, empresa_id or '-')
+
+
+def invalidate_resource(resource, empresa_id=None):
+    u"""Incrementa a versão do recurso, invalidando os ``ETag`` já entregues."""
+    Versao.incrementar(resource_key(resource, empresa_id))
+
+
+def _last_modified(modified):
+    u"""Segundo informado no ``Last-Modified``, ou ``None`` se ainda não puder ser informado.
+
+    O cabeçalho tem resolução de segundos, portanto é o segundo seguinte à alteração, e
+    só é informado depois que esse segundo passar: uma alteração posterior à resposta tem
+    então uma data maior que a informada. Até lá a resposta leva apenas o ``ETag``.
+    """
+    if modified is None:
+        return None
+    second = math.ceil(modified.timestamp())
+    return second if second <= time.time() else None
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    # Compara com a data completa: truncada ao segundo, uma alteração no mesmo segundo da
+    # data enviada pelo cliente passaria despercebida.
+    return since is not None and modified is not None and modified.timestamp() <= since
+
+
+def conditional_response(request, key, build):
+    u"""Responde ao request com ``build()`` ou com 304, conforme a versão da chave.
+
+    O ``ETag`` combina a versão com o caminho completo do request, que inclui a página e
+    os campos pedidos. ``build`` só é chamado se o cliente não tiver a versão atual.
+    """
+    numero, alterada = Versao.estado(key)
+    digest = hashlib.sha1('{0}:{1}:{2}'.format(key, numero, request.get_full_path()).encode('utf-8'))
+    etag = quote_etag(digest.hexdigest())
+    if _not_modified(request, etag, alterada):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+    response['ETag'] = etag
+    second = _last_modified(alterada)
+    if second is not None:
+        response['Last-Modified'] = http_date(second)
+    if not response.has_header('Cache-Control'):
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class ConditionalMixin(object):
+    u"""Respostas condicionais para as leituras de um ``ViewSet``.
+
+    ``resource`` identifica o recurso; com ``per_empresa``, a versão é a da empresa
+    selecionada no request. Os modelos do recurso devem chamar :func:`invalidate_resource`
+    ao serem gravados ou excluídos; alterações com ``QuerySet.update`` também devem.
+    """
+
+    resource = None
+    per_empresa = True
+
+    def resource_key(self):
+        u"""Chave da versão do recurso para o request atual."""
+        return resource_key(self.resource, get_current_empresa_pk(self.request) if self.per_empresa else None)
+
+    def list(self, request, *args, **kwargs):
+        u"""Lista os objetos, ou responde 304 se o cliente já tiver a versão atual."""
+        parent = super(ConditionalMixin, self).list
+        return conditional_response(request, self.resource_key(), lambda: parent(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        u"""Obtém o objeto, ou responde 304 se o cliente já tiver a versão atual."""
+        parent = super(ConditionalMixin, self).retrieve
+        return conditional_response(request, self.resource_key(), lambda: parent(request, *args, **kwargs))
+
+
+class SparseFieldsMixin(object):
+    u"""Serializador que devolve apenas os campos pedidos em ``?fields=a,b``.
+
+    Nomes desconhecidos são ignorados; sem o parâmetro, todos os campos são devolvidos.
+    """
+
+    def __init__(self, *args, **kwargs):
+        u"""Inicializa o serializador, removendo os campos não pedidos."""
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = getattr(request, 'query_params', {}).get('fields') if request is not None else None
+        if requested:
+            names = {name.strip() for name in requested.split(',')}
+            for name in set(self.fields) - names:
+                self.fields.pop(name)
+
+
+class UrlTemplate(object):
+    u"""URLs de uma rota montadas a partir de um único ``reverse()``.
+
+    A rota é revertida uma vez com um marcador no lugar do argumento, e cada URL é obtida
+    substituindo o marcador pelo valor. O marcador deve ser aceito pela expressão regular
+    do argumento na rota.
+    """
+
+    MARKER = '7319024586'
+
+    def __init__(self, view_name, lookup_url_kwarg, request=None, marker=MARKER):
+        u"""Reverte a rota com o marcador no argumento ``lookup_url_kwarg``."""
+        url = reverse(view_name, kwargs={lookup_url_kwarg: marker}, request=request)
+        self.prefix, _, self.suffix = url.rpartition(marker)
+
+    def format(self, value):
+        u"""URL da rota para o valor do argumento."""
+        return '{0}{1}{2}'.format(self.prefix, quote(str(value), safe=''), self.suffix)
+
+
+class TemplatedHyperlinkField(serializers.Field):
+    u"""Link somente leitura para o objeto, montado com um :class:`UrlTemplate`.
+
+    O ``reverse()`` é feito no primeiro objeto; como o serializador de uma lista é
+    compartilhado por todos os itens, os demais apenas formatam o valor de ``lookup_field``.
+    """
+
+    def __init__(self, view_name, lookup_field='pk', lookup_url_kwarg=None, marker=UrlTemplate.MARKER, **kwargs):
+        u"""Inicializa o campo para a rota ``view_name``."""
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super(TemplatedHyperlinkField, self).__init__(**kwargs)
+        self.view_name = view_name
+        self.lookup_field = lookup_field
+        self.lookup_url_kwarg = lookup_url_kwarg or lookup_field
+        self.marker = marker
+        self._template = None
+
+    def to_representation(self, obj):
+        u"""URL do objeto."""
+        if self._template is None:
+            self._template = UrlTemplate(self.view_name, self.lookup_url_kwarg, self.context.get('request'),
+                                         self.marker)
+        return self._template.format(getattr(obj, self.lookup_field))
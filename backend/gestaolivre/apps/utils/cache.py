@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+u"""Cache local ao processo, invalidado por versões compartilhadas."""
+
+import time
+from collections import OrderedDict
+from threading import RLock
+
+from .models import Versao
+
+
+class VersionedCache(object):
+    u"""Cache local ao processo de valores montados a partir do banco de dados.
+
+    Cada valor guarda a versão do recurso (:class:`Versao`) com que foi montado. A versão
+    é conferida no banco no máximo a cada ``ttl`` segundos, então alterações feitas por
+    outros processos são percebidas nesse intervalo; no processo que fez a alteração,
+    :meth:`invalidate` descarta o valor imediatamente. O cache guarda no máximo
+    ``maxsize`` chaves, descartando as usadas há mais tempo.
+    """
+
+    def __init__(self, namespace, builder, ttl=5, maxsize=1024):
+        u"""Inicializa o cache; ``builder(key)`` monta o valor de uma chave."""
+        self.namespace = namespace
+        self.builder = builder
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def version_key(self, key):
+        u"""Chave da :class:`Versao` correspondente a ``key``."""
+        return '{0}:{1}'.format(self.namespace, key)
+
+    def get(self, key, verify=False):
+        u"""Obtém o valor da chave, montando-o novamente se estiver desatualizado.
+
+        Com ``verify``, a versão é conferida no banco mesmo dentro do intervalo ``ttl``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if not verify and now - entry[1] < self.ttl:
+                    return entry[2]
+        version = Versao.atual(self.version_key(key))
+        if entry is not None and entry[0] == version:
+            entry[1] = now
+            return entry[2]
+        value = self.builder(key)
+        with self._lock:
+            self._entries[key] = [version, now, value]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def is_fresh(self, key):
+        u"""Confere no banco se o valor guardado para a chave ainda é o atual."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and entry[0] == Versao.atual(self.version_key(key))
+
+    def invalidate(self, key):
+        u"""Descarta o valor da chave neste processo e incrementa a sua versão."""
+        with self._lock:
+            self._entries.pop(key, None)
+        Versao.incrementar(self.version_key(key))
+
+    def clear(self):
+        u"""Descarta todos os valores deste processo."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+u"""Utilitários de acesso ao banco de dados."""
+
+import uuid
+
+from django.db import connection
+from django.db import transaction
+
+
+ITERSIZE = 2000
+
+
+def server_side_rows(sql, params=None, itersize=ITERSIZE):
+    u"""Gera as linhas da consulta através de um cursor do servidor.
+
+    As linhas são buscadas no PostgreSQL em blocos de ``itersize``, de modo que
+    consultas com milhões de linhas são percorridas com memória constante. A consulta
+    roda em uma transação, aberta aqui se ainda não houver uma.
+    """
+    with transaction.atomic():
+        connection.ensure_connection()
+        with connection.connection.cursor(name='ss_{0}'.format(uuid.uuid4().hex)) as cursor:
+            cursor.itersize = itersize
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield row
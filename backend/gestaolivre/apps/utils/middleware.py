@@ -6,6 +6,11 @@ from threading import local
 _locals = local()
 
 
+def _clear():
+    if hasattr(_locals, 'request'):
+        del _locals.request
+
+
 class GlobalRequestMiddleware(object):
     u"""Middleware pare obter o request atual em qualquer função."""
 
@@ -16,6 +21,19 @@ class GlobalRequestMiddleware(object):
         """
         _locals.request = request
 
+    def process_response(self, request, response):
+        u"""Descarta o request da thread ao fim do processamento.
+
+        Sem isso o request, e com ele a empresa selecionada, continuaria valendo para o
+        próximo código executado na mesma thread.
+        """
+        _clear()
+        return response
+
+    def process_exception(self, request, exception):
+        u"""Descarta o request da thread quando a view levanta uma exceção."""
+        _clear()
+
     @staticmethod
     def get_current_request():
         u"""Obtém o request da thread atual."""
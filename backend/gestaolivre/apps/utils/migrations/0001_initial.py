@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2016-04-16 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Versao',
+            fields=[
+                ('chave', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('numero', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'versão',
+                'verbose_name_plural': 'versões',
+            },
+        ),
+    ]
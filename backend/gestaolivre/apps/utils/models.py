@@ -1,2 +1,50 @@
 # -*- coding: utf-8 -*-
 u"""Utilitários para o Gestão Livre."""
+
+from django.db import IntegrityError
+from django.db import models
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+class Versao(models.Model):
+    u"""Contador de versão de um recurso, compartilhado por todos os processos.
+
+    Os caches locais de cada processo guardam a versão com que montaram seus valores e a
+    comparam com este contador para saber se outro processo alterou o recurso.
+    """
+
+    chave = models.CharField(max_length=200, primary_key=True)
+    numero = models.BigIntegerField(default=0)
+    alterada = models.DateTimeField(null=True)
+
+    class Meta(object):
+        verbose_name = 'versão'
+        verbose_name_plural = 'versões'
+
+    def __str__(self):
+        u"""String que representa este objeto."""
+        return '{0}: {1}'.format(self.chave, self.numero)
+
+    @classmethod
+    def atual(cls, chave):
+        u"""Obtém a versão atual do recurso."""
+        return cls.objects.filter(chave=chave).values_list('numero', flat=True).first() or 0
+
+    @classmethod
+    def estado(cls, chave):
+        u"""Obtém a versão atual do recurso e a data da sua última alteração."""
+        return cls.objects.filter(chave=chave).values_list('numero', 'alterada').first() or (0, None)
+
+    @classmethod
+    def incrementar(cls, chave):
+        u"""Incrementa a versão do recurso, criando o contador se necessário."""
+        agora = timezone.now()
+        if cls.objects.filter(chave=chave).update(numero=F('numero') + 1, alterada=agora):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(chave=chave, numero=1, alterada=agora)
+        except IntegrityError:
+            cls.objects.filter(chave=chave).update(numero=F('numero') + 1, alterada=agora)
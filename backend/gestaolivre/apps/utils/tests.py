@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+u"""Testes dos utilitários."""
+
+import uuid
+from datetime import datetime
+from datetime import timedelta
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .api import SparseFieldsMixin
+from .api import conditional_response
+from .api import invalidate_resource
+from .api import resource_key
+from .middleware import GlobalRequestMiddleware
+from .models import Versao
+
+
+class GlobalRequestMiddlewareTest(SimpleTestCase):
+    u"""Request da thread atual."""
+
+    def test_request_is_cleared(self):
+        u"""O request deixa de valer ao fim da resposta ou de uma exceção."""
+        middleware = GlobalRequestMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.assertIs(GlobalRequestMiddleware.get_current_request(), request)
+        middleware.process_response(request, HttpResponse())
+        self.assertIsNone(GlobalRequestMiddleware.get_current_request())
+        middleware.process_request(request)
+        middleware.process_exception(request, ValueError())
+        self.assertIsNone(GlobalRequestMiddleware.get_current_request())
+        middleware.process_response(request, HttpResponse())
+
+
+class ConditionalResponseTest(TestCase):
+    u"""Respostas 304 pela versão do recurso."""
+
+    def setUp(self):
+        u"""Cria a versão do recurso."""
+        self.empresa_id = uuid.uuid4()
+        self.key = resource_key('teste', self.empresa_id)
+        invalidate_resource('teste', self.empresa_id)
+        self.factory = RequestFactory()
+
+    def _get(self, path='/recurso/?page=2', **headers):
+        return conditional_response(self.factory.get(path, **headers), self.key, lambda: Response({'ok': True}))
+
+    def _modified(self, value):
+        Versao.objects.filter(chave=self.key).update(alterada=value)
+
+    def test_etag(self):
+        u"""O ``ETag`` muda com a versão e com o caminho pedido."""
+        etag = self._get()['ETag']
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH='W/' + etag).status_code, 304)
+        self.assertNotEqual(self._get('/recurso/?page=3')['ETag'], etag)
+        invalidate_resource('teste', self.empresa_id)
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        u"""Uma alteração no mesmo segundo da data enviada pelo cliente não é respondida com 304."""
+        self._modified(datetime(2016, 1, 1, 12, 0, 0, 500000, tzinfo=timezone.utc))
+        last_modified = self._get()['Last-Modified']
+        self.assertEqual(last_modified, 'Fri, 01 Jan 2016 12:00:01 GMT')
+        self.assertEqual(self._get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self._modified(datetime(2016, 1, 1, 12, 0, 1, 300000, tzinfo=timezone.utc))
+        self.assertEqual(self._get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_recent_change(self):
+        u"""Enquanto o segundo da alteração não termina, a resposta leva apenas o ``ETag``."""
+        self._modified(timezone.now() + timedelta(seconds=5))
+        response = self._get()
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+class SparseSerializer(SparseFieldsMixin, serializers.Serializer):
+    u"""Serializador de teste com dois campos."""
+
+    a = serializers.IntegerField()
+    b = serializers.IntegerField()
+
+
+class SparseFieldsMixinTest(SimpleTestCase):
+    u"""Seleção dos campos pelo parâmetro ``fields``."""
+
+    def _data(self, path):
+        request = Request(RequestFactory().get(path))
+        return dict(SparseSerializer({'a': 1, 'b': 2}, context={'request': request}).data)
+
+    def test_fields(self):
+        u"""Somente os campos pedidos são devolvidos; nomes desconhecidos são ignorados."""
+        self.assertEqual(self._data('/?fields=a'), {'a': 1})
+        self.assertEqual(self._data('/?fields=b,x'), {'b': 2})
+        self.assertEqual(self._data('/'), {'a': 1, 'b': 2})
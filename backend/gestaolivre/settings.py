@@ -17,14 +17,29 @@ SITE_NAME = basename(DJANGO_ROOT)
 
 
 def jwt_response_payload_handler(token, user=None, request=None):
-    u"""Função exemplo para adicionar payload ao token."""
-    print(token)
+    u"""Resposta da obtenção do token, com os CNPJs das empresas já incluídas no token."""
+    from rest_framework_jwt.settings import api_settings
+    payload = api_settings.JWT_DECODE_HANDLER(token)
     return {
         'token': token,
-        'empresas': [empresa.cnpj.format('r') for empresa in user.empresa.all()]
+        'empresas': [cnpj for cnpj, _ in payload.get('empresas', ())]
     }
 
 
+def custom_jwt_payload_handler(user):
+    u"""Inclui no token as empresas do usuário, como pares ``[cnpj, id]``.
+
+    Com elas a empresa selecionada em cada request é resolvida sem consultas ao banco. As
+    empresas vêm do cache de autenticação, que é atualizado quando elas mudam.
+    """
+    from rest_framework_jwt.utils import jwt_payload_handler
+    from gestaolivre.apps.geral.authentication import usuario_cacheado
+    payload = jwt_payload_handler(user)
+    cached = usuario_cacheado(user.pk)
+    payload['empresas'] = cached[1] if cached else []
+    return payload
+
+
 def custom_jwt_encode_handler(payload):
     from rest_framework_jwt.utils import jwt_encode_handler
     payload['user_id'] = str(payload['user_id'])
@@ -119,6 +134,8 @@ class Base(Configuration):
         'brazil_fields',
 
         'gestaolivre.apps.geral',
+        'gestaolivre.apps.contabil',
+        'gestaolivre.apps.tarefas',
         'gestaolivre.apps.utils',
     )
     LOGIN_REDIRECT_URL = '/'
@@ -132,7 +149,7 @@ class Base(Configuration):
             'rest_framework.permissions.IsAuthenticated',
         ),
         'DEFAULT_AUTHENTICATION_CLASSES': (
-            'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+            'gestaolivre.apps.geral.authentication.CachedJSONWebTokenAuthentication',
         ),
     })
     CORS_ORIGIN_ALLOW_ALL = values.Value(True)
@@ -144,10 +161,26 @@ class Base(Configuration):
         'JWT_AUTH_HEADER_PREFIX': 'Bearer',
         'JWT_RESPONSE_PAYLOAD_HANDLER': jwt_response_payload_handler,
         'JWT_ENCODE_HANDLER': custom_jwt_encode_handler,
+        'JWT_PAYLOAD_HANDLER': custom_jwt_payload_handler,
         # 'JWT_DECODE_HANDLER': jwt_decode_handler,
     })
     AUTH_USER_MODEL = 'geral.Usuario'
     AUTHENTICATION_BACKENDS = values.ListValue(['gestaolivre.apps.geral.backends.EmailModelBackend'])
+    PASSWORD_HASHERS = values.ListValue([
+        'gestaolivre.apps.geral.hashers.ConfigurablePBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+        'django.contrib.auth.hashers.SHA1PasswordHasher',
+    ])
+    SENHA_ITERACOES = values.IntegerValue(24000)
+    LOGIN_JANELA = values.IntegerValue(300)
+    LOGIN_LIMITE_CONTA = values.IntegerValue(10)
+    LOGIN_LIMITE_IP = values.IntegerValue(100)
+    LOGIN_PROXY_CONFIAVEL = values.BooleanValue(False)
+    CONTABIL_INCREMENTAL_BALANCES = values.BooleanValue(True)
+    CONTABIL_BALANCE_DELTAS = values.BooleanValue(True)
+    TAREFAS_LIMITE_EMPRESA = values.IntegerValue(1)
 
     @classmethod
     def pre_setup(cls):
@@ -21,6 +21,8 @@ urlpatterns = [
     url(r'^admin/', admin.site.urls),
 
     url(r'^api/', include(router.urls)),
+    url(r'^api/contabil/', include('gestaolivre.apps.contabil.urls', namespace='accounting')),
+    url(r'^api/tarefas/', include('gestaolivre.apps.tarefas.urls', namespace='tarefas')),
     url(r'^api/token-auth/', obtain_jwt_token),
     url(r'^api/token-refresh/', refresh_jwt_token),
     url(r'^api/token-verify/', verify_jwt_token),